@@ -1,6 +1,8 @@
 import streamlit as st
+import streamlit.components.v1 as components
 import pandas as pd
 import edge_tts
+import aiohttp
 import asyncio
 import os
 import time
@@ -19,14 +21,91 @@ import io
 import psutil
 import gc
 import hashlib
+import sqlite3
+import threading
+import math
+import concurrent.futures
+import bisect
+import re
+import unicodedata
+import shutil
+import zipfile
+import sys
+import argparse
+import functools
+import urllib.parse
+import random
+import collections
+import itertools
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+import queue
+import scipy.signal
+import tornado.web
+import xml.etree.ElementTree as ET
 
 ## streamlit run en600_st23.py
 
 # 기본 경로 설정
 SCRIPT_DIR = Path(os.path.dirname(os.path.abspath(__file__)))
-SETTINGS_PATH = SCRIPT_DIR / 'base/en600s-settings.json'
+SETTINGS_PATH = SCRIPT_DIR / 'base/en600s-settings.json'  # 예전 형식의 설정 파일 (사용자 저장소로 옮겨 읽음)
+USER_DB_PATH = Path(os.environ.get('EN600_USER_DB', str(SCRIPT_DIR / 'base/en600-users.sqlite3')))  # 사용자별 설정/학습 기록
+DEFAULT_USER_ID = 'default'  # ?user= 없이 접속한 사용자 (예전 전역 파일을 이어받음)
+SETTINGS_SCHEMA_VERSION = 2  # 저장된 설정 형식 (바뀌면 올리고 SETTINGS_MIGRATIONS에 변환 추가)
+SETTINGS_SAVE_DEBOUNCE = 2.0  # 위젯 조작으로 바뀐 설정을 모아서 저장하는 간격(초)
 EXCEL_PATH = SCRIPT_DIR / 'base/en600new.xlsx'
 TEMP_DIR = SCRIPT_DIR / 'temp'  # 임시 파일 저장 경로 추가
+CACHE_DIR = SCRIPT_DIR / 'cache'  # 영구 캐시 저장 경로
+CORPUS_CACHE_DIR = CACHE_DIR / 'corpus'  # 엑셀 파싱 결과 캐시
+CORPUS_CACHE_VERSION = 6  # 캐시 형식이 바뀌면 올려서 기존 캐시를 무효화
+AUDIO_CACHE_DIR = CACHE_DIR / 'audio'  # 합성 음성 영구 캐시
+AUDIO_CACHE_MAX_BYTES = int(os.environ.get('EN600_AUDIO_CACHE_MB', '2048')) * 1024 * 1024  # 음성 캐시 디스크 한도
+EDGE_TTS_OUTPUT_FORMAT = 'audio-24khz-48kbitrate-mono-mp3'  # edge-tts가 돌려주는 음성 형식
+LOCAL_TTS_OUTPUT_FORMAT = 'local-formant-v1-24khz-mono-mp3'  # 로컬 합성 엔진 음성 형식
+TRIM_TOP_DB = 40  # 가장 큰 소리보다 이만큼(dB) 작은 앞뒤 구간을 무음으로 보고 잘라냄
+TRIM_PAD_SECONDS = 0.03  # 자음이 잘리지 않도록 남겨 두는 앞뒤 여유
+TARGET_LUFS = -16.0  # 음성 음량 목표 (ITU-R BS.1770 통합 음량)
+PEAK_LIMIT = 0.98  # 음량을 맞춘 뒤 허용하는 최대 진폭
+AUDIO_POSTPROCESS_TAG = f"trim{TRIM_TOP_DB}-lufs{TARGET_LUFS:g}"  # 캐시 키에 넣는 후처리 방식
+MEDIA_PORT = int(os.environ.get('EN600_MEDIA_PORT', '8502'))  # 음성 파일 전용 HTTP 서버 포트 (사용 중이면 다음 포트)
+MEDIA_ADDRESS = os.environ.get('EN600_MEDIA_ADDRESS', '127.0.0.1')  # 음성 서버가 받을 주소 (기본: 이 컴퓨터에서만, 모든 주소는 0.0.0.0)
+MEDIA_BASE_URL = os.environ.get('EN600_MEDIA_BASE_URL', '')  # 프록시/HTTPS 뒤에서 쓸 때 브라우저가 접근할 음성 서버 주소
+MEDIA_EXTENSIONS = ('mp3', 'ogg', 'opus', 'wav')  # 음성 서버가 보내는 파일 형식 (캐시 색인 등 다른 파일은 보내지 않음)
+LOOPBACK_HOSTS = ('localhost', '127.0.0.1', '::1')
+MEDIA_HOT_TIER_BYTES = int(os.environ.get('EN600_MEDIA_HOT_MB', '64')) * 1024 * 1024  # 메모리에 두는 최근 음성 용량
+PLAYBACK_EVENT_GRACE = 1.0  # 브라우저의 재생 끝 알림을 재생 시간보다 더 기다리는 여유(초)
+MIXER_PLAY_TIMEOUT_MARGIN = 5.0  # 서버 스피커 재생 완료를 재생 시간보다 더 기다리는 최대 여유(초, 디코딩 포함)
+TTS_REQUEST_TIMEOUT = float(os.environ.get('EN600_TTS_TIMEOUT', '15'))  # 음성 합성 요청 하나의 제한 시간(초)
+TTS_RETRIES = 2  # 합성 실패 시 재시도 횟수
+TTS_MAX_INFLIGHT = int(os.environ.get('EN600_TTS_MAX_INFLIGHT', '8'))  # 프로세스 전체 동시 합성 요청 수
+TTS_BREAKER_FAILURES = 5  # 연속으로 이만큼 실패하면 온라인 음성 요청을 잠시 멈춤
+TTS_BREAKER_RESET = 30.0  # 요청을 멈춘 뒤 다시 시도해 보기까지의 시간(초)
+RENDER_PROGRESS_DIR = CACHE_DIR / 'render'  # 일괄 음성 생성(render 명령) 진행 상황
+SYNTHESIS_LOCK_DIR = CACHE_DIR / 'locks'  # 같은 음성을 여러 프로세스가 동시에 합성하지 않도록 하는 잠금 파일
+SYNTHESIS_WORKER_ADDRESS = os.environ.get('EN600_SYNTH_WORKER', '')  # 합성 작업자 주소 (예: 127.0.0.1:8765, 비우면 앱 안에서 합성)
+SYNTHESIS_WORKER_PORT = 8765  # worker 명령의 기본 포트
+SYNTHESIS_WORKER_TIMEOUT = 60.0  # 합성 작업자 응답을 기다리는 최대 시간(초), 넘으면 앱 안에서 합성
+SYNTHESIS_LOCK_WAIT = TTS_REQUEST_TIMEOUT * (TTS_RETRIES + 1) + 5  # 다른 프로세스의 합성을 기다리는 최대 시간(초)
+STRETCHED_OUTPUT_FORMAT = 'stretch-24khz-mono-mp3'  # 1배속 음성을 로컬에서 배속 변환한 결과
+STRETCH_WORKERS = max(1, min(4, (os.cpu_count() or 2) - 1))  # 배속 변환 프로세스 수
+LESSON_TRACK_SAMPLE_RATE = 24000  # 레슨 트랙 샘플레이트 (edge-tts 음성과 같음)
+LESSON_TRACK_VERSION = 2  # 레슨 트랙 구성 방식이 바뀌면 올려서 기존 트랙을 무효화
+PLAYER_COMPONENT_DIR = CACHE_DIR / 'player'  # 브라우저 레슨 플레이어 컴포넌트 파일
+PLAYER_REPORT_SECONDS = 30  # 브라우저 플레이어가 진행 상황을 서버에 알리는 간격(초)
+PLAYER_LOOKAHEAD = 3  # 브라우저가 미리 받아 두는 음성 수
+# 클라이언트별 음성 전송 형식 (None: edge-tts 원본 그대로)
+AUDIO_PROFILES = {
+    'desktop': None,
+    # 모바일: Ogg Opus 약 20kbps (원본 MP3 48kbps의 절반 이하)
+    'mobile': {'format': 'OGG', 'subtype': 'OPUS', 'compression_level': 0.95, 'extension': 'ogg'},
+    # iOS Safari는 Ogg 재생이 불안정하므로 저비트레이트 MP3
+    'mobile-mp3': {'format': 'MP3', 'subtype': None, 'compression_level': 0.9, 'extension': 'mp3'}
+}
+AUDIO_MIME_TYPES = {'.mp3': 'audio/mpeg', '.ogg': 'audio/ogg', '.opus': 'audio/ogg', '.wav': 'audio/wav'}
+BREAK_MESSAGE = "쉬어가는 시간입니다, 5초간의 호흡을 느껴보세요"
 
 # base 폴더가 없으면 생성
 if not (SCRIPT_DIR / 'base').exists():
@@ -153,6 +232,48 @@ LANGUAGE_MAPPING = {
     'km': {'code': 'km-KH', 'name': '캄보디아'}
 }
 
+# 언어 이름 -> 엑셀 열 머리글의 언어 코드
+LANGUAGE_CODES = {
+    'english': 'en',
+    'korean': 'ko',
+    'chinese': 'zh',
+    'japanese': 'ja',
+    'vietnamese': 'vi',
+    'filipino': 'tl',
+    'thai': 'th',
+    'russian': 'ru',
+    'uzbek': 'uz',
+    'mongolian': 'mn',
+    'nepali': 'ne',
+    'burmese': 'my',
+    'indonesian': 'id',
+    'khmer': 'km'
+}
+
+# 머리글이 없는 시트에서 열 내용의 문자 체계로 언어 추정 (검사 순서가 중요: 일본어는 한자를 포함)
+SCRIPT_DETECTION = [
+    ('korean', re.compile('[\uac00-\ud7a3]'), 0.5),
+    ('japanese', re.compile('[\u3040-\u30ff]'), 0.5),
+    ('chinese', re.compile('[\u4e00-\u9fff]'), 0.5),
+    ('thai', re.compile('[\u0e00-\u0e7f]'), 0.5),
+    ('khmer', re.compile('[\u1780-\u17ff]'), 0.5),
+    ('burmese', re.compile('[\u1000-\u109f]'), 0.5),
+    ('nepali', re.compile('[\u0900-\u097f]'), 0.5),
+    ('mongolian', re.compile('[ӨөҮү]'), 0.3),
+    ('russian', re.compile('[\u0400-\u04ff]'), 0.5),
+    ('vietnamese', re.compile('[ăâđêôơưạảấầẩẫậắằẳẵặẹẻẽếềểễệỉịọỏốồổỗộớờởỡợụủứừửữựỳỵỷỹ]', re.IGNORECASE), 0.5),
+    ('english', re.compile('^[\x00-\x7f]+$'), 0.9),
+]
+
+class MissingLanguageColumnError(LookupError):
+    """시트에서 언어 열을 찾을 수 없을 때 발생"""
+
+class SynthesisError(RuntimeError):
+    """음성 합성 엔진이 음성을 만들지 못했을 때 발생"""
+
+class CircuitOpenError(SynthesisError):
+    """연속 실패로 음성 엔진 요청이 잠시 차단된 상태일 때 발생"""
+
 def format_column_header(lang_code):
     """
     언어 코드를 기반으로 '[코드]-[국가명]' 형식의 컬럼 헤더를 반환합니다.
@@ -161,47 +282,993 @@ def format_column_header(lang_code):
         return f"{lang_code}-{LANGUAGE_MAPPING[lang_code]['name']}"
     return lang_code
 
+def _language_from_header(header):
+    """열 머리글('en-미국', '영어', 'english' 등)에서 언어 이름 찾기"""
+    header = str(header).strip()
+    lowered = header.lower()
+    code_to_lang = {code: lang for lang, code in LANGUAGE_CODES.items()}
+
+    # 1) 'en-미국'처럼 언어 코드로 시작하는 머리글
+    match = re.match(r'^([a-z]{2,3})(?:$|[-_ (])', lowered)
+    if match and match.group(1) in code_to_lang:
+        return code_to_lang[match.group(1)]
+
+    # 2) 짧은 머리글에 언어/국가 이름이 들어 있는 경우 (문장이 머리글로 쓰인 시트는 제외)
+    if len(header) <= 15:
+        for lang, code in LANGUAGE_CODES.items():
+            names = [lang, LANG_DISPLAY.get(lang, ''), LANGUAGE_MAPPING.get(code, {}).get('name', '')]
+            if any(name and name in lowered for name in names):
+                return lang
+    return None
+
+def _detect_column_language(texts):
+    """열 내용의 문자 체계로 언어 추정 (판단할 수 없으면 None)"""
+    sample = [text for text in texts[:200] if text]
+    if not sample:
+        return None
+    for lang, pattern, threshold in SCRIPT_DETECTION:
+        if sum(1 for text in sample if pattern.search(text)) / len(sample) >= threshold:
+            return lang
+    return None
+
+def build_column_index(columns, column_texts=None):
+    """
+    LANGUAGES의 모든 언어를 열 위치로 변환한 인덱스 생성 (없으면 None).
+    머리글로 먼저 찾고, 머리글로 찾지 못한 열은 column_texts(열 이름 -> 문장 목록)의 내용으로 추정한다.
+    """
+    index = {lang: None for lang in LANGUAGES if lang != 'none'}
+    unresolved = []
+    for position, col in enumerate(columns):
+        lang = _language_from_header(col)
+        if lang is not None and index[lang] is None:
+            index[lang] = position
+        else:
+            unresolved.append(position)
+
+    if column_texts is not None:
+        for position in unresolved:
+            texts = column_texts.get(columns[position])
+            lang = _detect_column_language(list(texts)) if texts is not None else None
+            if lang is not None and index[lang] is None:
+                index[lang] = position
+    return index
+
+def process_resource(func):
+    """
+    st.cache_resource처럼 프로세스에 하나만 만드는 자원.
+    Streamlit 밖(render, worker 명령)에서는 st.cache_resource가 캐시하지 않으므로 직접 하나만 만들어 둔다.
+    """
+    cached = st.cache_resource(show_spinner=False)(func)
+    instance = []
+    lock = threading.Lock()
+
+    @functools.wraps(func)
+    def wrapper():
+        if st.runtime.exists():
+            return cached()
+        with lock:
+            if not instance:
+                instance.append(func())
+            return instance[0]
+
+    wrapper.clear = cached.clear
+    return wrapper
+
+def atomic_write_bytes(path, data):
+    """임시 파일에 쓴 뒤 이름을 바꿔 원자적으로 저장"""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f".{path.name}.{os.getpid()}.{time.time_ns()}.tmp")
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    finally:
+        if tmp_path.exists():
+            tmp_path.unlink()
+
+def atomic_write_json(path, data):
+    """JSON 데이터를 원자적으로 저장"""
+    atomic_write_bytes(path, json.dumps(data, ensure_ascii=False, indent=2).encode('utf-8'))
+
+@st.cache_data(show_spinner=False)
+def _hash_workbook(path_str, size, mtime_ns):
+    """엑셀 파일 내용 해시 (크기/수정 시각이 같으면 재계산하지 않음)"""
+    digest = hashlib.sha256()
+    with open(path_str, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def get_workbook_fingerprint(path=EXCEL_PATH):
+    """엑셀 파일의 크기, 수정 시각, 내용 해시로 지문 생성"""
+    stat = Path(path).stat()
+    return {
+        'size': stat.st_size,
+        'mtime_ns': stat.st_mtime_ns,
+        'sha256': _hash_workbook(str(path), stat.st_size, stat.st_mtime_ns)
+    }
+
+def get_corpus_cache_dir(fingerprint):
+    """지문에 해당하는 코퍼스 캐시 폴더"""
+    return CORPUS_CACHE_DIR / f"v{CORPUS_CACHE_VERSION}-{fingerprint['sha256'][:16]}"
+
+def build_corpus_cache(fingerprint):
+    """엑셀 전체를 한 번만 파싱해 시트별 Parquet 파일로 저장"""
+    cache_dir = get_corpus_cache_dir(fingerprint)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+
+    # 모든 시트를 한 번의 파싱으로 읽기
+    frames = pd.read_excel(EXCEL_PATH, sheet_name=None, header=0, engine='openpyxl')
+
+    sheets = []
+    for i, (sheet_name, df) in enumerate(frames.items()):
+        # 숫자가 섞인 열도 있으므로 모든 값을 문자열로 통일 (빈 칸은 None 유지)
+        df.columns = [str(col) for col in df.columns]
+        df = df.astype(object).where(df.notna(), None)
+        df = df.apply(lambda col: col.map(lambda v: v if v is None else str(v)))
+
+        file_name = f"sheet_{i}.parquet"
+        buffer = io.BytesIO()
+        df.to_parquet(buffer, index=False)
+        atomic_write_bytes(cache_dir / file_name, buffer.getvalue())
+
+        # 문장 저장소(열별 UTF-8 블롭 + 오프셋 배열) 생성
+        store_name = f"sheet_{i}"
+        write_sentence_store(cache_dir / store_name, df)
+
+        # 언어 -> 열 위치 인덱스 (한 번만 계산해 매니페스트에 저장)
+        column_texts = {col: df[col].dropna().head(200).tolist() for col in df.columns}
+
+        sheets.append({
+            'name': sheet_name,
+            'file': file_name,
+            'store': store_name,
+            'rows': len(df),
+            'columns': df.columns.tolist(),
+            'column_index': build_column_index(df.columns.tolist(), column_texts)
+        })
+        frames[sheet_name] = df
+
+    # 전체 시트/언어 검색 색인
+    write_search_index(cache_dir / 'search_index.npz', [frames[sheet['name']] for sheet in sheets])
+
+    manifest = {
+        'version': CORPUS_CACHE_VERSION,
+        'fingerprint': fingerprint,
+        'created': time.time(),
+        'sheets': sheets
+    }
+    # 매니페스트는 마지막에 저장 (매니페스트가 있으면 캐시가 완성된 것)
+    atomic_write_json(cache_dir / 'manifest.json', manifest)
+
+    # 이전 버전의 엑셀에서 만든 캐시 정리
+    for old_dir in CORPUS_CACHE_DIR.iterdir():
+        if old_dir.is_dir() and old_dir != cache_dir:
+            shutil.rmtree(old_dir, ignore_errors=True)
+    return manifest
+
+@st.cache_resource(show_spinner=False, max_entries=4)
+def _load_corpus_manifest(sha256, size, mtime_ns):
+    """코퍼스 매니페스트 로드 (없거나 지문이 다르면 새로 생성)"""
+    fingerprint = {'size': size, 'mtime_ns': mtime_ns, 'sha256': sha256}
+    manifest_path = get_corpus_cache_dir(fingerprint) / 'manifest.json'
+    try:
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        if (manifest.get('version') == CORPUS_CACHE_VERSION
+                and manifest.get('fingerprint', {}).get('sha256') == sha256):
+            return manifest
+    except Exception:
+        pass
+    return build_corpus_cache(fingerprint)
+
+def get_corpus():
+    """현재 엑셀 파일에 해당하는 코퍼스 매니페스트 반환 (엑셀이 바뀌면 자동 재생성)"""
+    fingerprint = get_workbook_fingerprint()
+    return _load_corpus_manifest(fingerprint['sha256'], fingerprint['size'], fingerprint['mtime_ns'])
+
+def get_sheet_names():
+    """엑셀 시트 이름 목록"""
+    return [sheet['name'] for sheet in get_corpus()['sheets']]
+
+def get_sheet_info(sheet_name):
+    """시트 이름 또는 순번으로 시트 정보 찾기"""
+    sheets = get_corpus()['sheets']
+    if isinstance(sheet_name, int):
+        return sheets[sheet_name]
+    for sheet in sheets:
+        if sheet['name'] == sheet_name:
+            return sheet
+    raise KeyError(f"시트를 찾을 수 없습니다: {sheet_name}")
+
+@st.cache_resource(show_spinner=False, max_entries=16)
+def _load_sheet_frame(sha256, file_name):
+    """캐시된 Parquet 파일에서 시트 데이터 로드"""
+    cache_dir = get_corpus_cache_dir({'sha256': sha256})
+    return pd.read_parquet(cache_dir / file_name)
+
+def get_column_index(sheet_name=0):
+    """시트의 언어 -> 열 위치 인덱스"""
+    return get_sheet_info(sheet_name)['column_index']
+
+def resolve_language_column(sheet_name, lang):
+    """언어에 해당하는 열 이름 반환 (없으면 MissingLanguageColumnError)"""
+    sheet = get_sheet_info(sheet_name)
+    position = sheet['column_index'].get(lang)
+    if position is None:
+        raise MissingLanguageColumnError(
+            f"시트 '{sheet['name']}'에서 {LANG_DISPLAY.get(lang, lang)} 열을 찾을 수 없습니다."
+        )
+    return sheet['columns'][position]
+
+def read_sheet(sheet_name=0):
+    """
+    시트 데이터를 캐시에서 읽기.
+    반환된 DataFrame은 모든 세션이 공유하므로 수정하지 말 것.
+    """
+    corpus = get_corpus()
+    sheet = get_sheet_info(sheet_name)
+    return _load_sheet_frame(corpus['fingerprint']['sha256'], sheet['file'])
+
+def write_sentence_store(store_dir, df):
+    """시트의 각 열을 UTF-8 블롭 하나와 오프셋 배열로 저장"""
+    store_dir.mkdir(parents=True, exist_ok=True)
+    for j, col in enumerate(df.columns):
+        encoded = [(text or '').encode('utf-8') for text in df[col]]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum(np.fromiter(map(len, encoded), dtype=np.int64, count=len(encoded)), out=offsets[1:])
+
+        buffer = io.BytesIO()
+        np.save(buffer, offsets)
+        atomic_write_bytes(store_dir / f"col_{j}.offsets.npy", buffer.getvalue())
+        atomic_write_bytes(store_dir / f"col_{j}.blob", b''.join(encoded))
+
+class SentenceRange:
+    """저장소의 행 범위를 복사 없이 참조하는 시퀀스 (접근할 때만 디코딩)"""
+
+    def __init__(self, blob, offsets, start, stop):
+        self._blob = blob
+        self._offsets = offsets
+        self._start = start
+        self._stop = stop
+
+    def __len__(self):
+        return self._stop - self._start
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("문장 범위를 벗어났습니다.")
+        row = self._start + index
+        return self._blob[self._offsets[row]:self._offsets[row + 1]].tobytes().decode('utf-8')
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def tolist(self):
+        return list(self)
+
+class SentenceStore:
+    """
+    메모리 매핑된 읽기 전용 문장 저장소.
+    열마다 UTF-8 블롭과 int64 오프셋 배열을 가지며, 모든 세션(프로세스)이 같은 페이지 캐시를 공유한다.
+    """
+
+    def __init__(self, store_dir, columns, rows, column_index=None):
+        self.store_dir = Path(store_dir)
+        self.columns = list(columns)
+        self.rows = rows
+        self.column_index = column_index or {}
+        self._mapped = {}
+
+    def _column(self, column):
+        """열의 블롭과 오프셋을 (처음 접근할 때) 메모리 매핑"""
+        if column not in self._mapped:
+            j = self.columns.index(column)
+            blob_path = self.store_dir / f"col_{j}.blob"
+            offsets = np.load(self.store_dir / f"col_{j}.offsets.npy", mmap_mode='r')
+            if blob_path.stat().st_size > 0:
+                blob = np.memmap(blob_path, dtype=np.uint8, mode='r')
+            else:
+                blob = np.zeros(0, dtype=np.uint8)
+            self._mapped[column] = (blob, offsets)
+        return self._mapped[column]
+
+    def get_rows(self, column, start_idx, end_idx):
+        """start_idx~end_idx(포함) 행을 복사 없이 반환"""
+        blob, offsets = self._column(column)
+        start = max(0, min(start_idx, self.rows))
+        stop = max(start, min(end_idx + 1, self.rows))
+        return SentenceRange(blob, offsets, start, stop)
+
+    def language_column(self, lang):
+        """언어에 해당하는 열 이름 (없으면 MissingLanguageColumnError)"""
+        position = self.column_index.get(lang)
+        if position is None:
+            raise MissingLanguageColumnError(f"{LANG_DISPLAY.get(lang, lang)} 열을 찾을 수 없습니다.")
+        return self.columns[position]
+
+    def get_text(self, column, row):
+        """한 문장 반환"""
+        blob, offsets = self._column(column)
+        return blob[offsets[row]:offsets[row + 1]].tobytes().decode('utf-8')
+
+@st.cache_resource(show_spinner=False, max_entries=16)
+def _open_sentence_store(sha256, sheet_name):
+    """문장 저장소 열기 (프로세스 내 모든 세션이 공유)"""
+    sheet = get_sheet_info(sheet_name)
+    cache_dir = get_corpus_cache_dir({'sha256': sha256})
+    return SentenceStore(cache_dir / sheet['store'], sheet['columns'], sheet['rows'], sheet['column_index'])
+
+def get_sentence_store(sheet_name=0):
+    """선택된 시트의 문장 저장소 반환"""
+    corpus = get_corpus()
+    return _open_sentence_store(corpus['fingerprint']['sha256'], get_sheet_info(sheet_name)['name'])
+
+# 띄어쓰기로 단어를 나눌 수 없는 문자 체계 (한국어, 일본어, 중국어, 태국어, 크메르어, 미얀마어)는 글자 2-gram으로 색인
+NGRAM_CHARS = '\uac00-\ud7a3\u3040-\u30ff\u4e00-\u9fff\u0e00-\u0e7f\u1780-\u17ff\u1000-\u109f'
+SEARCH_TOKEN_PATTERN = re.compile(
+    f'([{NGRAM_CHARS}]+)|((?:(?![{NGRAM_CHARS}])[^\\W_]|[\u0900-\u097f])+)'
+)
+SEARCH_SHEET_SHIFT = 34  # 문서 번호(int64) = 시트 << 34 | 행 << 14 | 열 (엑셀 한도: 1,048,576행, 16,384열)
+SEARCH_ROW_SHIFT = 14
+SEARCH_COLUMN_MASK = (1 << SEARCH_ROW_SHIFT) - 1
+SEARCH_ROW_MASK = (1 << (SEARCH_SHEET_SHIFT - SEARCH_ROW_SHIFT)) - 1
+
+def tokenize_for_search(text):
+    """
+    검색용 토큰 분리.
+    라틴/키릴/데바나가리 문자는 소문자 단어, 띄어쓰기가 없는 문자 체계는 글자 2-gram(한 글자면 1-gram)으로 나눈다.
+    (토큰 목록, 2-gram 구간 목록) 반환
+    """
+    text = unicodedata.normalize('NFKC', str(text)).lower()
+    tokens = []
+    runs = []
+    for match in SEARCH_TOKEN_PATTERN.finditer(text):
+        run, word = match.groups()
+        if word:
+            tokens.append(word)
+        elif len(run) == 1:
+            tokens.append(run)
+            runs.append(run)
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+            runs.append(run)
+    return tokens, runs
+
+def write_search_index(path, frames):
+    """모든 시트/언어의 역색인(정렬된 토큰 + 문서 번호 목록)을 NumPy 배열로 저장"""
+    postings = {}
+    for sheet_idx, df in enumerate(frames):
+        # 범위를 넘으면 다른 문서 번호와 겹치므로 색인을 만들지 않음
+        if len(df.columns) > SEARCH_COLUMN_MASK + 1 or len(df) > SEARCH_ROW_MASK + 1:
+            raise ValueError(f"검색 색인 범위를 넘는 시트입니다: {len(df)}행 {len(df.columns)}열")
+        for col_idx, col in enumerate(df.columns):
+            base = (sheet_idx << SEARCH_SHEET_SHIFT) | col_idx
+            for row, text in enumerate(df[col]):
+                if not text:
+                    continue
+                doc = base | (row << SEARCH_ROW_SHIFT)
+                tokens, runs = tokenize_for_search(text)
+                # 구간의 마지막 글자는 2-gram의 첫 글자가 아니므로 1-gram으로도 색인 (한 글자 검색: '吗', '요')
+                tokens.extend(run[-1] for run in runs if len(run) > 1)
+                for token in set(tokens):
+                    postings.setdefault(token, []).append(doc)
+
+    tokens = sorted(postings)
+    offsets = np.zeros(len(tokens) + 1, dtype=np.int64)
+    np.cumsum([len(postings[token]) for token in tokens], out=offsets[1:])
+    docs = np.fromiter(
+        (doc for token in tokens for doc in postings[token]), dtype=np.int64, count=int(offsets[-1])
+    )
+    buffer = io.BytesIO()
+    # 토큰은 고정 폭 유니코드 배열 대신 줄바꿈으로 이은 UTF-8 바이트로 저장 (크기 절약)
+    np.savez(buffer, tokens=np.frombuffer('\n'.join(tokens).encode('utf-8'), dtype=np.uint8),
+             offsets=offsets, docs=docs)
+    atomic_write_bytes(path, buffer.getvalue())
+
+class SearchIndex:
+    """전체 시트/언어 문장 역색인 (토큰 배열이 정렬되어 있어 이진 탐색으로 조회)"""
+
+    def __init__(self, path):
+        with np.load(path) as data:
+            raw_tokens = data['tokens'].tobytes().decode('utf-8')
+            self.tokens = raw_tokens.split('\n') if raw_tokens else []
+            self.offsets = data['offsets']
+            self.docs = data['docs']
+
+    def _postings(self, token, prefix=False):
+        """토큰(또는 접두어)의 문서 번호 배열"""
+        start = bisect.bisect_left(self.tokens, token)
+        if prefix:
+            stop = bisect.bisect_left(self.tokens, token + '\U0010ffff', lo=start)
+        else:
+            stop = start + 1 if start < len(self.tokens) and self.tokens[start] == token else start
+        if stop <= start:
+            return np.zeros(0, dtype=np.int64)
+        docs = self.docs[self.offsets[start]:self.offsets[stop]]
+        return np.unique(docs) if stop - start > 1 else docs
+
+    def search(self, query):
+        """
+        모든 토큰을 포함하는 문서 번호 배열 반환.
+        마지막 단어는 입력 중일 수 있으므로 접두어로 찾는다.
+        """
+        tokens, runs = tokenize_for_search(query)
+        if not tokens:
+            return np.zeros(0, dtype=np.int64), runs
+        last_is_word = not runs or not query.rstrip().endswith(runs[-1][-1:])
+        result = None
+        for i, token in enumerate(dict.fromkeys(tokens)):
+            prefix = (last_is_word and token == tokens[-1]) or len(token) == 1
+            docs = self._postings(token, prefix=prefix)
+            result = docs if result is None else np.intersect1d(result, docs, assume_unique=True)
+            if len(result) == 0:
+                break
+        return result, runs
+
+@st.cache_resource(show_spinner=False, max_entries=2)
+def _load_search_index(sha256):
+    """검색 색인 로드 (프로세스 내 모든 세션이 공유)"""
+    return SearchIndex(get_corpus_cache_dir({'sha256': sha256}) / 'search_index.npz')
+
+def search_sentences(query, limit=50, sheet_names=None, corpus=None):
+    """
+    전체 시트/언어에서 문장 검색 (corpus를 주면 다시 찾지 않음).
+    [{'sheet': 시트 이름, 'row': 문장 번호(1부터), 'langs': 일치한 언어 목록, 'text': 일치한 문장}, ...] 반환
+    """
+    if not query or not query.strip():
+        return []
+    corpus = corpus or get_corpus()
+    index = _load_search_index(corpus['fingerprint']['sha256'])
+    docs, runs = index.search(query)
+
+    results = {}
+    stores = {}
+    sha256 = corpus['fingerprint']['sha256']
+    for doc in docs.tolist():
+        sheet = corpus['sheets'][doc >> SEARCH_SHEET_SHIFT]
+        if sheet_names is not None and sheet['name'] not in sheet_names:
+            continue
+        row = (doc >> SEARCH_ROW_SHIFT) & SEARCH_ROW_MASK
+        col = sheet['columns'][doc & SEARCH_COLUMN_MASK]
+        if sheet['name'] not in stores:
+            stores[sheet['name']] = _open_sentence_store(sha256, sheet['name'])
+        text = stores[sheet['name']].get_text(col, row)
+        if runs:
+            # 2-gram은 순서를 보장하지 않으므로 실제로 이어진 문자열인지 확인
+            normalized = unicodedata.normalize('NFKC', text).lower()
+            if not all(run in normalized for run in runs):
+                continue
+        key = (sheet['name'], row)
+        if key not in results:
+            if len(results) >= limit:
+                break
+            results[key] = {'sheet': sheet['name'], 'row': row + 1, 'langs': [], 'text': text}
+        lang = next((lang for lang, position in sheet['column_index'].items()
+                     if position == doc & SEARCH_COLUMN_MASK), None)
+        if lang:
+            results[key]['langs'].append(lang)
+    return list(results.values())
+
+XLSX_MAIN_NS = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+XLSX_REL_NS = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}'
+XLSX_PKG_REL_NS = '{http://schemas.openxmlformats.org/package/2006/relationships}'
+
+def _resolve_sheet_xml_path(archive, sheet_name):
+    """시트 이름(또는 순번)으로 xlsx 내부의 시트 XML 경로 찾기"""
+    workbook = ET.fromstring(archive.read('xl/workbook.xml'))
+    sheets = workbook.find(f'{XLSX_MAIN_NS}sheets')
+    rel_ids = [(sheet.get('name'), sheet.get(f'{XLSX_REL_NS}id')) for sheet in sheets]
+    if isinstance(sheet_name, int):
+        rel_id = rel_ids[sheet_name][1]
+    else:
+        rel_id = next((rid for name, rid in rel_ids if name == sheet_name), None)
+        if rel_id is None:
+            raise KeyError(f"시트를 찾을 수 없습니다: {sheet_name}")
+
+    rels = ET.fromstring(archive.read('xl/_rels/workbook.xml.rels'))
+    for rel in rels.iter(f'{XLSX_PKG_REL_NS}Relationship'):
+        if rel.get('Id') == rel_id:
+            target = rel.get('Target')
+            return target.lstrip('/') if target.startswith('/') else f"xl/{target}"
+    raise KeyError(f"시트 XML을 찾을 수 없습니다: {sheet_name}")
+
+def _cell_text(cell):
+    """셀 요소의 원시 값 반환 (공유 문자열이면 ('s', 인덱스))"""
+    cell_type = cell.get('t')
+    if cell_type == 'inlineStr':
+        inline = cell.find(f'{XLSX_MAIN_NS}is')
+        return ''.join(t.text or '' for t in inline.iter(f'{XLSX_MAIN_NS}t')) if inline is not None else ''
+    value = cell.find(f'{XLSX_MAIN_NS}v')
+    if value is None or value.text is None:
+        return ''
+    if cell_type == 's':
+        return ('s', int(value.text))
+    return value.text
+
+def _shared_string_text(fragment):
+    """<si> 조각에서 본문 텍스트만 추출 (윗주 rPh 제외)"""
+    si = ET.fromstring(fragment)
+    parts = []
+    for child in si:
+        tag = child.tag.rsplit('}', 1)[-1]
+        if tag == 't':
+            parts.append(child.text or '')
+        elif tag == 'r':
+            parts.extend(t.text or '' for t in child.iter() if t.tag.rsplit('}', 1)[-1] == 't')
+    return ''.join(parts)
+
+def _read_shared_strings(archive, indices):
+    """
+    공유 문자열 중 필요한 인덱스만 읽기.
+    XML 전체를 파싱하지 않고 <si> 경계만 바이트 단위로 세며, 마지막 인덱스를 지나면 압축 해제도 중단한다.
+    """
+    result = {}
+    if not indices or 'xl/sharedStrings.xml' not in archive.namelist():
+        return result
+    last_index = max(indices)
+    index = 0
+    buffer = b''
+    with archive.open('xl/sharedStrings.xml') as f:
+        for chunk in iter(lambda: f.read(256 * 1024), b''):
+            buffer += chunk
+            pos = 0
+            while True:
+                start = buffer.find(b'<si>', pos)
+                if start < 0:
+                    pos = max(pos, len(buffer) - 3)  # 청크 경계에 걸친 태그 보존
+                    break
+                end = buffer.find(b'</si>', start)
+                if end < 0:
+                    pos = start
+                    break
+                if index in indices:
+                    result[index] = _shared_string_text(buffer[start:end + 5])
+                if index >= last_index:
+                    return result
+                index += 1
+                pos = end + 5
+            buffer = buffer[pos:]
+    return result
+
+def stream_sheet_rows(sheet_name, columns, start_row, end_row, path=EXCEL_PATH):
+    """
+    원본 시트 XML에서 필요한 열과 행 범위만 스트리밍으로 읽기.
+    start_row/end_row는 헤더를 제외한 1부터 시작하는 문장 번호이며, end_row를 지나면 즉시 중단한다.
+    (헤더 목록, {열 이름: 문장 리스트}) 반환
+    """
+    wanted = set(columns)
+    first_excel_row = start_row + 1  # 1행은 헤더
+    last_excel_row = end_row + 1
+
+    with zipfile.ZipFile(path) as archive:
+        sheet_path = _resolve_sheet_xml_path(archive, sheet_name)
+        header = []
+        letter_to_column = {}
+        cells = {}  # (엑셀 행, 열 이름) -> 값
+        last_seen_row = first_excel_row - 1
+
+        with archive.open(sheet_path) as f:
+            for _, elem in ET.iterparse(f, events=('end',)):
+                if elem.tag != f'{XLSX_MAIN_NS}row':
+                    continue
+                row_number = int(elem.get('r'))
+                if row_number == 1:
+                    for cell in elem.iter(f'{XLSX_MAIN_NS}c'):
+                        name = _cell_text(cell)
+                        if name == '':
+                            continue  # 서식만 있는 빈 셀
+                        header.append(name)
+                        letter_to_column[cell.get('r').rstrip('0123456789')] = name
+                elif row_number > last_excel_row:
+                    break
+                elif row_number >= first_excel_row:
+                    for cell in elem.iter(f'{XLSX_MAIN_NS}c'):
+                        if len(cell) == 0:
+                            continue  # 값이 없는 셀은 건너뜀
+                        letters = cell.get('r').rstrip('0123456789')
+                        if letters in letter_to_column:
+                            cells[(row_number, letter_to_column[letters])] = _cell_text(cell)
+                            last_seen_row = row_number
+                elem.clear()
+
+        # 헤더와 선택된 셀에 쓰인 공유 문자열만 해석
+        needed = {value[1] for value in header + list(cells.values()) if isinstance(value, tuple)}
+        shared = _read_shared_strings(archive, needed)
+
+    def resolve(value):
+        return shared.get(value[1], '') if isinstance(value, tuple) else value
+
+    header = [str(resolve(name)) for name in header]
+    letter_to_column = {letters: str(resolve(name)) for letters, name in letter_to_column.items()}
+    cells = {(row, str(resolve(name)) if isinstance(name, tuple) else name): value
+             for (row, name), value in cells.items()}
+
+    rows = range(first_excel_row, last_seen_row + 1)
+    data = {col: [str(resolve(cells.get((row, col), ''))) for row in rows] for col in wanted if col in header}
+    return header, data
+
+def is_corpus_cache_ready():
+    """현재 엑셀 파일에 대한 코퍼스 캐시가 이미 만들어져 있는지 확인"""
+    try:
+        fingerprint = get_workbook_fingerprint()
+        return (get_corpus_cache_dir(fingerprint) / 'manifest.json').exists()
+    except Exception:
+        return False
+
+VALIDATION_OUTLIER_Z = 4.0  # 길이 이상치 판정 기준 (강건 z-점수)
+
+def build_validation_report(corpus):
+    """
+    코퍼스 전체 데이터 검증 보고서 생성 (벡터화된 pandas/NumPy 연산).
+    - 언어(열)별 빈 칸/NaN 개수
+    - 일부 언어만 비어 있는 행
+    - 같은 행의 다른 언어에 비해 길이가 비정상적인 셀 (번역 누락/밀림 의심)
+    """
+    sheets = []
+    warnings = []
+    for sheet in corpus['sheets']:
+        df = read_sheet(sheet['name'])
+        columns = df.columns.tolist()
+
+        # 필수 열 확인 (영어, 한국어)
+        en_col_exists = sheet['column_index'].get('english') is not None
+        ko_col_exists = sheet['column_index'].get('korean') is not None
+        if not en_col_exists or not ko_col_exists:
+            warnings.append(f"시트 '{sheet['name']}'에 필수 열(영어, 한국어)이 없습니다.")
+        missing_languages = [lang for lang, position in sheet['column_index'].items() if position is None]
+
+        # 행 x 열 길이 행렬 (빈 칸과 NaN은 길이 0)
+        lengths = np.stack(
+            [df[col].fillna('').str.strip().str.len().to_numpy(dtype=np.float64) for col in columns], axis=1
+        ) if columns else np.zeros((len(df), 0))
+        empty = lengths == 0
+        mixed_rows = np.flatnonzero(empty.any(axis=1) & ~empty.all(axis=1))
+
+        # 행 중앙값 대비 로그 길이 비율을 열마다 강건 z-점수로 변환
+        with np.errstate(all='ignore'):
+            log_len = np.where(empty, np.nan, np.log1p(lengths))
+            ratio = log_len - np.nanmedian(log_len, axis=1, keepdims=True)
+            center = np.nanmedian(ratio, axis=0)
+            mad = np.nanmedian(np.abs(ratio - center), axis=0) * 1.4826
+            z = (ratio - center) / np.where(mad > 0, mad, np.nan)
+        outliers = np.nan_to_num(np.abs(z)) > VALIDATION_OUTLIER_Z
+
+        empty_cells = {col: int(n) for col, n in zip(columns, empty.sum(axis=0)) if n}
+        length_outliers = {
+            col: (np.flatnonzero(outliers[:, j]) + 1).tolist()
+            for j, col in enumerate(columns) if outliers[:, j].any()
+        }
+        if empty_cells:
+            warnings.append(f"시트 '{sheet['name']}'에 빈 칸 {sum(empty_cells.values())}개가 있습니다.")
+        if len(mixed_rows):
+            warnings.append(f"시트 '{sheet['name']}'에 일부 언어만 비어 있는 행 {len(mixed_rows)}개가 있습니다.")
+
+        sheets.append({
+            'name': sheet['name'],
+            'rows': sheet['rows'],
+            'has_required_columns': bool(en_col_exists and ko_col_exists),
+            'missing_languages': missing_languages,
+            'empty_cells': empty_cells,
+            'mixed_empty_rows': (mixed_rows + 1).tolist(),  # 1부터 시작하는 문장 번호
+            'length_outliers': length_outliers
+        })
+
+    return {
+        'fingerprint': corpus['fingerprint'],
+        'created': time.time(),
+        'ok': bool(sheets) and all(sheet['has_required_columns'] for sheet in sheets[:3]),
+        'warnings': warnings,
+        'sheets': sheets
+    }
+
+@st.cache_resource(show_spinner=False, max_entries=4)
+def _load_validation_report(sha256):
+    """엑셀 버전별 검증 보고서 로드 (없으면 한 번만 생성해 저장)"""
+    corpus = get_corpus()
+    report_path = get_corpus_cache_dir(corpus['fingerprint']) / 'validation.json'
+    try:
+        with open(report_path, 'r', encoding='utf-8') as f:
+            report = json.load(f)
+        if report.get('fingerprint', {}).get('sha256') == sha256:
+            return report
+    except Exception:
+        pass
+
+    report = build_validation_report(corpus)
+    atomic_write_json(report_path, report)
+    # 경고는 보고서를 만들 때 한 번만 출력
+    for warning in report['warnings']:
+        print(warning)
+    return report
+
+def get_validation_report():
+    """현재 엑셀 파일의 검증 보고서 반환"""
+    return _load_validation_report(get_corpus()['fingerprint']['sha256'])
+
 def validate_excel_structure():
-    """엑셀 파일 구조 검증 및 필요시 수정"""
+    """엑셀 파일 구조 검증 (엑셀 버전별로 저장된 검증 결과 사용)"""
     try:
         # 엑셀 파일 존재 여부 확인
         if not EXCEL_PATH.exists():
             st.error(f"엑셀 파일을 찾을 수 없습니다: {EXCEL_PATH}")
             return False
             
-        # 엑셀 파일 읽기
-        excel_file = pd.ExcelFile(EXCEL_PATH)
-        sheet_names = excel_file.sheet_names
+        # 캐시된 코퍼스에서 시트 목록 읽기
+        sheet_names = get_sheet_names()
         
         if not sheet_names:
             st.error("엑셀 파일에 시트가 없습니다.")
             return False
             
-        # 각 시트 검증
-        for sheet_name in sheet_names[:3]:  # 처음 3개 시트만 검증
-            try:
-                df = pd.read_excel(EXCEL_PATH, sheet_name=sheet_name, header=0, engine='openpyxl')
-                
-                # 열 이름 확인
-                columns = df.columns.tolist()
-                
-                # 필수 열 확인 (영어, 한국어)
-                en_col_exists = any('en' in str(col).lower() or '영어' in str(col) or '미국' in str(col) for col in columns)
-                ko_col_exists = any('ko' in str(col).lower() or '한국' in str(col) or '한글' in str(col) for col in columns)
-                
-                if not en_col_exists or not ko_col_exists:
-                    print(f"시트 '{sheet_name}'에 필수 열(영어, 한국어)이 없습니다.")
-                
-            except Exception as e:
-                print(f"시트 '{sheet_name}' 검증 중 오류 발생: {str(e)}")
-                continue
-                
+        # 저장된 검증 결과 읽기 (엑셀이 바뀐 경우에만 새로 검증)
+        get_validation_report()
         return True
         
     except Exception as e:
         st.error(f"엑셀 파일 검증 중 오류 발생: {str(e)}")
         return False
 
+def create_validation_report_ui():
+    """데이터 검증 보고서 요약 표시"""
+    try:
+        report = get_validation_report()
+    except Exception as e:
+        st.error(f"검증 보고서를 불러올 수 없습니다: {e}")
+        return
+
+    with st.expander("📋 데이터 검증 보고서"):
+        summary = pd.DataFrame([{
+            '시트': sheet['name'],
+            '문장 수': sheet['rows'],
+            '필수 열': '✅' if sheet['has_required_columns'] else '❌',
+            '없는 언어': ', '.join(LANG_DISPLAY.get(lang, lang) for lang in sheet['missing_languages']),
+            '빈 칸': sum(sheet['empty_cells'].values()),
+            '일부 비어 있는 행': len(sheet['mixed_empty_rows']),
+            '길이 이상치': sum(len(rows) for rows in sheet['length_outliers'].values())
+        } for sheet in report['sheets']])
+        st.dataframe(summary, hide_index=True, use_container_width=True)
+        for sheet in report['sheets']:
+            for col, rows in sheet['length_outliers'].items():
+                st.caption(f"{sheet['name']} / {col}: {', '.join(map(str, rows[:20]))}{' …' if len(rows) > 20 else ''}")
+
+def encode_settings(settings):
+    """설정 값을 키별 JSON 문자열로 (변경 비교와 저장에 사용)"""
+    return {key: json.dumps(value, ensure_ascii=False, sort_keys=True) for key, value in settings.items()}
+
+def _migrate_settings_v1(settings):
+    """v1 -> v2: 언어별 배속 키({순위}_{언어}_speed)를 순위별 배속 키({순위}_speed)로"""
+    for rank in ('first', 'second', 'third'):
+        lang = settings.get(f'{rank}_lang')
+        legacy_key = f'{rank}_{lang}_speed'
+        if f'{rank}_speed' not in settings and legacy_key in settings:
+            settings[f'{rank}_speed'] = settings[legacy_key]
+    return settings
+
+SETTINGS_MIGRATIONS = {1: _migrate_settings_v1}  # 버전 -> 다음 버전으로 바꾸는 함수
+
+def migrate_settings(settings):
+    """저장된 설정을 현재 형식으로 변환 (버전이 없으면 v1)"""
+    settings = dict(settings)
+    version = settings.get('schema_version', 1)
+    while version < SETTINGS_SCHEMA_VERSION:
+        settings = SETTINGS_MIGRATIONS[version](settings)
+        version += 1
+    settings['schema_version'] = SETTINGS_SCHEMA_VERSION
+    return settings
+
+class UserStore:
+    """
+    사용자별 상태 저장소 (SQLite, WAL).
+    설정은 키 하나당 한 행이라 바뀐 키만 짧은 트랜잭션으로 고치고, 학습 시간은 이벤트로 쌓아 합계를 색인으로 조회한다.
+    여러 세션과 프로세스가 같은 파일을 함께 써도 서로 덮어쓰지 않는다.
+    """
+
+    def __init__(self, path=USER_DB_PATH):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(self.path), timeout=30, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS settings ('
+            ' user_id TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, updated REAL NOT NULL,'
+            ' PRIMARY KEY (user_id, key))'
+        )
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS study_events ('
+            ' id INTEGER PRIMARY KEY, user_id TEXT NOT NULL, session_id TEXT, day TEXT NOT NULL,'
+            ' minutes INTEGER NOT NULL, at REAL NOT NULL)'
+        )
+        self._db.execute('CREATE INDEX IF NOT EXISTS study_events_user_day ON study_events (user_id, day)')
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS checkpoints ('
+            ' user_id TEXT NOT NULL, name TEXT NOT NULL, data TEXT NOT NULL, updated REAL NOT NULL,'
+            ' PRIMARY KEY (user_id, name))'
+        )
+        self._db.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)')
+        self._db.commit()
+
+    def load_settings(self, user_id):
+        """사용자의 저장된 설정 (없으면 빈 dict)"""
+        with self._lock:
+            rows = self._db.execute('SELECT key, value FROM settings WHERE user_id = ?', (user_id,)).fetchall()
+        return {key: json.loads(value) for key, value in rows}
+
+    def save_settings(self, user_id, settings):
+        """저장된 값과 다른 키만 한 트랜잭션으로 기록하고 바뀐 키 수 반환"""
+        encoded = encode_settings(settings)
+        with self._lock:
+            stored = dict(self._db.execute('SELECT key, value FROM settings WHERE user_id = ?', (user_id,)))
+        changed = {key: value for key, value in encoded.items() if stored.get(key) != value}
+        self.write_settings(user_id, changed)
+        return len(changed)
+
+    def write_settings(self, user_id, encoded):
+        """이미 JSON으로 바꾼 설정 값들을 비교 없이 한 트랜잭션으로 기록"""
+        if not encoded:
+            return
+        now = time.time()
+        with self._lock, self._db:
+            self._db.executemany(
+                'INSERT INTO settings (user_id, key, value, updated) VALUES (?, ?, ?, ?) '
+                'ON CONFLICT (user_id, key) DO UPDATE SET value = excluded.value, updated = excluded.updated',
+                [(user_id, key, value, now) for key, value in encoded.items()]
+            )
+
+    def claim_migration(self, name):
+        """한 번만 할 작업을 표시 (처음 표시한 쪽만 True, 여러 프로세스가 동시에 불러도 하나만)"""
+        with self._lock, self._db:
+            cursor = self._db.execute('INSERT OR IGNORE INTO meta (key, value) VALUES (?, ?)',
+                                      (f'migration:{name}', str(time.time())))
+        return cursor.rowcount == 1
+
+    def has_settings(self, user_id):
+        with self._lock:
+            return self._db.execute('SELECT 1 FROM settings WHERE user_id = ? LIMIT 1', (user_id,)).fetchone() is not None
+
+    def add_study_minutes(self, user_id, day, minutes, session_id=None):
+        """학습 시간 이벤트 추가"""
+        with self._lock, self._db:
+            self._db.execute(
+                'INSERT INTO study_events (user_id, session_id, day, minutes, at) VALUES (?, ?, ?, ?, ?)',
+                (user_id, session_id, day, int(minutes), time.time())
+            )
+
+    def study_minutes(self, user_id, day):
+        """사용자의 그날 학습 시간 합계(분)"""
+        with self._lock:
+            row = self._db.execute(
+                'SELECT COALESCE(SUM(minutes), 0) FROM study_events WHERE user_id = ? AND day = ?', (user_id, day)
+            ).fetchone()
+        return row[0]
+
+    def save_checkpoint(self, user_id, name, data):
+        """학습 진행 상태 같은 체크포인트 저장 (이름별로 덮어씀)"""
+        with self._lock, self._db:
+            self._db.execute(
+                'INSERT INTO checkpoints (user_id, name, data, updated) VALUES (?, ?, ?, ?) '
+                'ON CONFLICT (user_id, name) DO UPDATE SET data = excluded.data, updated = excluded.updated',
+                (user_id, name, json.dumps(data, ensure_ascii=False), time.time())
+            )
+
+    def load_checkpoint(self, user_id, name):
+        """체크포인트 (없으면 None)"""
+        with self._lock:
+            row = self._db.execute(
+                'SELECT data FROM checkpoints WHERE user_id = ? AND name = ?', (user_id, name)
+            ).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def import_legacy_files(self):
+        """예전 전역 파일(설정, 오늘 학습 시간, 학습 상태)을 기본 사용자로 한 번 옮김 (옮긴 표시는 meta 테이블)"""
+        # 설정 파일이 없거나 읽지 못해도 표시가 남으므로 학습 시간을 다시 더하지 않음
+        imported_before = self.has_settings(DEFAULT_USER_ID)  # 표시를 남기기 전 버전에서 이미 옮긴 저장소
+        if not self.claim_migration('legacy_files') or imported_before:
+            return
+        try:
+            with open(SETTINGS_PATH, 'r', encoding='utf-8') as f:
+                self.save_settings(DEFAULT_USER_ID, json.load(f))
+        except Exception:
+            pass
+        try:
+            with open(SCRIPT_DIR / 'study_time.json', 'r') as f:
+                study_data = json.load(f)
+            if study_data.get('time'):
+                self.add_study_minutes(DEFAULT_USER_ID, study_data['date'], study_data['time'])
+        except Exception:
+            pass
+        try:
+            with open(TEMP_DIR / 'learning_state.json', 'r', encoding='utf-8') as f:
+                self.save_checkpoint(DEFAULT_USER_ID, 'learning_state', json.load(f))
+        except Exception:
+            pass
+
+@st.cache_resource(show_spinner=False)
+def get_user_store():
+    """프로세스 공용 사용자 저장소"""
+    store = UserStore()
+    store.import_legacy_files()
+    return store
+
+class SettingsSaver:
+    """
+    세션 하나의 설정 저장. 마지막으로 저장한 값과 비교해 바뀐 키만 기록하고,
+    직전 저장 후 debounce초 안에 또 바뀌면 모아 두었다가 그 시간이 끝날 때 백그라운드 루프에서 기록한다
+    (다음 실행이 없어도, 탭을 닫아도 마지막 변경이 남음).
+    """
+
+    def __init__(self, store, user_id, saved, background, debounce=SETTINGS_SAVE_DEBOUNCE):
+        self.store = store
+        self.user_id = user_id
+        self.saved = saved  # 저장소에 있는 값 (키 -> JSON)
+        self.background = background
+        self.debounce = debounce
+        self.saved_at = 0.0
+        self._pending = None  # 아직 기록하지 않은 최신 설정 (JSON으로 바꾼 것)
+        self._flush_scheduled = False
+        self._lock = threading.Lock()
+
+    def save(self, settings, force=True):
+        """바뀐 키를 기록 (force=False면 debounce 안의 변경은 모아서 나중에)"""
+        encoded = encode_settings(settings)
+        with self._lock:
+            if not any(self.saved.get(key) != value for key, value in encoded.items()):
+                self._pending = None
+                return
+            wait = self.debounce - (time.monotonic() - self.saved_at)
+            if force or wait <= 0:
+                self._write(encoded)
+                return
+            self._pending = encoded
+            if self._flush_scheduled:
+                return
+            self._flush_scheduled = True
+        loop = self.background.loop
+        loop.call_soon_threadsafe(lambda: loop.call_later(wait, self.flush))
+
+    def flush(self):
+        """모아 둔 변경 기록 (백그라운드 루프에서 호출)"""
+        try:
+            with self._lock:
+                self._flush_scheduled = False
+                if self._pending is not None:
+                    self._write(self._pending)
+        except Exception as e:
+            print(f"설정 저장 중 오류: {e}")
+
+    def _write(self, encoded):
+        dirty = {key: value for key, value in encoded.items() if self.saved.get(key) != value}
+        self._pending = None
+        self.store.write_settings(self.user_id, dirty)
+        self.saved.update(dirty)
+        self.saved_at = time.monotonic()
+
+def current_user_id():
+    """접속한 사용자 ID (?user=이름, 없으면 기본 사용자)"""
+    try:
+        user_id = st.query_params.get('user', '')
+    except Exception:
+        user_id = ''
+    user_id = re.sub(r'[^\w.@-]', '', str(user_id))[:64]
+    return user_id or DEFAULT_USER_ID
+
+def current_session_id():
+    """Streamlit 세션 ID (학습 시간 이벤트에 함께 기록)"""
+    try:
+        from streamlit.runtime.scriptrunner import get_script_run_ctx
+        ctx = get_script_run_ctx()
+        return ctx.session_id if ctx is not None else None
+    except Exception:
+        return None
+
 def initialize_session_state():
     """세션 상태 초기화 함수"""
     # 페이지 상태 초기화
@@ -267,15 +1334,45 @@ def initialize_session_state():
         'second_color': '#FFFFF0', # 아이보리
         'third_color': '#00FF00',  # 초록색
         
+        # 엑셀 읽기 방식 ('cache': 파싱 캐시, 'stream': 필요한 열/행만 원본에서 스트리밍)
+        'sheet_reader_mode': 'cache',
+        
+        # 배속 생성 방식 ('tts': 배속마다 edge-tts 요청, 'stretch': 1배속을 한 번만 받아 로컬에서 배속 변환)
+        'speed_mode': 'tts',
+        
+        # 재생 방식 ('clips': 음성마다 따로 재생, 'track': 레슨 전체를 한 트랙으로 만들어 재생)
+        'playback_mode': 'clips',
+        
+        # 음성 전송 형식 ('auto': 접속 기기로 판단, 'desktop': 원본, 'mobile': 데이터 절약)
+        'audio_profile': 'auto',
+        
+        # 음성 엔진 ('edge': 온라인 edge-tts, 'local': 오프라인 로컬 합성), 온라인 엔진 실패 시 로컬 엔진으로 대체
+        'tts_backend': 'edge',
+        'tts_fallback': True,
+        
         # 오디오 설정
         'audio_playback_method': 'html5',
         'audio_wait_mode': 'duration',
-        'fixed_wait_time': 2.0
+        'fixed_wait_time': 2.0,
+
+        # 설정 형식 버전
+        'schema_version': SETTINGS_SCHEMA_VERSION
     }
     
-    # 설정이 없는 경우 기본값으로 초기화
+    # 사용자 구분 (?user=이름)
+    if 'user_id' not in st.session_state:
+        st.session_state.user_id = current_user_id()
+
+    # 설정이 없는 경우 사용자 저장소의 설정(없으면 기본값)으로 초기화
     if 'settings' not in st.session_state:
-        st.session_state.settings = default_settings
+        # 세션마다 한 번만 읽음 (이후에는 바뀐 키만 저장)
+        try:
+            stored_settings = get_user_store().load_settings(st.session_state.user_id)
+        except Exception:
+            stored_settings = {}
+        st.session_state.settings_saver = SettingsSaver(get_user_store(), st.session_state.user_id,
+                                                        encode_settings(stored_settings), get_synthesis_loop())
+        st.session_state.settings = {**default_settings, **migrate_settings(stored_settings)}
     else:
         # 기존 설정에 누락된 값이 있으면 기본값으로 보완
         for key, value in default_settings.items():
@@ -289,20 +1386,9 @@ def initialize_session_state():
     # 오늘 날짜 확인
     current_date = time.strftime('%Y-%m-%d')
     
-    # 학습 시간 파일 경로
-    study_time_path = SCRIPT_DIR / 'study_time.json'
-    
-    # 파일에서 학습 시간 데이터 로드
+    # 사용자 저장소에서 오늘 학습 시간 합계 로드
     try:
-        if study_time_path.exists():
-            with open(study_time_path, 'r') as f:
-                study_data = json.load(f)
-                if study_data.get('date') == current_date:
-                    st.session_state.today_total_study_time = study_data.get('time', 0)
-                else:
-                    st.session_state.today_total_study_time = 0
-        else:
-            st.session_state.today_total_study_time = 0
+        st.session_state.today_total_study_time = get_user_store().study_minutes(st.session_state.user_id, current_date)
     except Exception:
         st.session_state.today_total_study_time = 0
     
@@ -321,21 +1407,24 @@ def initialize_session_state():
     
     # break.wav 파일 존재 여부 확인
     break_sound_path = SCRIPT_DIR / './base/break.wav'
-    if not break_sound_path.exists():
+    if not break_sound_path.exists() and 'break_sound_checked' not in st.session_state:
+        # 온라인 엔진을 쓸 수 없으면 파일이 생기지 않으므로 세션마다 한 번만 시도
+        st.session_state.break_sound_checked = True
         st.warning("브레이크 알림음 파일이 없습니다. 기본 알림음을 생성합니다.")
-        try:
-            # 기본 알림음 생성 (북소리)
-            communicate = edge_tts.Communicate("딩동", "ko-KR-SunHiNeural")
-            asyncio.run(communicate.save(str(break_sound_path)))
-        except Exception as e:
-            st.error(f"알림음 생성 오류: {e}")
+        # 기본 알림음 생성 (설정된 음성 엔진, 실패하면 로컬 엔진)
+        break_file = asyncio.run(get_voice_file(
+            "딩동", "ko-KR-SunHiNeural", 1.0, output_file=break_sound_path,
+            backends=get_tts_backends(st.session_state.settings)
+        ))
+        if break_file is None:
+            st.error("알림음 생성 오류: 음성 엔진을 사용할 수 없습니다.")
 
     # 베트남어 음성 설정 확실히 초기화
     if 'vi_voice' not in st.session_state.settings:
         st.session_state.settings['vi_voice'] = 'HoaiMy'
     
-    # 설정 저장
-    save_settings(st.session_state.settings)
+    # 바뀐 설정 저장 (위젯 조작마다 쓰지 않도록 모아서)
+    save_settings(st.session_state.settings, force=False)
 
     # pygame 초기화
     initialize_pygame_mixer()
@@ -408,8 +1497,9 @@ def create_settings_ui(return_to_learning=False):
         # 현재 설정 가져오기
         settings = st.session_state.settings
         
-        # 기본값 설정
-        settings['audio_playback_method'] = 'html5'  # HTML5 Audio 방식으로 고정
+        # 기본값 설정 (서버 스피커 재생을 고르지 않았으면 HTML5 Audio 방식)
+        if settings.get('audio_playback_method') != 'pygame':
+            settings['audio_playback_method'] = 'html5'
         
         # CSS 스타일 수정 - 서브헤더 색상을 초록색으로 변경
         st.markdown("""
@@ -441,39 +1531,28 @@ def create_settings_ui(return_to_learning=False):
         with col2:
             # 엑셀 파일에서 시트 선택 및 최대 행 수 가져오기
             try:
-                # 엑셀 파일 전체 읽기
-                excel_file = pd.ExcelFile(EXCEL_PATH)
-                sheet_names = excel_file.sheet_names[:3]  # 처음 3개의 시트만 사용
+                # 캐시된 코퍼스에서 시트 목록 읽기
+                sheet_names = get_sheet_names()[:3]  # 처음 3개의 시트만 사용
+                
+                # 문장 검색에서 고른 시트/과를 위젯보다 먼저 반영
+                search_jump = st.session_state.get('search_jump')
+                if search_jump and search_jump.get('pending'):
+                    st.session_state['sheet_select'] = search_jump['sheet']
+                    jump_lesson = min((search_jump['row'] - 1) // 20 + 1, 30)
+                    st.session_state['lesson_select'] = f"{jump_lesson}과({(jump_lesson-1)*20+1}~{jump_lesson*20}번)"
+                    search_jump['pending'] = False
                 
                 # 시트 선택 (기본값: 첫 번째 시트)
                 selected_sheet = st.selectbox(
                     "주제 : 생활영어, 여행영어, 천일문",
                     options=sheet_names,
                     index=0,
-                    key="sheet_select"
+                    key="sheet_select",
+                    on_change=lambda: st.session_state.pop('search_jump', None)
                 )
                 
-                # 선택된 시트 데이터 읽기
-                try:
-                    # 먼저 헤더가 있는 형식으로 시도
-                    df = pd.read_excel(
-                        EXCEL_PATH,
-                        sheet_name=selected_sheet,
-                        header=0,
-                        engine='openpyxl'
-                    )
-                except Exception:
-                    # 실패하면 헤더 없이 시도
-                    df = pd.read_excel(
-                        EXCEL_PATH,
-                        sheet_name=selected_sheet,
-                        header=None,
-                        engine='openpyxl'
-                    )
-                    # 첫 번째 행을 헤더로 설정
-                    df.columns = [f"Column_{i}" for i in range(len(df.columns))]
-                
-                max_row = len(df)
+                # 선택된 시트의 행 수는 매니페스트에서 바로 확인
+                max_row = get_sheet_info(selected_sheet)['rows']
                 
                 # 선택된 시트 정보를 설정에 저장
                 settings['selected_sheet'] = selected_sheet
@@ -514,13 +1593,19 @@ def create_settings_ui(return_to_learning=False):
                 "과 선택(20문장 30과)",
                 options=lesson_options,
                 index=current_lesson-1,
-                key="lesson_select"
+                key="lesson_select",
+                on_change=lambda: st.session_state.pop('search_jump', None)
             )
             
             # 선택된 과에서 시작 번호 계산
             lesson_num = int(selected_lesson.split('과')[0])
             settings['start_row'] = (lesson_num - 1) * 20 + 1
             settings['end_row'] = lesson_num * 20
+            
+            # 문장 검색으로 고른 문장이 있으면 그 문장부터 시작
+            search_jump = st.session_state.get('search_jump')
+            if search_jump and search_jump['sheet'] == selected_sheet:
+                settings['start_row'] = min(search_jump['row'], max_row)
         
         with col2:
             # 범위 선택 (20개 또는 50개 단위)
@@ -550,6 +1635,35 @@ def create_settings_ui(return_to_learning=False):
                 range_value = range_options[selected_range]
                 settings['end_row'] = min(settings['start_row'] + range_value - 1, max_row)
 
+        # 문장 검색 (모든 시트/언어)
+        search_query = st.text_input("🔍 문장 검색 (단어 또는 구절, 모든 언어)", key="sentence_search")
+        if search_query:
+            # 검색어가 그대로면 다른 위젯을 바꿔 다시 실행될 때 검색하지 않음
+            corpus = get_corpus()
+            search_key = (corpus['fingerprint']['sha256'], search_query, tuple(sheet_names))
+            cached_search = st.session_state.get('search_cache')
+            if cached_search is None or cached_search[0] != search_key:
+                cached_search = st.session_state.search_cache = (
+                    search_key, search_sentences(search_query, sheet_names=sheet_names, corpus=corpus)
+                )
+            hits = cached_search[1]
+            if hits:
+                selected_hit = st.selectbox(
+                    f"검색 결과 {len(hits)}건",
+                    options=range(len(hits)),
+                    format_func=lambda i: f"{hits[i]['sheet']} No.{hits[i]['row']:03d} · {hits[i]['text']}",
+                    key="search_result"
+                )
+                if st.button("🔍 이 문장부터 학습", use_container_width=True, key="search_jump_btn"):
+                    st.session_state.search_jump = {
+                        'sheet': hits[selected_hit]['sheet'],
+                        'row': hits[selected_hit]['row'],
+                        'pending': True
+                    }
+                    st.rerun()
+            else:
+                st.caption("검색 결과가 없습니다.")
+
         # 선택된 범위 표시
         st.info(f"선택된 범위: {settings['start_row']} ~ {settings['end_row']} (총 {settings['end_row'] - settings['start_row'] + 1}문장)")
 
@@ -829,6 +1943,93 @@ def create_settings_ui(return_to_learning=False):
             settings['final_sound_enabled'] = selected_duration != '없음'
             settings['final_sound_duration'] = final_sound_mapping[selected_duration]
 
+        # 배속 생성 방식 설정
+        speed_mode_mapping = {'배속마다 음성 요청': 'tts', '1배속 음성을 로컬에서 배속 변환': 'stretch'}
+        speed_mode_options = list(speed_mode_mapping.keys())
+        current_speed_mode = next(
+            (option for option, mode in speed_mode_mapping.items() if mode == settings.get('speed_mode', 'tts')),
+            speed_mode_options[0]
+        )
+        selected_speed_mode = st.selectbox(
+            "배속 생성 방식",
+            options=speed_mode_options,
+            index=speed_mode_options.index(current_speed_mode),
+            key="speed_mode_main"
+        )
+        settings['speed_mode'] = speed_mode_mapping[selected_speed_mode]
+
+        # 재생 방식 설정
+        playback_mode_mapping = {
+            '음성마다 따로 재생': 'clips',
+            '레슨 전체를 한 트랙으로 재생': 'track',
+            '브라우저에서 레슨 전체 진행': 'browser'
+        }
+        playback_mode_options = list(playback_mode_mapping.keys())
+        current_playback_mode = next(
+            (option for option, mode in playback_mode_mapping.items() if mode == settings.get('playback_mode', 'clips')),
+            playback_mode_options[0]
+        )
+        selected_playback_mode = st.selectbox(
+            "재생 방식",
+            options=playback_mode_options,
+            index=playback_mode_options.index(current_playback_mode),
+            key="playback_mode_main"
+        )
+        settings['playback_mode'] = playback_mode_mapping[selected_playback_mode]
+
+        # 소리 나는 곳: 브라우저 또는 서버에 연결된 스피커 (교실 키오스크)
+        playback_method_mapping = {'브라우저에서 재생': 'html5', '서버 스피커로 재생 (키오스크)': 'pygame'}
+        playback_method_options = list(playback_method_mapping.keys())
+        current_playback_method = next(
+            (option for option, method in playback_method_mapping.items()
+             if method == settings.get('audio_playback_method', 'html5')),
+            playback_method_options[0]
+        )
+        selected_playback_method = st.selectbox(
+            "소리 나는 곳",
+            options=playback_method_options,
+            index=playback_method_options.index(current_playback_method),
+            key="audio_playback_method_main"
+        )
+        settings['audio_playback_method'] = playback_method_mapping[selected_playback_method]
+
+        # 음성 전송 형식 설정
+        audio_profile_mapping = {'자동 (접속 기기에 맞춤)': 'auto', '원음 (PC)': 'desktop', '데이터 절약 (모바일)': 'mobile'}
+        audio_profile_options = list(audio_profile_mapping.keys())
+        current_audio_profile = next(
+            (option for option, profile in audio_profile_mapping.items()
+             if profile == settings.get('audio_profile', 'auto')),
+            audio_profile_options[0]
+        )
+        selected_audio_profile = st.selectbox(
+            "음성 전송 형식",
+            options=audio_profile_options,
+            index=audio_profile_options.index(current_audio_profile),
+            key="audio_profile_main"
+        )
+        settings['audio_profile'] = audio_profile_mapping[selected_audio_profile]
+
+        # 음성 엔진 설정
+        tts_backend_mapping = {'edge-tts (온라인)': 'edge', '로컬 합성 (오프라인)': 'local'}
+        tts_backend_options = list(tts_backend_mapping.keys())
+        current_tts_backend = next(
+            (option for option, name in tts_backend_mapping.items() if name == settings.get('tts_backend', 'edge')),
+            tts_backend_options[0]
+        )
+        selected_tts_backend = st.selectbox(
+            "음성 엔진",
+            options=tts_backend_options,
+            index=tts_backend_options.index(current_tts_backend),
+            key="tts_backend_main"
+        )
+        settings['tts_backend'] = tts_backend_mapping[selected_tts_backend]
+        if settings['tts_backend'] != 'local':
+            settings['tts_fallback'] = st.checkbox(
+                "온라인 음성을 쓸 수 없으면 로컬 합성으로 대체",
+                value=settings.get('tts_fallback', True),
+                key="tts_fallback_main"
+            )
+
         # 학습 시작 버튼 위치 이동 (학습 설정 아래, 폰트 설정 위)
         if st.button("▶️ 학습 시작", use_container_width=True, key="start_btn_bottom"):
             save_settings(settings)
@@ -884,6 +2085,27 @@ def create_settings_ui(return_to_learning=False):
                                          key="third_color_select")
             settings['third_color'] = COLOR_MAPPING[selected_color]
 
+        # 데이터 검증 보고서
+        create_validation_report_ui()
+        
+        # 음성 캐시 상태
+        try:
+            cache_stats = get_audio_cache().stats()
+            st.caption(
+                f"🔊 음성 캐시: {cache_stats['entries']}개, "
+                f"{cache_stats['bytes'] / 1024 / 1024:.1f}MB / {cache_stats['max_bytes'] / 1024 / 1024:.0f}MB, "
+                f"적중 {cache_stats['hits']}회 · 실패 {cache_stats['misses']}회 · 삭제 {cache_stats['evictions']}회"
+            )
+            media_server = get_media_server()
+            if media_server is not None and media_server.tracker.samples:
+                st.caption(f"▶️ 브라우저 재생 시작 지연: 평균 {media_server.tracker.start_latency * 1000:.0f}ms "
+                           f"({media_server.tracker.samples}회 측정)")
+            breaker = get_edge_tts_client().breaker
+            if breaker.state != 'closed':
+                st.caption(f"⚠️ 온라인 음성 서버 응답 없음: {breaker.retry_after():.0f}초 후 다시 시도합니다.")
+        except Exception:
+            pass
+
 def get_voice_mapping(language, voice_setting):
     """안전하게 음성 매핑을 가져오는 함수"""
     try:
@@ -948,109 +2170,1441 @@ def initialize_pygame_mixer():
                 return False
     return True
 
-def play_audio(file_path, sentence_interval=1.0, next_sentence=False):
+class MixerPlayer:
     """
-    음성 파일 재생 - 저장된 설정에 따라 재생 방식 선택
+    서버에 연결된 스피커로 재생 (교실 키오스크용, audio_playback_method='pygame').
+    전용 오디오 스레드가 요청 큐에서 디코딩된 음성을 꺼내 한 채널에 이어 붙이고(Channel.queue)
+    음성이 끝날 때마다 기다리는 쪽에 알린다. 음성 뒤의 간격은 무음으로 붙여 샘플 단위로 맞춘다.
+    스피커는 하나이므로 한 번에 한 세션만 쓴다 (acquire로 차지하고 stop으로 놓음).
     """
-    try:
-        if not file_path or not os.path.exists(file_path):
-            # 파일이 없는 경우 조용히 리턴
-            return
 
-        settings = st.session_state.settings
-        playback_method = settings.get('audio_playback_method', 'html5')
-        wait_mode = settings.get('audio_wait_mode', 'duration')
+    def __init__(self, max_sounds=16):
+        if not initialize_pygame_mixer():
+            raise RuntimeError("pygame mixer를 초기화할 수 없습니다.")
+        self.frequency, self.size, self.channels = pygame.mixer.get_init()
+        pygame.mixer.set_reserved(1)
+        self.channel = pygame.mixer.Channel(0)
+        self.max_sounds = max_sounds
+        self._sounds = collections.OrderedDict()  # (경로, 간격) -> pygame.mixer.Sound (최근 사용 순)
+        self._lock = threading.Lock()
+        self.owner = None  # 지금 스피커를 쓰는 세션 ID
+        self._decoder = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix='mixer-decode')
+        self._requests = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name='mixer-player', daemon=True)
+        self._thread.start()
+
+    def _decode(self, path, gap):
+        """음성 파일을 mixer 형식의 PCM으로 디코딩하고 간격만큼 무음을 붙임"""
+        samples, sample_rate = sf.read(str(path), dtype='float32')
+        if samples.ndim > 1:
+            samples = samples.mean(axis=1)
+        if sample_rate != self.frequency:
+            import librosa  # 가져오는 데 몇 초 걸리므로 필요할 때만
+            samples = librosa.resample(samples, orig_sr=sample_rate, target_sr=self.frequency)
+        samples = np.concatenate([samples, np.zeros(int(round(gap * self.frequency)), dtype=np.float32)])
+        if self.size == 32:
+            pcm = samples.astype(np.float32)
+        else:
+            pcm = (np.clip(samples, -1.0, 1.0) * 32767).astype(np.int16)
+        if self.channels > 1:
+            pcm = np.repeat(pcm[:, None], self.channels, axis=1)
+        return pygame.sndarray.make_sound(np.ascontiguousarray(pcm))
+
+    def sound(self, path, gap=0.0):
+        """디코딩된 Sound (최근 것 몇 개는 메모리에 둠)"""
+        key = (str(path), round(gap, 3))
+        with self._lock:
+            sound = self._sounds.get(key)
+            if sound is not None:
+                self._sounds.move_to_end(key)
+                return sound
+        sound = self._decode(path, gap)
+        with self._lock:
+            self._sounds[key] = sound
+            while len(self._sounds) > self.max_sounds:
+                self._sounds.popitem(last=False)
+        return sound
+
+    def preload(self, path, gap=0.0):
+        """곧 재생할 음성을 미리 디코딩"""
+        return self._decoder.submit(self.sound, path, gap)
+
+    def play(self, path, gap=0.0):
+        """재생을 예약하고, 음성과 간격이 끝나면 완료되는 Future 반환 (실패하면 결과가 False)"""
+        done = concurrent.futures.Future()
+        self._requests.put((self.preload(path, gap), done))
+        return done
+
+    @staticmethod
+    def _session_alive(session_id):
+        try:
+            from streamlit.runtime import Runtime
+            return Runtime.instance().is_active_session(session_id)
+        except Exception:
+            # Streamlit 밖(명령줄)에서는 알 수 없으므로 계속 쓰는 것으로 봄
+            return True
+
+    def acquire(self, owner):
+        """세션이 스피커를 차지 (다른 세션이 쓰는 중이면 False, 그 세션이 끝났으면 넘겨받음)"""
+        with self._lock:
+            if self.owner not in (None, owner) and self._session_alive(self.owner):
+                return False
+            self.owner = owner
+            return True
+
+    def stop(self, owner=None):
+        """재생 중인 음성과 예약된 음성을 모두 멈추고 스피커를 놓음 (owner를 주면 그 세션이 쓰는 중일 때만)"""
+        with self._lock:
+            if owner is not None and self.owner != owner:
+                return
+            self.owner = None
+        self._requests.put(None)
+
+    @staticmethod
+    def _finish(done, result):
+        if not done.done():
+            done.set_result(result)
+
+    @property
+    def alive(self):
+        return self._thread.is_alive()
+
+    def _fail_all(self, playing, waiting):
+        """재생 중/대기 중인 음성을 모두 실패로 끝냄"""
+        for _, done in waiting:
+            self._finish(done, False)
+        for done in playing:
+            self._finish(done, False)
+        waiting.clear()
+        playing.clear()
+
+    def _run(self):
+        playing = collections.deque()  # 채널에서 재생 중인 음성(첫 번째)과 이어서 재생될 음성(두 번째)의 완료 알림
+        waiting = collections.deque()
+        while True:
+            try:
+                self._step(playing, waiting)
+            except Exception as e:
+                # mixer가 다시 초기화되는 등 채널 오류: 기다리는 쪽을 모두 끝내고 채널을 다시 잡아 계속 실행
+                print(f"서버 스피커 재생 오류: {e}")
+                self._fail_all(playing, waiting)
+                try:
+                    self.channel = pygame.mixer.Channel(0)
+                    with self._lock:
+                        self._sounds.clear()
+                except Exception:
+                    time.sleep(0.5)
+
+    def _step(self, playing, waiting):
+        """요청 하나를 받고 채널 상태를 확인해 다음 음성을 이어 붙임"""
+        try:
+            # 재생 중이면 끝나는 시점을 놓치지 않도록 짧게 확인
+            request = self._requests.get(timeout=0.005 if playing or waiting else None)
+            if request is None:
+                self.channel.stop()
+                self._fail_all(playing, waiting)
+                return
+            waiting.append(request)
+        except queue.Empty:
+            pass
+
+        # 채널이 멈췄으면 모두 끝남, 이어 붙인 음성이 시작됐으면(대기열이 비었으면) 앞의 음성이 끝남
+        if playing and not self.channel.get_busy():
+            while playing:
+                self._finish(playing.popleft(), True)
+        elif len(playing) == 2 and self.channel.get_queue() is None:
+            self._finish(playing.popleft(), True)
+
+        # 채널 대기열이 비어 있으면 디코딩이 끝난 다음 음성을 이어 붙임
+        while waiting and len(playing) < 2 and waiting[0][0].done():
+            sound_future, done = waiting.popleft()
+            try:
+                sound = sound_future.result()
+            except Exception:
+                self._finish(done, False)
+                continue
+            # 채널 호출이 실패해도 _run에서 실패로 끝낼 수 있도록 먼저 넣음
+            playing.append(done)
+            if len(playing) > 1:
+                self.channel.queue(sound)
+            else:
+                self.channel.play(sound)
+
+@st.cache_resource(show_spinner=False, validate=lambda player: player is None or player.alive)
+def get_mixer_player():
+    """프로세스 공용 서버 스피커 플레이어 (mixer를 쓸 수 없으면 None)"""
+    try:
+        return MixerPlayer()
+    except Exception as e:
+        print(f"서버 스피커 재생을 사용할 수 없습니다: {e}")
+        return None
+
+def mixer_owner_id():
+    """서버 스피커를 차지하는 단위 (Streamlit 세션, 밖에서는 프로세스)"""
+    return current_session_id() or 'local'
+
+def session_mixer_player(settings):
+    """서버 스피커 재생이면 이 세션이 쓸 플레이어 (mixer를 쓸 수 없거나 다른 세션이 쓰는 중이면 None)"""
+    if settings.get('audio_playback_method') != 'pygame':
+        return None
+    player = get_mixer_player()
+    if player is None or not player.acquire(mixer_owner_id()):
+        return None
+    return player
+
+def mixer_play_timeout(file_path, gap=0.0):
+    """서버 스피커 재생 완료를 기다릴 최대 시간 (오디오 스레드가 멈췄을 때 무한히 기다리지 않도록)"""
+    return clip_duration(file_path) + gap + MIXER_PLAY_TIMEOUT_MARGIN
+
+def speed_to_rate(speed):
+    """배속을 edge-tts rate 문자열로 변환 (예: 1.5 -> '+50%', 0.8 -> '-20%')"""
+    return f"{int(round((float(speed) - 1) * 100)):+d}%"
+
+def audio_cache_key(text, voice, rate, output_format=EDGE_TTS_OUTPUT_FORMAT):
+    """(문장, 음성, 속도, 출력 형식) 전체에 대한 SHA-256 캐시 키"""
+    payload = json.dumps(
+        {'text': text, 'voice': voice, 'rate': rate, 'format': output_format},
+        ensure_ascii=False, sort_keys=True
+    )
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
 
-        # WAV 파일에서 실제 재생 시간 계산
+def clip_cache_key(text, voice, speed, stretched=False, backend=None):
+    """
+    음성 캐시 키 (backend가 없으면 edge-tts 기준, 후처리 방식 포함).
+    stretched=True면 해당 엔진의 1배속 음성을 로컬에서 배속 변환한 결과의 키.
+    """
+    output_format = backend.output_format if backend is not None else EDGE_TTS_OUTPUT_FORMAT
+    output_format = f"{output_format}+{AUDIO_POSTPROCESS_TAG}"
+    if stretched and float(speed) != 1.0:
+        output_format = f"{STRETCHED_OUTPUT_FORMAT}/{output_format}"
+    return audio_cache_key(text, voice, speed_to_rate(speed), output_format=output_format)
+
+class AudioCache:
+    """
+    내용 주소 기반 영구 음성 캐시.
+    파일은 cache/audio/<키 앞 2자리>/<키>.<확장자>에 원자적으로 저장하고,
+    SQLite 색인에 크기와 마지막 사용 시각을 기록해 디스크 한도를 넘으면 오래 안 쓴 것부터 지운다.
+    색인에는 저장할 때 한 번 읽은 재생 시간, 샘플레이트, 코덱도 함께 기록한다.
+    """
+
+    AUDIO_EXTENSIONS = ('mp3', 'wav', 'ogg', 'opus', 'flac')
+    INFO_MEMO_SIZE = 4096
+
+    def __init__(self, root=AUDIO_CACHE_DIR, max_bytes=AUDIO_CACHE_MAX_BYTES):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(self.root / 'index.sqlite3'), timeout=30, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS clips ('
+            ' key TEXT PRIMARY KEY, path TEXT NOT NULL, size INTEGER NOT NULL,'
+            ' created REAL NOT NULL, last_access REAL NOT NULL, hits INTEGER NOT NULL DEFAULT 0,'
+            ' duration REAL, sample_rate INTEGER, codec TEXT)'
+        )
+        self._db.execute('CREATE INDEX IF NOT EXISTS clips_last_access ON clips (last_access)')
+        # 이전 형식의 색인에 음성 정보 열 추가 (값은 처음 조회할 때 채움)
+        existing = {row[1] for row in self._db.execute('PRAGMA table_info(clips)')}
+        for column, column_type in (('duration', 'REAL'), ('sample_rate', 'INTEGER'), ('codec', 'TEXT')):
+            if column not in existing:
+                try:
+                    self._db.execute(f'ALTER TABLE clips ADD COLUMN {column} {column_type}')
+                except sqlite3.OperationalError:
+                    # 다른 프로세스가 먼저 추가함
+                    pass
+        self._db.commit()
+        self._info = collections.OrderedDict()  # 키 -> 음성 정보 (메모리 사본)
+
+    @staticmethod
+    def probe(source):
+        """음성 데이터(바이트 또는 경로)의 (재생 시간, 샘플레이트, 코덱), 읽을 수 없으면 (None, None, None)"""
         try:
-            with wave.open(file_path, 'rb') as wav_file:
-                frames = wav_file.getnframes()
-                rate = wav_file.getframerate()
-                duration = frames / float(rate)
+            info = sf.info(io.BytesIO(source) if isinstance(source, (bytes, bytearray)) else str(source))
+            return info.frames / info.samplerate, info.samplerate, info.format.lower()
         except Exception:
+            return None, None, None
+
+    def path_for(self, key, extension='mp3'):
+        return self.root / key[:2] / f"{key}.{extension}"
+
+    def get(self, key):
+        """캐시된 파일 경로 반환 (없으면 None). 사용 시각을 갱신한다."""
+        with self._lock:
+            row = self._db.execute('SELECT path FROM clips WHERE key = ?', (key,)).fetchone()
+            if row is not None and (self.root / row[0]).exists():
+                self._db.execute(
+                    'UPDATE clips SET last_access = ?, hits = hits + 1 WHERE key = ?', (time.time(), key)
+                )
+                self._db.commit()
+                self.hits += 1
+                return self.root / row[0]
+            if row is not None:
+                # 색인에는 있지만 파일이 지워진 경우
+                self._db.execute('DELETE FROM clips WHERE key = ?', (key,))
+                self._db.commit()
+            self.misses += 1
+            return None
+
+    def contains(self, key):
+        """적중/실패 횟수나 사용 시각을 건드리지 않고 캐시에 있는지만 확인"""
+        with self._lock:
+            row = self._db.execute('SELECT path FROM clips WHERE key = ?', (key,)).fetchone()
+        return row is not None and (self.root / row[0]).exists()
+
+    def put(self, key, data, extension='mp3'):
+        """음성 데이터를 원자적으로 저장하고 경로 반환 (재생 시간 등은 이때 한 번만 읽어 색인에 기록)"""
+        path = self.path_for(key, extension)
+        atomic_write_bytes(path, data)
+        duration, sample_rate, codec = self.probe(data) if extension in self.AUDIO_EXTENSIONS else (None, None, None)
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                'INSERT OR REPLACE INTO clips (key, path, size, created, last_access, hits, duration, sample_rate, codec)'
+                ' VALUES (?, ?, ?, ?, ?, 0, ?, ?, ?)',
+                (key, str(path.relative_to(self.root)), len(data), now, now, duration, sample_rate, codec)
+            )
+            self._db.commit()
+            self._remember(key, duration, sample_rate, codec)
+        self.enforce_budget()
+        return path
+
+    def _remember(self, key, duration, sample_rate, codec):
+        if duration is None:
+            self._info.pop(key, None)
+            return
+        self._info[key] = {'duration': duration, 'sample_rate': sample_rate, 'codec': codec}
+        self._info.move_to_end(key)
+        while len(self._info) > self.INFO_MEMO_SIZE:
+            self._info.popitem(last=False)
+
+    def info(self, key):
+        """캐시된 음성의 {'duration', 'sample_rate', 'codec'} (없으면 None)"""
+        with self._lock:
+            if key in self._info:
+                self._info.move_to_end(key)
+                return self._info[key]
+            row = self._db.execute(
+                'SELECT path, duration, sample_rate, codec FROM clips WHERE key = ?', (key,)
+            ).fetchone()
+        if row is None:
+            return None
+        rel_path, duration, sample_rate, codec = row
+        if duration is None:
+            # 정보 열이 생기기 전에 저장된 음성은 한 번만 읽어서 채움
+            duration, sample_rate, codec = self.probe(self.root / rel_path)
+            if duration is None:
+                return None
+            with self._lock:
+                self._db.execute(
+                    'UPDATE clips SET duration = ?, sample_rate = ?, codec = ? WHERE key = ?',
+                    (duration, sample_rate, codec, key)
+                )
+                self._db.commit()
+        with self._lock:
+            self._remember(key, duration, sample_rate, codec)
+        # 메모리 사본은 다른 스레드의 삭제로 바로 빠질 수 있으므로 읽은 값으로 돌려줌
+        return {'duration': duration, 'sample_rate': sample_rate, 'codec': codec}
+
+    def info_for_path(self, path):
+        """캐시 안의 파일 경로로 음성 정보 찾기 (캐시 밖 파일이면 None)"""
+        path = Path(path)
+        if self.root not in path.parents:
+            return None
+        return self.info(path.stem)
+
+    def enforce_budget(self):
+        """디스크 한도를 넘으면 마지막 사용이 오래된 항목부터 한도의 90%까지 삭제"""
+        with self._lock:
+            total = self._db.execute('SELECT COALESCE(SUM(size), 0) FROM clips').fetchone()[0]
+            if total <= self.max_bytes:
+                return
+            target = int(self.max_bytes * 0.9)
+            for key, rel_path, size in self._db.execute(
+                'SELECT key, path, size FROM clips ORDER BY last_access ASC'
+            ).fetchall():
+                if total <= target:
+                    break
+                try:
+                    (self.root / rel_path).unlink(missing_ok=True)
+                except Exception:
+                    continue
+                self._db.execute('DELETE FROM clips WHERE key = ?', (key,))
+                self._info.pop(key, None)
+                total -= size
+                self.evictions += 1
+            self._db.commit()
+
+    def stats(self):
+        """적중/실패 횟수와 캐시 크기"""
+        with self._lock:
+            entries, total = self._db.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM clips').fetchone()
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'evictions': self.evictions,
+            'entries': entries,
+            'bytes': total,
+            'max_bytes': self.max_bytes
+        }
+
+@process_resource
+def get_audio_cache():
+    """프로세스 공용 음성 캐시"""
+    return AudioCache()
+
+class MediaHotTier:
+    """최근에 보낸 음성 파일 내용을 메모리에 두는 LRU (용량 한도 안에서)"""
+
+    def __init__(self, max_bytes=MEDIA_HOT_TIER_BYTES):
+        self.max_bytes = max_bytes
+        self.total = 0
+        self._items = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, path):
+        with self._lock:
+            data = self._items.get(path)
+            if data is not None:
+                self._items.move_to_end(path)
+            return data
+
+    def put(self, path, data):
+        if len(data) > self.max_bytes // 8:
+            return
+        with self._lock:
+            if path in self._items:
+                return
+            self._items[path] = data
+            self.total += len(data)
+            while self.total > self.max_bytes:
+                _, evicted = self._items.popitem(last=False)
+                self.total -= len(evicted)
+
+class MediaFileHandler(tornado.web.StaticFileHandler):
+    """
+    음성 캐시 파일 전송 (ETag, If-None-Match, Range는 StaticFileHandler가 처리).
+    캐시 파일 이름이 내용 해시이므로 URL이 바뀌지 않는 한 내용도 바뀌지 않는다.
+    """
+
+    hot_tier = MediaHotTier()
+
+    @classmethod
+    def get_content(cls, abspath, start=None, end=None):
+        data = cls.hot_tier.get(abspath)
+        if data is None:
+            with open(abspath, 'rb') as f:
+                data = f.read()
+            cls.hot_tier.put(abspath, data)
+        return data[start:end]
+
+    @classmethod
+    def get_content_version(cls, abspath):
+        # 파일 이름(캐시 키)이 곧 내용 해시이므로 파일을 다시 읽어 해시하지 않음
+        return Path(abspath).stem
+
+    def set_extra_headers(self, path):
+        self.set_header('Cache-Control', 'public, max-age=31536000, immutable')
+
+class BaseSoundHandler(tornado.web.StaticFileHandler):
+    """base 폴더의 알림음 전송 (바뀔 수 있으므로 짧게 캐시)"""
+
+    def set_extra_headers(self, path):
+        self.set_header('Cache-Control', 'public, max-age=3600')
+
+class PlaybackTracker:
+    """
+    브라우저가 알려 주는 재생 시작/끝 이벤트를 재생 ID별로 기다림.
+    이벤트는 음성 서버 스레드에서 들어오고, 기다리는 쪽은 학습 루프(다른 이벤트 루프)이다.
+    """
+
+    def __init__(self):
+        self._pending = {}
+        self._lock = threading.Lock()
+        self.start_latency = None  # 재생 요청부터 브라우저에서 실제로 소리가 나기까지 (지수 이동 평균, 초)
+        self.samples = 0
+
+    def expect(self):
+        """새 재생 ID 발급 (지금 실행 중인 이벤트 루프에서 기다림)"""
+        playback_id = os.urandom(8).hex()
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            self._pending[playback_id] = {'loop': loop, 'issued': time.monotonic(), 'ended': loop.create_future()}
+        return playback_id
+
+    def record(self, playback_id, event):
+        """브라우저 이벤트 기록 (모르는 재생 ID면 False)"""
+        with self._lock:
+            entry = self._pending.get(playback_id)
+            if entry is None:
+                return False
+            if event == 'playing' and 'started' not in entry:
+                entry['started'] = time.monotonic()
+                latency = entry['started'] - entry['issued']
+                self.start_latency = latency if self.start_latency is None else 0.8 * self.start_latency + 0.2 * latency
+                self.samples += 1
+            elif event == 'ended':
+                future = entry['ended']
+                try:
+                    entry['loop'].call_soon_threadsafe(lambda: future.done() or future.set_result(True))
+                except RuntimeError:
+                    # 학습 루프가 이미 끝남
+                    pass
+        return True
+
+    def discard(self, playback_id):
+        """더 기다리지 않을 재생 ID 정리"""
+        with self._lock:
+            self._pending.pop(playback_id, None)
+
+    async def wait_ended(self, playback_id, timeout):
+        """재생이 끝났다는 알림을 기다림 (제한 시간 안에 오지 않으면 False)"""
+        with self._lock:
+            future = self._pending[playback_id]['ended']
+        try:
+            await asyncio.wait_for(future, timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            self.discard(playback_id)
+
+class PlaybackEventHandler(tornado.web.RequestHandler):
+    """브라우저의 재생 이벤트 수신 (POST /events/<재생 ID>?event=playing|ended)"""
+
+    def initialize(self, tracker):
+        self.tracker = tracker
+
+    def post(self, playback_id):
+        event = self.get_argument('event', '')
+        if event not in ('playing', 'ended'):
+            raise tornado.web.HTTPError(400)
+        # 플레이어는 응답을 읽지 않는 no-cors 요청으로 보내므로 CORS 헤더가 필요 없음
+        self.tracker.record(playback_id, event)
+        self.set_status(204)
+
+class MediaServer:
+    """
+    음성 파일 전용 HTTP 서버 (tornado, 백그라운드 이벤트 루프에서 실행).
+    브라우저가 <audio src>로 직접 받으므로 웹소켓으로 base64를 보내지 않아도 되고 브라우저 캐시도 쓸 수 있다.
+    """
+
+    def __init__(self, background, port=MEDIA_PORT, address=MEDIA_ADDRESS, attempts=10):
+        self.background = background
+        self.tracker = PlaybackTracker()
+        self.application = tornado.web.Application([
+            (r'/events/([0-9a-f]{16})', PlaybackEventHandler, {'tracker': self.tracker}),
+            (rf"/media/(.+\.(?:{'|'.join(MEDIA_EXTENSIONS)}))", MediaFileHandler, {'path': str(AUDIO_CACHE_DIR)}),
+            (r'/base/(break\.wav|final\.wav)', BaseSoundHandler, {'path': str(SCRIPT_DIR / 'base')}),
+        ])
+        self.port = None
+        self.loopback_only = address in LOOPBACK_HOSTS
+        last_error = None
+        # 다른 프로세스가 포트를 쓰고 있으면 다음 포트 시도
+        for candidate in range(port, port + attempts):
             try:
+                self.server = self.background.submit(self._listen(candidate, address)).result(timeout=5)
+                self.port = candidate
+                break
+            except OSError as e:
+                last_error = e
+        if self.port is None:
+            raise last_error
+
+    async def _listen(self, port, address):
+        return self.application.listen(port, address=address, xheaders=True)
+
+    def url_for(self, file_path, base_url):
+        """파일의 URL (서버가 보낼 수 없는 파일이면 None)"""
+        path = Path(file_path)
+        if AUDIO_CACHE_DIR in path.parents and path.suffix.lower().lstrip('.') in MEDIA_EXTENSIONS:
+            return f"{base_url}/media/{path.relative_to(AUDIO_CACHE_DIR).as_posix()}"
+        if path.parent == SCRIPT_DIR / 'base' and path.name in ('break.wav', 'final.wav'):
+            return f"{base_url}/base/{path.name}"
+        return None
+
+@st.cache_resource(show_spinner=False)
+def get_media_server():
+    """프로세스 공용 음성 서버 (시작할 수 없으면 None - 인라인 base64로 대체)"""
+    try:
+        return MediaServer(get_synthesis_loop())
+    except Exception as e:
+        print(f"음성 서버를 시작할 수 없습니다: {e}")
+        return None
+
+def media_base_url(server):
+    """
+    브라우저가 음성 서버에 접근할 주소 (EN600_MEDIA_BASE_URL, 없으면 접속한 페이지의 주소 + 음성 서버 포트).
+    HTTPS 페이지(혼합 콘텐츠로 막힘)이거나 이 컴퓨터에서만 받는 서버에 다른 컴퓨터가 접속했으면 None
+    """
+    if MEDIA_BASE_URL:
+        return MEDIA_BASE_URL.rstrip('/')
+    try:
+        from streamlit.web.server.websocket_headers import _get_websocket_headers
+        headers = _get_websocket_headers() or {}
+    except Exception:
+        headers = {}
+    origin = urllib.parse.urlsplit(headers.get('Origin', ''))
+    scheme = origin.scheme or headers.get('X-Forwarded-Proto', 'http').split(',')[0].strip()
+    hostname = origin.hostname or urllib.parse.urlsplit(f"//{headers.get('Host', 'localhost')}").hostname
+    if scheme != 'http' or not hostname:
+        return None
+    if server.loopback_only and hostname not in LOOPBACK_HOSTS:
+        return None
+    if ':' in hostname:
+        hostname = f"[{hostname}]"
+    return f"http://{hostname}:{server.port}"
+
+def reachable_media_server():
+    """브라우저가 접근할 수 있는 음성 서버와 그 주소 (없으면 (None, None) - 인라인 base64로 대체)"""
+    server = get_media_server()
+    base_url = media_base_url(server) if server is not None else None
+    return (server, base_url) if base_url is not None else (None, None)
+
+def audio_source(file_path):
+    """<audio>에 넣을 주소: 음성 서버 URL, 서버에 접근할 수 없으면 base64 data URI"""
+    server, base_url = reachable_media_server()
+    if server is not None:
+        url = server.url_for(file_path, base_url)
+        if url is not None:
+            return url
+    with open(file_path, 'rb') as f:
+        audio_base64 = base64.b64encode(f.read()).decode()
+    return f"data:{audio_mime_type(file_path)};base64,{audio_base64}"
+
+def audio_mime_type(file_path):
+    """파일 확장자에 맞는 MIME 형식"""
+    return AUDIO_MIME_TYPES.get(Path(file_path).suffix.lower(), 'audio/mpeg')
+
+def detect_audio_profile(settings):
+    """설정과 접속 기기(User-Agent)에 맞는 음성 전송 형식"""
+    profile = settings.get('audio_profile', 'auto')
+    if profile != 'auto':
+        return profile if profile in AUDIO_PROFILES else 'desktop'
+    try:
+        from streamlit.web.server.websocket_headers import _get_websocket_headers
+        user_agent = (_get_websocket_headers() or {}).get('User-Agent', '')
+    except Exception:
+        user_agent = ''
+    if re.search(r'iPhone|iPad|iPod', user_agent):
+        return 'mobile-mp3'
+    if re.search(r'Mobi|Android', user_agent):
+        return 'mobile'
+    return 'desktop'
+
+def encode_audio(samples, sample_rate, profile):
+    """PCM을 전송 형식에 맞게 인코딩해 (바이트, 확장자) 반환 (desktop은 MP3)"""
+    options = AUDIO_PROFILES.get(profile) or {'format': 'MP3', 'subtype': None, 'compression_level': None,
+                                              'extension': 'mp3'}
+    buffer = io.BytesIO()
+    sf.write(buffer, samples, sample_rate, format=options['format'], subtype=options['subtype'],
+             compression_level=options['compression_level'])
+    return buffer.getvalue(), options['extension']
+
+def profile_variant_key(source_key, profile):
+    """원본 음성 캐시 키에 대한 전송 형식별 변형의 캐시 키 (원본을 그대로 쓰는 형식이면 원본 키)"""
+    if AUDIO_PROFILES.get(profile) is None:
+        return source_key
+    return hashlib.sha256(f"{source_key}:{profile}".encode('utf-8')).hexdigest()
+
+def get_profile_variant(cache, source_path, profile):
+    """
+    캐시된 음성의 전송 형식별 변형 경로 (없으면 한 번 변환해 원본 옆에 캐시).
+    원본보다 크게 나오면 원본을 쓰고, 다시 변환하지 않도록 그 결정도 빈 표시 항목(.source)으로 캐시한다.
+    """
+    if AUDIO_PROFILES.get(profile) is None or not source_path:
+        return source_path
+    key = profile_variant_key(Path(source_path).stem, profile)
+    cached = cache.get(key)
+    if cached is not None:
+        return source_path if cached.suffix == '.source' else str(cached)
+    samples, sample_rate = sf.read(str(source_path), dtype='float32')
+    data, extension = encode_audio(samples, sample_rate, profile)
+    if len(data) >= Path(source_path).stat().st_size:
+        cache.put(key, b'', extension='source')
+        return source_path
+    return str(cache.put(key, data, extension=extension))
+
+def playback_wait_time(duration, sentence_interval, next_sentence, settings):
+    """음성 하나를 재생한 뒤 다음 동작까지 기다릴 시간 (재생 시간 포함)"""
+    if settings.get('audio_wait_mode', 'duration') == 'fixed':
+        return settings.get('fixed_wait_time', 2.0)
+    if next_sentence:
+        return duration + 0.3
+    base_wait = duration
+    extra_wait = duration * 0.1 if duration > 5 else 0.5
+    wait_time = base_wait + extra_wait + sentence_interval
+    return max(wait_time, duration + 0.3)
+
+def playback_gap(duration, sentence_interval, next_sentence, settings):
+    """실제 재생 끝을 알 수 있을 때 음성이 끝난 뒤 다음 동작까지 둘 간격"""
+    if settings.get('audio_wait_mode', 'duration') == 'fixed':
+        return max(0.0, settings.get('fixed_wait_time', 2.0) - duration)
+    return 0.0 if next_sentence else sentence_interval
+
+def playback_event_server(settings):
+    """
+    실제 재생 끝 알림을 받을 (음성 서버, 주소) (HTML5 재생, 재생 시간 기준 대기일 때만).
+    브라우저가 음성 서버에 접근할 수 없으면(HTTPS 페이지 등) (None, None) - 재생 시간으로 기다림
+    """
+    if settings.get('audio_playback_method', 'html5') != 'html5':
+        return None, None
+    if settings.get('audio_wait_mode', 'duration') != 'duration':
+        return None, None
+    return reachable_media_server()
+
+def audio_player_html(src, mime_type, event_url):
+    """
+    components.html 안에서 재생하는 <audio> (스크립트가 실행됨).
+    소리가 나기 시작할 때와 끝날 때(오류 포함) 음성 서버로 알림
+    """
+    return f"""
+        <audio id="player" autoplay="true">
+            <source src="{src}" type="{mime_type}">
+        </audio>
+        <script>
+            (function() {{
+                const audio = document.getElementById("player");
+                const report = event => fetch("{event_url}?event=" + event,
+                    {{method: "POST", mode: "no-cors", keepalive: true}}).catch(() => {{}});
+                audio.addEventListener("playing", () => report("playing"), {{once: true}});
+                audio.addEventListener("ended", () => report("ended"));
+                audio.addEventListener("error", () => report("ended"), true);
+            }})();
+        </script>
+    """
+
+def audio_element_html(src, mime_type='audio/mpeg'):
+    """자동 재생되는 <audio> 태그 (src는 URL 또는 data URI, 이전에 재생 중인 음성은 멈춤)"""
+    audio_id = f"audio_{int(time.time() * 1000)}"
+    return f"""
+        <audio id="{audio_id}" autoplay="true">
+            <source src="{src}" type="{mime_type}">
+        </audio>
+        <script>
+            (function() {{
+                const audio = document.getElementById("{audio_id}");
+                if (window.currentAudio && window.currentAudio !== audio) {{
+                    window.currentAudio.pause();
+                    window.currentAudio.currentTime = 0;
+                    window.currentAudio.remove();
+                }}
+                window.currentAudio = audio;
+                window.audioEnded = false;
+                audio.onended = function() {{
+                    window.audioEnded = true;
+                    if (window.currentAudio === audio) {{
+                        window.currentAudio = null;
+                    }}
+                    audio.remove();
+                }};
+                audio.onplay = function() {{
+                    window.audioEnded = false;
+                }};
+            }})();
+        </script>
+    """
+
+def clip_duration(file_path):
+    """음성 파일 재생 시간(초)"""
+    # 캐시된 음성은 저장할 때 기록한 값을 사용 (파일을 다시 읽지 않음)
+    info = get_audio_cache().info_for_path(file_path)
+    if info is not None:
+        return info['duration']
+    # 캐시 밖의 파일(알림음 등)은 헤더에서 읽음 (이름이 .wav인 MP3도 처리)
+    duration = AudioCache.probe(file_path)[0]
+    # 파일 읽기 실패 시 기본값 사용
+    return duration if duration is not None else 2.0
+
+def start_playback(file_path, container=None, event_url=None):
+    """
+    음성 재생을 시작하고 재생 시간(초)을 돌려줌 (기다리지 않음). 파일이 없으면 None.
+    저장된 설정에 따라 재생 방식 선택. container(st.empty)를 주면 이전 음성 자리에 그려서 겹쳐 재생되지 않음
+    """
+    if not file_path or not os.path.exists(file_path):
+        # 파일이 없는 경우 조용히 리턴
+        return None
+
+    settings = st.session_state.settings
+    playback_method = settings.get('audio_playback_method', 'html5')
+    duration = clip_duration(file_path)
+
+    target = container if container is not None else st
+    if playback_method == 'html5' and event_url is not None:
+        # 재생 끝을 알려 주는 플레이어 (스크립트가 실행되는 iframe)
+        try:
+            with target:
+                components.html(audio_player_html(audio_source(file_path), audio_mime_type(file_path), event_url),
+                                height=0)
+        except Exception:
+            pass
+    elif playback_method == 'html5':
+        # HTML5 Audio 방식
+        try:
+            target.markdown(audio_element_html(audio_source(file_path), audio_mime_type(file_path)),
+                            unsafe_allow_html=True)
+        except Exception:
+            # 오디오 재생 실패 시 조용히 넘어감
+            pass
+    else:
+        # Streamlit Audio 방식
+        try:
+            source = audio_source(file_path)
+            if source.startswith('data:'):
                 with open(file_path, 'rb') as f:
-                    audio_bytes = f.read()
-                duration = len(audio_bytes) / 32000
+                    source = f.read()
+            target.audio(source, format=audio_mime_type(file_path))
+        except Exception:
+            # 오디오 재생 실패 시 조용히 넘어감
+            pass
+    return duration
+
+def finish_playback(file_path):
+    """재생이 끝난 임시 음성 파일 정리"""
+    try:
+        if file_path and TEMP_DIR in Path(file_path).parents:
+            os.remove(file_path)
+    except Exception:
+        pass
+
+def play_audio(file_path, sentence_interval=1.0, next_sentence=False):
+    """
+    음성 파일 재생 후 다음 동작까지 기다림 (스레드를 막음, 이벤트 루프 밖에서 사용)
+    """
+    try:
+        player = session_mixer_player(st.session_state.settings)
+        if player is not None:
+            if file_path and os.path.exists(file_path):
+                gap = playback_gap(clip_duration(file_path), sentence_interval, next_sentence, st.session_state.settings)
+                player.play(file_path, gap).result(timeout=mixer_play_timeout(file_path, gap))
+            return
+        duration = start_playback(file_path)
+        if duration is not None:
+            # 대기 시간 계산
+            time.sleep(playback_wait_time(duration, sentence_interval, next_sentence, st.session_state.settings))
+    except Exception:
+        # 오류 발생 시 경고 없이 계속 진행
+        pass
+    finally:
+        finish_playback(file_path)
+
+async def play_audio_async(file_path, sentence_interval=1.0, next_sentence=False, container=None):
+    """
+    play_audio와 같지만 asyncio.sleep으로 기다려서, 재생하는 동안 같은 루프의 합성/자막 갱신이 함께 진행됨.
+    container를 주면 브라우저가 알려 주는 실제 재생 끝에 맞춰 간격만 두고 바로 다음으로 넘어감
+    (알림이 오지 않으면 재생 시간 + 평균 시작 지연 + 여유만큼 기다림).
+    서버 스피커 재생(pygame)이면 채널에서 음성이 끝나는 시점을 기다림
+    """
+    try:
+        settings = st.session_state.settings
+        player = session_mixer_player(settings)
+        if player is not None:
+            # 서버 스피커: 음성과 뒤따르는 간격을 한 번에 채널에 이어 붙이고 끝날 때까지 기다림
+            if file_path and os.path.exists(file_path):
+                gap = playback_gap(clip_duration(file_path), sentence_interval, next_sentence, settings)
+                await asyncio.wait_for(asyncio.wrap_future(player.play(file_path, gap)),
+                                       mixer_play_timeout(file_path, gap))
+            return
+
+        server, base_url = playback_event_server(settings) if container is not None else (None, None)
+        if server is None:
+            duration = start_playback(file_path, container)
+            if duration is not None:
+                await asyncio.sleep(playback_wait_time(duration, sentence_interval, next_sentence, settings))
+            return
+
+        tracker = server.tracker
+        playback_id = tracker.expect()
+        try:
+            duration = start_playback(file_path, container, f"{base_url}/events/{playback_id}")
+            if duration is None:
+                return
+            latency = tracker.start_latency if tracker.start_latency is not None else 0.5
+            await tracker.wait_ended(playback_id, duration + latency + PLAYBACK_EVENT_GRACE)
+        finally:
+            # 재생을 시작하지 못했거나 기다리다 취소돼도 재생 ID를 남기지 않음
+            tracker.discard(playback_id)
+        await asyncio.sleep(playback_gap(duration, sentence_interval, next_sentence, settings))
+    except asyncio.CancelledError:
+        raise
+    except Exception:
+        # 오류 발생 시 경고 없이 계속 진행
+        pass
+    finally:
+        finish_playback(file_path)
+
+class TTSBackend:
+    """
+    음성 합성 엔진 인터페이스.
+    output_format은 캐시 키에 들어가므로 엔진마다(그리고 출력이 바뀌면) 달라야 한다.
+    """
+
+    name = None
+    output_format = None
+    # 다시 시도하면 나을 수 있는 오류 (시간 초과, 연결 문제). 나머지는 문장/음성 자체의 문제로 보고 재시도하지 않음
+    transient_errors = (asyncio.TimeoutError, OSError)
+
+    async def synthesize(self, text, voice, rate):
+        """text를 voice로 rate('+50%' 등) 속도로 합성해 MP3 바이트로 반환 (실패하면 예외)"""
+        raise NotImplementedError
+
+class EdgeTTSBackend(TTSBackend):
+    """Microsoft Edge 온라인 음성 (edge-tts)"""
+
+    name = 'edge'
+    output_format = EDGE_TTS_OUTPUT_FORMAT
+    # NoAudioReceived(문장부호만 있는 셀 등), 잘못된 음성 이름(ValueError)은 서버 장애가 아님
+    transient_errors = TTSBackend.transient_errors + (
+        aiohttp.ClientError, edge_tts.exceptions.WebSocketError,
+        edge_tts.exceptions.UnexpectedResponse, edge_tts.exceptions.UnknownResponse
+    )
+
+    async def synthesize(self, text, voice, rate):
+        communicate = edge_tts.Communicate(text, voice, rate=rate)
+        chunks = []
+        async for message in communicate.stream():
+            if message['type'] == 'audio':
+                chunks.append(message['data'])
+        if not chunks:
+            raise SynthesisError(f"edge-tts가 빈 음성을 돌려주었습니다: {voice}")
+        return b''.join(chunks)
+
+class LocalTTSBackend(TTSBackend):
+    """
+    네트워크 없이 동작하는 결정적 포먼트 합성 엔진.
+    실제 음성은 아니지만 문장 길이/배속에 맞는 길이의 음성을 만들므로
+    오프라인 벤치마크·부하 테스트와 온라인 음성 장애 시 대체용으로 쓴다.
+    """
+
+    name = 'local'
+    output_format = LOCAL_TTS_OUTPUT_FORMAT
+    sample_rate = 24000
+    syllable_seconds = 0.17
+    # 모음별 (F1, F2) 포먼트 주파수 (Hz)
+    vowel_formants = [(730, 1090), (530, 1840), (270, 2290), (570, 840), (300, 870)]
+    unit_pattern = re.compile(f'[{NGRAM_CHARS}]|[^\\W\\d_]+|\\d+|[.,!?;:。、！？]')
+    pause_seconds = {',': 0.2, '、': 0.2, ';': 0.25, ':': 0.25}
+
+    @staticmethod
+    def _seed(value):
+        return int(hashlib.sha256(value.encode('utf-8')).hexdigest()[:8], 16)
+
+    def _syllable(self, unit, f0, seconds, rng):
+        """모음 하나를 배음 합성(포먼트 공명으로 배음 크기 결정)으로 생성"""
+        n = max(1, int(seconds * self.sample_rate))
+        t = np.arange(n) / self.sample_rate
+        f1, f2 = self.vowel_formants[self._seed(unit) % len(self.vowel_formants)]
+        harmonics = np.arange(1, int(4000 / f0) + 1)
+        frequencies = harmonics * f0
+        amplitudes = 1 / (1 + ((frequencies - f1) / 90) ** 2) + 0.6 / (1 + ((frequencies - f2) / 120) ** 2)
+        # 음절 안에서 음높이가 조금 내려가도록
+        phase = 2 * np.pi * np.cumsum(np.linspace(1.04, 0.96, n)) * f0 / self.sample_rate
+        wave = (amplitudes[:, None] * np.sin(np.outer(harmonics, phase))).sum(axis=0)
+        # 자음 자리에 짧은 잡음
+        burst = min(n, int(0.02 * self.sample_rate))
+        wave[:burst] += rng.standard_normal(burst) * np.abs(wave).max() * 0.3
+        envelope = np.minimum(1, np.minimum(np.arange(n), np.arange(n)[::-1]) / (0.015 * self.sample_rate))
+        return wave * envelope
+
+    def render(self, text, voice, rate):
+        """합성 본체 (CPU 작업) - MP3 바이트 반환"""
+        factor = max(0.3, 1 + int(rate.rstrip('%')) / 100)
+        rng = np.random.default_rng(self._seed(f"{voice}|{text}"))
+        base_f0 = 95 + self._seed(voice) % 140  # 음성마다 고정된 기본 음높이
+        units = self.unit_pattern.findall(text)
+        if not units:
+            raise SynthesisError("합성할 글자가 없습니다.")
+
+        pieces = []
+        for position, unit in enumerate(units):
+            if unit in '.!?。！？':
+                pieces.append(np.zeros(int(0.35 / factor * self.sample_rate)))
+                continue
+            if unit in self.pause_seconds:
+                pieces.append(np.zeros(int(self.pause_seconds[unit] / factor * self.sample_rate)))
+                continue
+            # 라틴 문자 등은 모음 묶음 수를 음절 수로 사용
+            syllables = max(1, len(re.findall('[aeiouyáéíóúàèìòùâêôăơư]+', unit.lower()))) if len(unit) > 1 else 1
+            f0 = base_f0 * (1.08 - 0.16 * position / max(1, len(units)))
+            for k in range(syllables):
+                pieces.append(self._syllable(f"{unit}{k}", f0, self.syllable_seconds / factor, rng))
+            pieces.append(np.zeros(int(0.04 / factor * self.sample_rate)))
+
+        audio = np.concatenate(pieces)
+        audio = (0.3 * audio / max(1e-9, np.abs(audio).max())).astype(np.float32)
+        buffer = io.BytesIO()
+        sf.write(buffer, audio, self.sample_rate, format='MP3')
+        return buffer.getvalue()
+
+    async def synthesize(self, text, voice, rate):
+        return await asyncio.to_thread(self.render, text, voice, rate)
+
+class ProcessSemaphore:
+    """
+    여러 스레드의 이벤트 루프가 함께 쓰는 비동기 세마포어.
+    (asyncio.Semaphore는 한 루프에서만 쓸 수 있어 합성 루프와 스크립트 루프가 한도를 나눌 수 없음)
+    """
+
+    def __init__(self, value):
+        self._value = value
+        self._lock = threading.Lock()
+        self._waiters = collections.deque()
+
+    async def acquire(self):
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if self._value > 0 and not self._waiters:
+                self._value -= 1
+                return
+            future = loop.create_future()
+            self._waiters.append((loop, future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            with self._lock:
+                try:
+                    self._waiters.remove((loop, future))
+                    granted = False
+                except ValueError:
+                    granted = True
+            # 자리를 넘겨받은 뒤 취소되었으면 다시 반납
+            if granted and future.done() and not future.cancelled():
+                self.release()
+            raise
+
+    def _grant(self, future):
+        if future.cancelled():
+            self.release()
+        else:
+            future.set_result(None)
+
+    def release(self):
+        with self._lock:
+            if self._waiters:
+                # 기다리는 쪽에 자리를 바로 넘김 (그 루프의 스레드에서 깨움)
+                loop, future = self._waiters.popleft()
+                loop.call_soon_threadsafe(self._grant, future)
+            else:
+                self._value += 1
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.release()
+
+class CircuitBreaker:
+    """
+    연속 실패가 failure_threshold번 쌓이면 reset_timeout초 동안 요청을 막고(open),
+    그 뒤 한 번만 시험 요청을 허용해(half-open) 성공하면 다시 연다(closed).
+    """
+
+    def __init__(self, failure_threshold=TTS_BREAKER_FAILURES, reset_timeout=TTS_BREAKER_RESET):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._trial_running = False
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state()
+
+    def _state(self):
+        if self._opened_at is None:
+            return 'closed'
+        if time.monotonic() - self._opened_at >= self.reset_timeout:
+            return 'half-open'
+        return 'open'
+
+    def retry_after(self):
+        """다시 시도할 수 있을 때까지 남은 시간(초)"""
+        with self._lock:
+            if self._opened_at is None:
+                return 0.0
+            return max(0.0, self.reset_timeout - (time.monotonic() - self._opened_at))
+
+    def before_call(self):
+        """요청 전에 호출: 막힌 상태면 CircuitOpenError, 시험 요청으로 허용했으면 True"""
+        with self._lock:
+            state = self._state()
+            if state == 'closed':
+                return False
+            if state == 'half-open' and not self._trial_running:
+                self._trial_running = True
+                return True
+        raise CircuitOpenError(f"음성 서버 요청이 일시 중단되었습니다 ({self.retry_after():.0f}초 후 재시도).")
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._trial_running or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+            self._trial_running = False
+
+    def release_trial(self):
+        """시험 요청이 결과 없이 끝났을 때(취소) 상태는 그대로 두고 다음 시험 요청을 허용"""
+        with self._lock:
+            self._trial_running = False
+
+class ResilientTTSBackend(TTSBackend):
+    """
+    음성 엔진에 요청 제한 시간, 지터를 준 지수 백오프 재시도, 프로세스 전체 동시 요청 한도,
+    서킷 브레이커를 씌운 래퍼. 캐시 키가 바뀌지 않도록 이름과 출력 형식은 감싼 엔진을 따른다.
+    """
+
+    def __init__(self, backend, timeout=TTS_REQUEST_TIMEOUT, retries=TTS_RETRIES,
+                 max_inflight=TTS_MAX_INFLIGHT, breaker=None, backoff_base=0.5, backoff_cap=8.0):
+        self.backend = backend
+        self.name = backend.name
+        self.output_format = backend.output_format
+        self.timeout = timeout
+        self.retries = retries
+        self.semaphore = ProcessSemaphore(max_inflight)
+        self.breaker = breaker or CircuitBreaker()
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+
+    async def synthesize(self, text, voice, rate):
+        for attempt in range(self.retries + 1):
+            # 서버 장애 중이면 기다리지 않고 바로 실패 (대체 엔진으로 넘어가도록)
+            trial = self.breaker.before_call()
+            try:
+                async with self.semaphore:
+                    audio_bytes = await asyncio.wait_for(self.backend.synthesize(text, voice, rate), self.timeout)
+                self.breaker.record_success()
+                return audio_bytes
+            except asyncio.CancelledError:
+                # 레슨 중단 등으로 취소된 시험 요청이 half-open 자리를 계속 차지하지 않도록 반납
+                if trial:
+                    self.breaker.release_trial()
+                raise
+            except self.backend.transient_errors as e:
+                # 요청 하나가 재시도까지 모두 실패했을 때만 실패 한 번으로 셈 (시험 요청은 바로)
+                if trial or attempt >= self.retries:
+                    self.breaker.record_failure()
+                    if isinstance(e, asyncio.TimeoutError):
+                        raise SynthesisError(f"음성 합성 시간 초과 ({self.timeout:g}초): {voice}") from e
+                    raise
+                # 전체 지터 백오프: 0 ~ min(상한, 기준 * 2^시도) 사이에서 무작위로 대기
+                await asyncio.sleep(random.uniform(0, min(self.backoff_cap, self.backoff_base * 2 ** attempt)))
             except Exception:
-                # 파일 읽기 실패 시 기본값 사용
-                duration = 2.0
+                # 내용 오류: 서버는 응답했으므로 재시도하지 않고 서킷 브레이커에도 세지 않음
+                if trial:
+                    self.breaker.release_trial()
+                raise
+
+@process_resource
+def get_edge_tts_client():
+    """프로세스 공용 edge-tts 클라이언트 (동시 요청 한도와 서킷 브레이커를 모든 세션이 공유)"""
+    return ResilientTTSBackend(EdgeTTSBackend())
+
+TTS_BACKENDS = {
+    'edge': EdgeTTSBackend,
+    'local': LocalTTSBackend
+}
+
+def get_tts_backends(settings):
+    """설정에 따른 음성 엔진 목록 (앞에서부터 시도, 온라인 엔진이 실패하면 로컬 엔진으로 대체)"""
+    primary = settings.get('tts_backend', 'edge')
+    if primary == 'local':
+        backends = [LocalTTSBackend()]
+    else:
+        backends = [get_edge_tts_client()]
+    if settings.get('tts_fallback', True) and backends[0].name != 'local':
+        backends.append(LocalTTSBackend())
+    return backends
+
+def _k_weighting_filters(sample_rate):
+    """BS.1770 K 가중 필터 (고역 쉘프 + 고역 통과) 계수 [(b, a), (b, a)]"""
+    filters = []
+    # 고역 쉘프: +4dB, 1500Hz
+    gain, q, fc = 4.0, 1 / np.sqrt(2), 1500.0
+    a = 10 ** (gain / 40)
+    w0 = 2 * np.pi * fc / sample_rate
+    alpha = np.sin(w0) / (2 * q)
+    cos_w0 = np.cos(w0)
+    filters.append((
+        np.array([a * ((a + 1) + (a - 1) * cos_w0 + 2 * np.sqrt(a) * alpha),
+                  -2 * a * ((a - 1) + (a + 1) * cos_w0),
+                  a * ((a + 1) + (a - 1) * cos_w0 - 2 * np.sqrt(a) * alpha)]),
+        np.array([(a + 1) - (a - 1) * cos_w0 + 2 * np.sqrt(a) * alpha,
+                  2 * ((a - 1) - (a + 1) * cos_w0),
+                  (a + 1) - (a - 1) * cos_w0 - 2 * np.sqrt(a) * alpha])
+    ))
+    # 고역 통과: 38Hz
+    q, fc = 0.5, 38.0
+    w0 = 2 * np.pi * fc / sample_rate
+    alpha = np.sin(w0) / (2 * q)
+    cos_w0 = np.cos(w0)
+    filters.append((
+        np.array([(1 + cos_w0) / 2, -(1 + cos_w0), (1 + cos_w0) / 2]),
+        np.array([1 + alpha, -2 * cos_w0, 1 - alpha])
+    ))
+    return filters
+
+def integrated_loudness(samples, sample_rate):
+    """모노 음성의 BS.1770 통합 음량 (LUFS, 400ms 블록, 절대/상대 게이트), 무음이면 None"""
+    weighted = samples.astype(np.float64)
+    for b, a in _k_weighting_filters(sample_rate):
+        weighted = scipy.signal.lfilter(b, a, weighted)
+
+    block = int(0.4 * sample_rate)
+    step = int(0.1 * sample_rate)
+    if len(weighted) < block:
+        powers = np.array([np.mean(weighted ** 2)])
+    else:
+        # 75% 겹치는 400ms 블록의 평균 제곱 (누적합으로 한 번에 계산)
+        cumulative = np.concatenate([[0.0], np.cumsum(weighted ** 2)])
+        starts = np.arange(0, len(weighted) - block + 1, step)
+        powers = (cumulative[starts + block] - cumulative[starts]) / block
+
+    with np.errstate(divide='ignore'):
+        loudness = -0.691 + 10 * np.log10(powers)
+    gated = powers[loudness > -70]
+    if len(gated) == 0:
+        return None
+    relative_gate = -0.691 + 10 * np.log10(gated.mean()) - 10
+    gated = powers[(loudness > -70) & (loudness > relative_gate)]
+    return -0.691 + 10 * np.log10(gated.mean())
+
+def postprocess_clip(audio_bytes):
+    """
+    캐시에 넣기 전 한 번만 하는 음성 후처리: 앞뒤 무음 제거 후 TARGET_LUFS로 음량 맞춤.
+    원본과 같은 형식(MP3)으로 다시 인코딩해 반환하며, 읽을 수 없는 데이터는 그대로 둔다.
+    """
+    try:
+        samples, sample_rate = sf.read(io.BytesIO(audio_bytes), dtype='float32')
+    except Exception:
+        return audio_bytes
+    if samples.ndim > 1:
+        samples = samples.mean(axis=1)
+    if len(samples) == 0:
+        return audio_bytes
+
+    import librosa  # 가져오는 데 몇 초 걸리므로 필요할 때만 (합성 직후 후처리에서 한 번)
+    _, (start, end) = librosa.effects.trim(samples, top_db=TRIM_TOP_DB)
+    pad = int(TRIM_PAD_SECONDS * sample_rate)
+    samples = samples[max(0, start - pad):min(len(samples), end + pad)]
+
+    loudness = integrated_loudness(samples, sample_rate)
+    if loudness is not None:
+        samples = samples * 10 ** ((TARGET_LUFS - loudness) / 20)
+        peak = np.abs(samples).max()
+        if peak > PEAK_LIMIT:
+            samples = samples * (PEAK_LIMIT / peak)
+
+    buffer = io.BytesIO()
+    sf.write(buffer, samples.astype(np.float32), sample_rate, format='MP3')
+    return buffer.getvalue()
+
+class FileLock:
+    """
+    프로세스 사이의 배타 잠금 (잠금 파일에 flock, Windows는 msvcrt). 기다리지 않고 시도만 한다.
+    잠금 파일은 놓을 때 지운다 (잡은 뒤 파일이 지워졌거나 바뀌었으면 다시 시도하도록 False).
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._file = None
+
+    def try_acquire(self):
+        """잠금을 잡으면 True (다른 프로세스가 잡고 있으면 False)"""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        handle = open(self.path, 'a+b')
+        try:
+            if fcntl is not None:
+                fcntl.flock(handle.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            else:
+                handle.seek(0)
+                msvcrt.locking(handle.fileno(), msvcrt.LK_NBLCK, 1)
+        except OSError:
+            handle.close()
+            return False
+        if fcntl is not None:
+            # 앞서 잡았던 쪽이 놓으면서 지운 파일을 잡았으면 무효 (새 파일을 잡은 다른 프로세스와 겹치지 않도록)
+            try:
+                current = os.stat(self.path).st_ino
+            except FileNotFoundError:
+                current = None
+            if current != os.fstat(handle.fileno()).st_ino:
+                handle.close()
+                return False
+        self._file = handle
+        return True
+
+    def release(self):
+        if self._file is None:
+            return
+        try:
+            if fcntl is not None:
+                # 잠금을 잡은 채로 지워야 기다리던 쪽이 지워진 파일을 잡지 않음 (try_acquire에서 확인)
+                self.path.unlink(missing_ok=True)
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+            else:
+                self._file.seek(0)
+                msvcrt.locking(self._file.fileno(), msvcrt.LK_UNLCK, 1)
+        finally:
+            self._file.close()
+            self._file = None
+        if fcntl is None:
+            # Windows는 열려 있는 파일을 지울 수 없으므로 닫은 뒤 (다른 프로세스가 열고 있으면 남겨 둠)
+            try:
+                self.path.unlink(missing_ok=True)
+            except OSError:
+                pass
+
+class FlightAbandoned(Exception):
+    """앞서 합성하던 쪽이 취소되어 기다리던 쪽이 다시 시도해야 함"""
+
+class SingleFlight:
+    """
+    같은 키의 작업을 한 번만 실행하고 기다리는 모두에게 같은 결과를 돌려줌.
+    프로세스 안에서는 키별 Future를 나눠 갖고 (세션마다 이벤트 루프가 달라도 됨),
+    프로세스 사이에서는 키별 잠금 파일로 한 프로세스만 합성하고 나머지는 캐시에 결과가 생기기를 기다린다.
+    """
+
+    def __init__(self, lock_dir=SYNTHESIS_LOCK_DIR, lock_wait=SYNTHESIS_LOCK_WAIT, poll=0.05):
+        self.lock_dir = Path(lock_dir)
+        self.lock_wait = lock_wait
+        self.poll = poll
+        self.started = 0  # 실제로 실행한 작업 수
+        self.joined = 0  # 다른 요청의 결과를 받아 간 수
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    async def run(self, key, factory, check):
+        """
+        key 작업 결과 반환. check()는 이미 만들어진 결과(없으면 None), factory()는 결과를 만드는 코루틴.
+        """
+        while True:
+            with self._lock:
+                future = self._flights.get(key)
+                leader = future is None
+                if leader:
+                    future = self._flights[key] = concurrent.futures.Future()
+            if leader:
+                return await self._lead(key, future, factory, check)
+            try:
+                # 기다리던 세션이 멈춰도 앞선 작업은 취소하지 않음
+                result = await asyncio.shield(asyncio.wrap_future(future))
+                with self._lock:
+                    self.joined += 1
+                return result
+            except FlightAbandoned:
+                continue
+
+    async def _lead(self, key, future, factory, check):
+        lock = FileLock(self.lock_dir / key[:2] / f"{key}.lock")
+        try:
+            result = None
+            deadline = time.monotonic() + self.lock_wait
+            # 다른 프로세스가 합성 중이면 잠금이 풀리거나 캐시에 결과가 생길 때까지 기다림
+            while not lock.try_acquire():
+                result = check()
+                if result is not None or time.monotonic() > deadline:
+                    break
+                await asyncio.sleep(self.poll)
+            if result is None:
+                result = check()
+            if result is None:
+                with self._lock:
+                    self.started += 1
+                result = await factory()
+            future.set_result(result)
+            return result
+        except asyncio.CancelledError:
+            future.set_exception(FlightAbandoned())
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            lock.release()
+            with self._lock:
+                if self._flights.get(key) is future:
+                    del self._flights[key]
+
+@process_resource
+def get_single_flight():
+    """프로세스 공용 합성 중복 제거기"""
+    return SingleFlight()
+
+async def synthesize_clip(text, voice, speed, cache, backend, stretcher=None):
+    """
+    backend로 음성 하나를 캐시에 만들고 경로 반환 (이미 있으면 재사용, 실패하면 예외).
+    합성한 음성은 후처리(postprocess_clip)한 뒤 저장한다.
+    stretcher가 있으면 1배속 음성만 합성하고 다른 배속은 로컬에서 변환한다.
+    """
+    key = clip_cache_key(text, voice, speed, stretched=stretcher is not None, backend=backend)
+    cached = cache.get(key)
+    if cached is not None:
+        return cached
 
-        if playback_method == 'html5':
-            # HTML5 Audio 방식
-            try:
-                with open(file_path, 'rb') as f:
-                    audio_bytes = f.read()
-                audio_base64 = base64.b64encode(audio_bytes).decode()
+    async def produce():
+        if stretcher is not None and float(speed) != 1.0:
+            base_path = await synthesize_clip(text, voice, 1.0, cache, backend)
+            return cache.put(key, await stretcher.stretch(base_path, speed))
+        audio_bytes = await backend.synthesize(text, voice, speed_to_rate(speed))
+        # 무음 제거·음량 맞춤은 저장할 때 한 번만 (재생 시간 색인도 처리된 길이로 기록됨)
+        return cache.put(key, await asyncio.to_thread(postprocess_clip, audio_bytes))
 
-                audio_id = f"audio_{int(time.time() * 1000)}"
-                
-                st.markdown(f"""
-                    <audio id="{audio_id}" autoplay="true">
-                        <source src="data:audio/wav;base64,{audio_base64}" type="audio/wav">
-                    </audio>
-                    <script>
-                        (function() {{
-                            const audio = document.getElementById("{audio_id}");
-                            if (window.currentAudio && window.currentAudio !== audio) {{
-                                window.currentAudio.pause();
-                                window.currentAudio.currentTime = 0;
-                                window.currentAudio.remove();
-                            }}
-                            window.currentAudio = audio;
-                            window.audioEnded = false;
-                            audio.onended = function() {{
-                                window.audioEnded = true;
-                                if (window.currentAudio === audio) {{
-                                    window.currentAudio = null;
-                                }}
-                                audio.remove();
-                            }};
-                            audio.onplay = function() {{
-                                window.audioEnded = false;
-                            }};
-                        }})();
-                    </script>
-                """, unsafe_allow_html=True)
-            except Exception:
-                # 오디오 재생 실패 시 조용히 넘어감
-                pass
-        else:
-            # Streamlit Audio 방식
-            try:
-                with open(file_path, 'rb') as f:
-                    audio_bytes = f.read()
-                st.audio(audio_bytes, format='audio/wav')
-            except Exception:
-                # 오디오 재생 실패 시 조용히 넘어감
-                pass
+    # 여러 세션(프로세스)이 같은 음성을 동시에 요청해도 합성은 한 번만
+    return await get_single_flight().run(key, produce, lambda: cache.get(key) if cache.contains(key) else None)
 
-        # 대기 시간 계산
-        if wait_mode == 'fixed':
-            wait_time = settings.get('fixed_wait_time', 2.0)
-        else:
-            if next_sentence:
-                wait_time = duration + 0.3
-            else:
-                base_wait = duration
-                extra_wait = duration * 0.1 if duration > 5 else 0.5
-                wait_time = base_wait + extra_wait + sentence_interval
-                wait_time = max(wait_time, duration + 0.3)
+class ClipStretcher:
+    """
+    1배속 음성을 음높이는 유지한 채 배속 변환 (librosa 위상 보코더).
+    계산은 프로세스 풀에서 하므로 재생/합성 루프를 막지 않는다.
+    """
 
-        time.sleep(wait_time)
+    def __init__(self, workers=STRETCH_WORKERS):
+        import librosa  # 가져오는 데 몇 초 걸리므로 배속 변환 모드에서만
+        self.pool = concurrent.futures.ProcessPoolExecutor(max_workers=workers)
+        # 작업 프로세스마다 첫 변환에 걸리는 준비 시간(1~2초)을 미리 치름
+        for _ in range(workers):
+            self.pool.submit(functools.partial(librosa.effects.time_stretch, np.zeros(4096, dtype=np.float32), rate=1.5))
 
-    except Exception:
-        # 오류 발생 시 경고 없이 계속 진행
-        pass
-    finally:
-        try:
-            if file_path and TEMP_DIR in Path(file_path).parents:
-                os.remove(file_path)
-        except Exception:
-            pass
+    async def stretch(self, source_path, speed):
+        """source_path 음성을 speed배로 변환해 MP3 바이트로 반환 (파일 읽기와 인코딩도 루프 밖에서)"""
+        import librosa
+        samples, sample_rate = await asyncio.to_thread(sf.read, str(source_path), dtype='float32')
+        if samples.ndim > 1:
+            samples = samples.mean(axis=1)
+        # 풀 작업자에는 librosa 함수만 넘김 (streamlit 스크립트 모듈의 함수는 다른 프로세스에서 찾을 수 없음)
+        stretched = await asyncio.get_running_loop().run_in_executor(
+            self.pool, functools.partial(librosa.effects.time_stretch, samples, rate=float(speed))
+        )
+        audio_bytes, _ = await asyncio.to_thread(encode_audio, stretched, sample_rate, 'desktop')
+        return audio_bytes
 
-async def get_voice_file(text, voice, speed=1.0, output_file=None):
-    """음성 파일 생성 함수 개선"""
+@st.cache_resource(show_spinner=False)
+def get_clip_stretcher():
+    """프로세스 공용 배속 변환기"""
+    return ClipStretcher()
+
+async def get_voice_file(text, voice, speed=1.0, output_file=None, cache=None, stretcher=None, backends=None,
+                         priority=0):
+    """
+    음성 파일 생성 함수 개선 (영구 음성 캐시 사용).
+    backends의 엔진을 차례로 시도하고 (기본: edge-tts), 모두 실패하면 None.
+    stretcher가 있으면 1배속 음성만 합성하고 다른 배속은 로컬에서 변환한다.
+    합성 작업자(EN600_SYNTH_WORKER)가 있으면 작업자에게 맡기고 (priority가 작을수록 먼저), 연결할 수 없으면 앱 안에서 합성한다.
+    """
     try:
         # 빈 텍스트 체크
         if not text or text.isspace():
@@ -1060,35 +3614,826 @@ async def get_voice_file(text, voice, speed=1.0, output_file=None):
         if voice is None:
             return None
             
-        # 파일명 해시 생성
-        text_hash = hashlib.md5(text.encode()).hexdigest()
-        
-        if output_file is None:
-            output_file = TEMP_DIR / f"temp_{voice}_{speed}_{text_hash[:8]}.wav"
-            
-        # 이미 존재하는 파일이면 재사용
-        if output_file.exists():
-            return str(output_file)
+        backends = backends or [EdgeTTSBackend()]
         
-        try:
-            # edge-tts로 음성 생성
-            communicate = edge_tts.Communicate(text, voice, rate=f"+{int((speed-1)*100)}%")
-            await communicate.save(str(output_file))
-            
-            # 파일 생성 확인
-            if output_file.exists():
+        if output_file is not None:
+            # 지정된 경로에 저장 (알림음 등)
+            if Path(output_file).exists():
                 return str(output_file)
-            else:
-                # 오류 메시지 없이 None 반환
+
+            async def produce():
+                for backend in backends:
+                    try:
+                        if backend.name != 'edge':
+                            # 대체(로컬) 엔진 음성은 고정 경로에 남기지 않고 엔진별 캐시에 둠
+                            # (온라인 엔진을 다시 쓸 수 있게 되면 그때 고정 경로에 만듦)
+                            return str(await synthesize_clip(text, voice, speed, cache or get_audio_cache(), backend))
+                        atomic_write_bytes(output_file, await backend.synthesize(text, voice, speed_to_rate(speed)))
+                        return str(output_file)
+                    except Exception:
+                        continue
+                raise SynthesisError(f"{output_file} 음성을 만들 수 없습니다.")
+
+            # 여러 세션이 동시에 시작해도 한 번만 합성
+            key = hashlib.sha256(str(Path(output_file).resolve()).encode('utf-8')).hexdigest()
+            try:
+                return await get_single_flight().run(
+                    key, produce, lambda: str(output_file) if Path(output_file).exists() else None
+                )
+            except SynthesisError:
                 return None
-        except Exception:
-            # 음성 생성 실패 시 자막만 표시
-            return None
+        
+        # 엔진마다 캐시를 먼저 보고, 없으면 합성 (실패하면 다음 엔진으로)
+        cache = cache or get_audio_cache()
+        worker = get_synthesis_worker_client()
+        for backend in backends:
+            try:
+                if worker is not None:
+                    try:
+                        return await worker.synthesize(text, voice, speed, backend.name, stretcher is not None, priority)
+                    except OSError:
+                        # 작업자에 연결할 수 없거나 응답이 없으면 앱 안에서 합성
+                        pass
+                return str(await synthesize_clip(text, voice, speed, cache, backend, stretcher))
+            except Exception:
+                continue
+        # 모든 엔진이 실패하면 자막만 표시
+        return None
             
     except Exception as e:
         # 자세한 오류 메시지 없이 None 반환
         return None
 
+class RateLimiter:
+    """토큰 버킷 요청 속도 제한 (초당 rate개, 최대 burst개까지 몰아서)"""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst or max(1, int(rate))
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+class SynthesisWorker:
+    """
+    독립 합성 작업자 (python en600_pro.py worker).
+    모든 세션의 (문장, 음성, 배속) 요청을 한 우선순위 큐에 모으고, 같은 요청은 하나로 합쳐(coalesce) 한 번만 합성한다.
+    캐시에 없는 요청만 속도 제한을 거쳐 합성하며, 결과는 공유 음성 캐시에 저장하고 경로를 돌려준다.
+    요청/응답은 TCP 위의 JSON 한 줄씩.
+    """
+
+    def __init__(self, cache, concurrency=TTS_MAX_INFLIGHT, rate=10.0):
+        self.cache = cache
+        self.concurrency = concurrency
+        self.limiter = RateLimiter(rate)
+        self.backends = {'edge': ResilientTTSBackend(EdgeTTSBackend()), 'local': LocalTTSBackend()}
+        self.stretcher = None
+        self.queue = asyncio.PriorityQueue()
+        self.pending = {}  # 작업 -> 결과 Future (같은 작업을 기다리는 요청이 함께 받음)
+        self.queued = {}  # 아직 꺼내지 않은 작업 -> 큐에 들어 있는 가장 급한 우선순위
+        self.in_flight = set()  # 지금 합성 중인 작업
+        self._order = itertools.count()  # 같은 우선순위는 먼저 온 순서대로
+        self.completed = 0
+        self.coalesced = 0
+        self.failed = 0
+
+    def submit(self, job, priority=0):
+        """작업을 큐에 넣고 결과 Future 반환 (이미 기다리는 같은 작업이 있으면 합침)"""
+        future = self.pending.get(job)
+        if future is None:
+            future = self.pending[job] = asyncio.get_running_loop().create_future()
+        else:
+            self.coalesced += 1
+            # 이미 합성 중이거나 큐에 같은/더 급한 순위로 있으면 그대로 기다림
+            if job in self.in_flight or priority >= self.queued.get(job, priority):
+                return future
+        # 더 급한 요청이면 앞쪽에 다시 넣음 (예전 순위의 항목은 꺼낼 때 건너뜀)
+        self.queued[job] = priority
+        self.queue.put_nowait((priority, next(self._order), job))
+        return future
+
+    async def _process(self, job):
+        text, voice, speed, backend_name, stretched = job
+        backend = self.backends[backend_name]
+        stretcher = None
+        if stretched:
+            if self.stretcher is None:
+                self.stretcher = ClipStretcher()
+            stretcher = self.stretcher
+        key = clip_cache_key(text, voice, speed, stretched=stretched, backend=backend)
+        if not self.cache.contains(key):
+            await self.limiter.acquire()
+        return str(await synthesize_clip(text, voice, speed, self.cache, backend, stretcher))
+
+    async def _run(self):
+        while True:
+            priority, _, job = await self.queue.get()
+            future = self.pending.get(job)
+            if future is None or future.done() or job in self.in_flight or self.queued.get(job) != priority:
+                continue  # 다른 쪽이 처리 중/처리했거나 더 급한 순위로 다시 넣은 항목
+            del self.queued[job]
+            self.in_flight.add(job)
+            try:
+                path = await self._process(job)
+                if not future.done():
+                    future.set_result(path)
+                self.completed += 1
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+                self.failed += 1
+            finally:
+                self.in_flight.discard(job)
+                self.pending.pop(job, None)
+                if not future.done():  # 작업자 종료로 취소된 경우 기다리던 요청도 끝냄
+                    future.cancel()
+
+    async def handle(self, reader, writer):
+        """연결 하나에서 요청을 한 줄씩 받아 응답 (한 연결에 여러 요청 가능)"""
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    request = json.loads(line)
+                    if request.get('op') == 'stats':
+                        response = {'queued': self.queue.qsize(), 'pending': len(self.pending),
+                                    'completed': self.completed, 'coalesced': self.coalesced, 'failed': self.failed}
+                    else:
+                        if request['backend'] not in self.backends:
+                            raise SynthesisError(f"알 수 없는 음성 엔진: {request['backend']}")
+                        job = (request['text'], request['voice'], float(request['speed']), request['backend'],
+                               bool(request.get('stretched')))
+                        future = self.submit(job, int(request.get('priority', 0)))
+                        response = {'path': await asyncio.shield(future)}
+                except Exception as e:
+                    response = {'error': f"{type(e).__name__}: {e}"}
+                writer.write((json.dumps(response, ensure_ascii=False) + '\n').encode('utf-8'))
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host='127.0.0.1', port=SYNTHESIS_WORKER_PORT, ready=None):
+        """요청을 받기 시작하고 멈출 때까지 실행"""
+        workers = [asyncio.ensure_future(self._run()) for _ in range(self.concurrency)]
+        server = await asyncio.start_server(self.handle, host, port)
+        if ready is not None:
+            ready(server)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            for task in workers:
+                task.cancel()
+
+class SynthesisWorkerClient:
+    """합성 작업자에게 요청을 보내고 캐시 경로를 받는 쪽 (요청마다 짧은 연결, 세션마다 이벤트 루프가 달라도 됨)"""
+
+    def __init__(self, address, timeout=SYNTHESIS_WORKER_TIMEOUT):
+        host, _, port = address.rpartition(':')
+        self.host = host or '127.0.0.1'
+        self.port = int(port or SYNTHESIS_WORKER_PORT)
+        self.timeout = timeout
+
+    async def request(self, payload):
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(self.host, self.port), 2.0)
+        try:
+            writer.write((json.dumps(payload, ensure_ascii=False) + '\n').encode('utf-8'))
+            await writer.drain()
+            line = await asyncio.wait_for(reader.readline(), self.timeout)
+        finally:
+            writer.close()
+        if not line:
+            raise ConnectionResetError("합성 작업자가 연결을 닫았습니다.")
+        return json.loads(line)
+
+    async def synthesize(self, text, voice, speed, backend, stretched=False, priority=0):
+        """음성을 만들어 캐시 경로 반환 (합성 실패는 SynthesisError, 연결 문제는 OSError)"""
+        response = await self.request({
+            'text': text, 'voice': voice, 'speed': float(speed), 'backend': backend,
+            'stretched': stretched, 'priority': priority
+        })
+        if 'error' in response:
+            raise SynthesisError(response['error'])
+        return response['path']
+
+@st.cache_resource(show_spinner=False)
+def get_synthesis_worker_client():
+    """설정된 합성 작업자 클라이언트 (EN600_SYNTH_WORKER가 없으면 None)"""
+    return SynthesisWorkerClient(SYNTHESIS_WORKER_ADDRESS) if SYNTHESIS_WORKER_ADDRESS else None
+
+class BackgroundLoop:
+    """별도 스레드에서 도는 asyncio 이벤트 루프 (재생 대기 중에도 음성 합성이 계속 진행됨)"""
+
+    def __init__(self, name='synthesis-loop'):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name=name, daemon=True)
+        self.thread.start()
+
+    def submit(self, coro):
+        """코루틴을 루프에 넣고 concurrent.futures.Future 반환"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+@st.cache_resource(show_spinner=False)
+def get_synthesis_loop():
+    """프로세스 공용 음성 합성 루프"""
+    return BackgroundLoop()
+
+class LessonPrefetcher:
+    """
+    현재 문장을 재생하는 동안 다음 문장들의 음성을 미리 합성.
+    미리 합성할 문장 수(depth)는 측정한 합성 지연과 문장당 재생 시간에 맞춰 조절한다.
+    """
+
+    def __init__(self, lesson_jobs, background, cache, concurrency=3, max_depth=8, stretcher=None, backends=None,
+                 profile='desktop'):
+        self.lesson_jobs = lesson_jobs  # 문장 번호 -> [(text, voice, speed), ...]
+        self.background = background
+        self.cache = cache
+        self.stretcher = stretcher
+        self.backends = backends
+        self.profile = profile  # 음성 전송 형식 (변형도 미리 만들어 둠)
+        self.concurrency = concurrency
+        self.max_depth = max_depth
+        self.depth = 2
+        self.futures = {}  # 작업 -> Future (학습 스레드와 합성 루프 스레드가 함께 쓰므로 _futures_lock으로 보호)
+        self._futures_lock = threading.Lock()
+        self._cancelled = False
+        self._semaphore = None
+        self._latency = None  # 음성 하나를 준비하는 데 걸린 시간 (지수 이동 평균, 초)
+        self._sentence_time = None  # 문장 하나를 재생하는 데 걸린 시간 (지수 이동 평균, 초)
+        self._last_advance = None
+
+    @staticmethod
+    def _ema(previous, value, alpha=0.3):
+        return value if previous is None else previous * (1 - alpha) + value * alpha
+
+    async def _synthesize(self, text, voice, speed, priority=0):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        if self.stretcher is not None and float(speed) != 1.0:
+            # 배속 변환 모드: 같은 문장의 1배속 음성을 한 번만 받도록 먼저 예약해 두고 기다림
+            # (세마포어를 잡기 전에 기다려야 변환 작업들이 1배속 작업의 자리를 막지 않음)
+            await asyncio.wrap_future(self._schedule((text, voice, 1.0), priority))
+        async with self._semaphore:
+            # 캐시 적중은 지연이 거의 0이므로 평균에 그대로 반영 (캐시가 채워질수록 depth가 줄어듦)
+            started = time.monotonic()
+            path = await get_voice_file(text, voice, speed, cache=self.cache, stretcher=self.stretcher,
+                                        backends=self.backends, priority=priority)
+            if path and AUDIO_PROFILES.get(self.profile) is not None:
+                path = await asyncio.to_thread(get_profile_variant, self.cache, path, self.profile)
+            if path:
+                self._latency = self._ema(self._latency, time.monotonic() - started)
+            return path
+
+    def _schedule(self, job, priority=0):
+        """priority: 지금 문장에서 몇 문장 뒤의 음성인지 (합성 작업자가 가까운 것부터 처리)"""
+        with self._futures_lock:
+            if self._cancelled:
+                # 취소된 뒤 합성 루프에서 들어온 예약 (배속 변환의 1배속 음성 등)은 새로 시작하지 않음
+                future = concurrent.futures.Future()
+                future.cancel()
+                return future
+            if job not in self.futures:
+                self.futures[job] = self.background.submit(self._synthesize(*job, priority))
+            return self.futures[job]
+
+    def _update_depth(self):
+        """depth = 합성 지연을 가릴 수 있는 문장 수 + 1"""
+        if self._latency is None or not self._sentence_time:
+            return
+        clips = max(1, max((len(jobs) for jobs in self.lesson_jobs), default=1))
+        needed = self._latency * clips / self.concurrency / self._sentence_time
+        self.depth = max(1, min(self.max_depth, math.ceil(needed) + 1))
+
+    def advance(self, index):
+        """index번 문장을 시작할 때 호출: 재생 시간을 측정하고 다음 문장들을 예약"""
+        now = time.monotonic()
+        if self._last_advance is not None and index > 0:
+            self._sentence_time = self._ema(self._sentence_time, now - self._last_advance)
+        self._last_advance = now
+        self._update_depth()
+        for i in range(index, min(index + 1 + self.depth, len(self.lesson_jobs))):
+            for job in self.lesson_jobs[i]:
+                self._schedule(job, i - index)
+
+    def ready_paths(self, index):
+        """index번 문장의 음성 중 이미 합성이 끝난 파일 경로"""
+        paths = []
+        for job in self.lesson_jobs[index] if 0 <= index < len(self.lesson_jobs) else []:
+            with self._futures_lock:
+                future = self.futures.get(job)
+            if future is not None and future.done() and not future.cancelled() and future.exception() is None:
+                if future.result():
+                    paths.append(future.result())
+        return paths
+
+    async def get(self, text, voice, speed):
+        """예약된 합성 결과를 기다려 파일 경로 반환 (예약되지 않았으면 지금 예약)"""
+        return await asyncio.wrap_future(self._schedule((text, voice, speed)))
+
+    def cancel(self):
+        """학습이 멈추면 아직 끝나지 않은 미리 합성 작업 취소"""
+        with self._futures_lock:
+            self._cancelled = True
+            futures = list(self.futures.values())
+            self.futures.clear()
+        for future in futures:
+            future.cancel()
+
+def plan_lesson_track(lang_data, settings, total_sentences, start_idx=0):
+    """
+    학습 루프와 같은 순서와 대기 규칙으로 레슨 전체의 재생 계획 생성.
+    항목: ('sentence', 문장 번호) / ('subtitle', [순위, 문장]) / ('clip', (text, voice, speed), next_sentence)
+          / ('file', 경로, next_sentence) / ('silence', 초) / ('break', 문장 수) / ('break_end', None)
+    """
+    plan = []
+    sentence_count = 0
+    for i in range(total_sentences):
+        plan.append(('sentence', start_idx + i + 1))
+        for rank, lang_key in [('first', 'first_lang'), ('second', 'second_lang'), ('third', 'third_lang')]:
+            lang = settings[lang_key]
+            if lang == 'none' or lang not in lang_data:
+                continue
+            text = lang_data[lang][i]
+            if not settings['hide_subtitles'][f'{rank}_lang'] and text:
+                plan.append(('silence', settings['subtitle_delay'] * rank_key_to_index(rank)))
+                plan.append(('subtitle', [rank, text]))
+            repeat = settings.get(f'{rank}_repeat', 0)
+            if repeat > 0:
+                voice = get_voice_mapping(lang, settings.get(f"{rank}_voice"))
+                if voice is None:
+                    plan.append(('silence', 1.0))
+                    continue
+                job = (text, voice, settings.get(f"{rank}_speed", 1.2))
+                plan.extend(('clip', job, False) for _ in range(repeat))
+        plan.append(('silence', settings['next_sentence_time']))
+
+        sentence_count += 1
+        if settings['break_enabled'] and sentence_count % settings['break_interval'] == 0:
+            plan.append(('break', settings['break_interval']))
+            break_sound_path = SCRIPT_DIR / 'base/break.wav'
+            if break_sound_path.exists():
+                plan.append(('file', str(break_sound_path), True))
+            plan.append(('clip', (BREAK_MESSAGE, VOICE_MAPPING['korean']['선희'], 1.0), True))
+            plan.append(('silence', max(0, settings['break_duration'] - 4)))
+            plan.append(('break_end', None))
+
+    final_sound_path = SCRIPT_DIR / 'base/final.wav'
+    if final_sound_path.exists():
+        plan.append(('file', str(final_sound_path), True))
+    return plan
+
+def _load_track_samples(path):
+    """음성 파일을 레슨 트랙 형식(모노 float32, LESSON_TRACK_SAMPLE_RATE)으로 디코딩"""
+    samples, sample_rate = sf.read(str(path), dtype='float32')
+    if samples.ndim > 1:
+        samples = samples.mean(axis=1)
+    if sample_rate != LESSON_TRACK_SAMPLE_RATE:
+        import librosa
+        samples = librosa.resample(samples, orig_sr=sample_rate, target_sr=LESSON_TRACK_SAMPLE_RATE)
+    return samples.astype(np.float32)
+
+def render_lesson_track(plan, clip_files, settings, profile='desktop'):
+    """
+    재생 계획을 하나의 음성 파일(전송 형식에 맞춰 인코딩)로 합치고 (음성 바이트, 확장자, 색인) 반환.
+    색인의 events는 자막/문장/휴식 표시 시각, chapters는 문장별 시작/끝 위치(초).
+    """
+    pieces = []
+    events = []
+    position = 0.0
+
+    def add_silence(seconds):
+        nonlocal position
+        frames = int(round(seconds * LESSON_TRACK_SAMPLE_RATE))
+        if frames > 0:
+            pieces.append(np.zeros(frames, dtype=np.float32))
+            position += frames / LESSON_TRACK_SAMPLE_RATE
+
+    for step in plan:
+        kind = step[0]
+        if kind in ('clip', 'file'):
+            path = clip_files.get(step[1]) if kind == 'clip' else step[1]
+            if not path:
+                # 음성 생성에 실패하면 학습 루프처럼 1초 쉬고 넘어감
+                add_silence(1.0)
+                continue
+            samples = _load_track_samples(path)
+            duration = len(samples) / LESSON_TRACK_SAMPLE_RATE
+            pieces.append(samples)
+            position += duration
+            add_silence(playback_wait_time(duration, settings['spacing'], step[2], settings) - duration)
+        elif kind == 'silence':
+            add_silence(step[1])
+        else:
+            events.append({'at': round(position, 3), 'type': kind, 'value': step[1]})
+
+    sentence_starts = [event for event in events if event['type'] == 'sentence']
+    chapters = [
+        {
+            'sentence': event['value'],
+            'start': event['at'],
+            'end': sentence_starts[n + 1]['at'] if n + 1 < len(sentence_starts) else round(position, 3)
+        }
+        for n, event in enumerate(sentence_starts)
+    ]
+
+    audio = np.concatenate(pieces) if pieces else np.zeros(1, dtype=np.float32)
+    audio_bytes, extension = encode_audio(np.clip(audio, -1.0, 1.0), LESSON_TRACK_SAMPLE_RATE, profile)
+    index = {'duration': round(position, 3), 'events': events, 'chapters': chapters}
+    return audio_bytes, extension, index
+
+def lesson_track_key(plan, settings, clip_keys, profile='desktop'):
+    """재생 계획(음성 캐시 키, 대기 설정, 전송 형식 포함)에 대한 레슨 트랙 캐시 키"""
+    steps = []
+    for step in plan:
+        if step[0] == 'clip':
+            steps.append(['clip', clip_keys.get(step[1]), step[2]])
+        elif step[0] == 'file':
+            # 알림음 파일이 다시 만들어지면 트랙도 새로 만들도록 크기와 수정 시각을 넣음
+            try:
+                stat = os.stat(step[1])
+                version = [stat.st_size, stat.st_mtime_ns]
+            except OSError:
+                version = None
+            steps.append(['file', step[1], version, step[2]])
+        else:
+            steps.append(list(step))
+    payload = json.dumps({
+        'version': LESSON_TRACK_VERSION,
+        'plan': steps,
+        'spacing': settings['spacing'],
+        'audio_wait_mode': settings.get('audio_wait_mode', 'duration'),
+        'fixed_wait_time': settings.get('fixed_wait_time', 2.0),
+        'profile': profile
+    }, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+async def gather_lesson_clips(plan, prefetcher, status=None):
+    """재생 계획에 필요한 음성을 모두 합성해 {(text, voice, speed): 경로} 반환 (실패한 음성은 None)"""
+    jobs = list(dict.fromkeys(step[1] for step in plan if step[0] == 'clip'))
+    futures = {job: asyncio.ensure_future(prefetcher.get(*job)) for job in jobs}
+    clip_files = {}
+    for done, job in enumerate(jobs, 1):
+        clip_files[job] = await futures[job]
+        if status is not None and (done % 10 == 0 or done == len(jobs)):
+            status.info(f"레슨 준비 중... 음성 {done}/{len(jobs)}")
+    return clip_files
+
+async def prepare_lesson_track(plan, settings, prefetcher, cache, status=None, profile='desktop'):
+    """
+    레슨 트랙을 캐시에서 찾거나, 필요한 음성을 모두 합성한 뒤 새로 만들어 (경로, 색인) 반환.
+    트랙은 원본 음성으로 만들고 전체를 한 번만 profile 형식으로 인코딩한다
+    (prefetcher는 변형을 만들지 않는 'desktop' 형식이어야 함 - 손실 압축을 두 번 거치지 않도록).
+    """
+    jobs = list(dict.fromkeys(step[1] for step in plan if step[0] == 'clip'))
+    primary = (prefetcher.backends or [EdgeTTSBackend()])[0]
+    stretched = prefetcher.stretcher is not None
+    key = lesson_track_key(plan, settings, {
+        job: clip_cache_key(*job, stretched=stretched, backend=primary) for job in jobs
+    }, profile)
+    index_key = hashlib.sha256(f"{key}:index".encode('utf-8')).hexdigest()
+    track_path, index_path = cache.get(key), cache.get(index_key)
+    if track_path is not None and index_path is not None:
+        with open(index_path, 'r', encoding='utf-8') as f:
+            return str(track_path), json.load(f)
+
+    clip_files = await gather_lesson_clips(plan, prefetcher, status)
+
+    # 대체 엔진으로 만든 음성이 섞였으면 실제 음성 키로 저장 (다음에는 기본 엔진으로 다시 시도)
+    actual_keys = {job: Path(path).stem if path else None for job, path in clip_files.items()}
+    key = lesson_track_key(plan, settings, actual_keys, profile)
+    index_key = hashlib.sha256(f"{key}:index".encode('utf-8')).hexdigest()
+
+    # 인코딩은 오래 걸리므로 다른 스레드에서
+    audio_bytes, extension, index = await asyncio.to_thread(
+        render_lesson_track, plan, clip_files, settings, profile
+    )
+    track_path = cache.put(key, audio_bytes, extension=extension)
+    cache.put(index_key, json.dumps(index, ensure_ascii=False).encode('utf-8'), extension='json')
+    return str(track_path), index
+
+def show_subtitle(subtitles, rank, text, settings):
+    """순위별 자막 표시"""
+    font_size = settings.get(f'{rank}_font_size', 32)
+    color = settings.get(f'{rank}_color', '#00FF00')
+    subtitles[rank_key_to_index(rank)].markdown(
+        f"""
+        <div class="{rank}-text" 
+             style="font-size: {font_size}px !important; color: {color};">
+            {text}
+        </div>
+        """,
+        unsafe_allow_html=True
+    )
+
+def lesson_speed_text(settings, lang_data):
+    """순위별 언어와 배속 (예: 영어 1.2배, 한국어 1배)"""
+    speed_display = []
+    for rank, lang_key in [('first', 'first_lang'), ('second', 'second_lang'), ('third', 'third_lang')]:
+        lang = settings[lang_key]
+        if lang != 'none' and lang in lang_data:
+            speed = settings.get(f"{rank}_speed", 1.2)
+            speed_text = str(int(speed)) if float(speed).is_integer() else f"{speed:.1f}"
+            speed_display.append(f"{LANG_DISPLAY.get(lang, lang)} {speed_text}배")
+    return ", ".join(speed_display)
+
+def sentence_status_html(sentence_number, settings, lang_data):
+    """현재 문장 번호와 순위별 배속 정보"""
+    return f'<div style="color: #00FF00;">No.{sentence_number:03d} ({lesson_speed_text(settings, lang_data)})</div>'
+
+async def follow_lesson_track(track_path, index, settings, lang_data, start_idx, progress, status, subtitles):
+    """레슨 트랙을 한 번 재생하고, 색인의 시각에 맞춰 진행률/자막/휴식 표시를 갱신"""
+    mixer_player = session_mixer_player(settings)
+    if mixer_player is not None:
+        mixer_player.play(track_path)
+    else:
+        st.markdown(audio_element_html(audio_source(track_path), audio_mime_type(track_path)), unsafe_allow_html=True)
+    started = time.monotonic()
+    total_sentences = max(1, len(index['chapters']))
+
+    for event in index['events']:
+        delay = event['at'] - (time.monotonic() - started)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        try:
+            if event['type'] == 'sentence':
+                progress.progress((event['value'] - start_idx) / total_sentences)
+                status.markdown(sentence_status_html(event['value'], settings, lang_data), unsafe_allow_html=True)
+            elif event['type'] == 'subtitle':
+                rank, text = event['value']
+                if rank_key_to_index(rank) < len(subtitles):
+                    show_subtitle(subtitles, rank, text, settings)
+            elif event['type'] == 'break':
+                status.warning(f"🔄 {event['value']}문장 완료! {settings['break_duration']}초간 휴식...")
+            elif event['type'] == 'break_end':
+                status.empty()
+        except Exception:
+            # 화면 갱신 실패는 재생에 영향 없음
+            continue
+
+    remaining = index['duration'] - (time.monotonic() - started)
+    if remaining > 0:
+        await asyncio.sleep(remaining)
+
+LESSON_PLAYER_HTML = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<style>
+    body { margin: 0; font-family: "Source Sans Pro", sans-serif; color: #FAFAFA; background: transparent; }
+    #bar { height: 6px; margin: 4px 0 8px; border-radius: 3px; overflow: hidden; background: rgba(151, 166, 195, 0.25); }
+    #fill { width: 0; height: 100%; background: #FF4B4B; }
+    #status { min-height: 1.5em; color: #00FF00; }
+    #notice { min-height: 1.5em; color: #FFD54F; }
+    #start { display: none; margin: 8px 0; padding: 8px 16px; font-size: 18px; }
+    .subtitle { min-height: 1.2em; margin: 10px 0; }
+</style>
+</head>
+<body>
+<div id="bar"><div id="fill"></div></div>
+<div id="status"></div>
+<div id="notice"></div>
+<button id="start">▶ 재생 시작</button>
+<div class="subtitle"></div>
+<div class="subtitle"></div>
+<div class="subtitle"></div>
+<script>
+(function () {
+    const fill = document.getElementById("fill");
+    const status = document.getElementById("status");
+    const notice = document.getElementById("notice");
+    const startButton = document.getElementById("start");
+    const subtitles = document.querySelectorAll(".subtitle");
+    const sleep = ms => new Promise(resolve => setTimeout(resolve, ms));
+    let lesson = null;
+    let generation = 0;
+    let lastReport = 0;
+    let clock = 0;
+    let current = null;
+    let preloaded = new Map();
+
+    function send(type, data) {
+        window.parent.postMessage(Object.assign({isStreamlitMessage: true, type: type}, data), "*");
+    }
+    function setHeight() {
+        send("streamlit:setFrameHeight", {height: document.body.scrollHeight + 8});
+    }
+    function report(value) {
+        lastReport = performance.now();
+        send("streamlit:setComponentValue", {value: Object.assign({lesson: lesson.id}, value), dataType: "json"});
+    }
+
+    // 앞으로 재생할 음성 몇 개만 미리 받아 두고 나머지는 놓아 줌
+    function audioFor(index) {
+        let audio = preloaded.get(index);
+        if (!audio) {
+            audio = new Audio(lesson.clips[index]);
+            audio.preload = "auto";
+            preloaded.set(index, audio);
+        }
+        return audio;
+    }
+    function preloadAfter(position, index) {
+        const keep = new Map([[index, audioFor(index)]]);
+        for (let p = position + 1; p < lesson.steps.length && keep.size <= lesson.lookahead; p++) {
+            const step = lesson.steps[p];
+            if (step[0] === "clip" && step[1] >= 0) {
+                keep.set(step[1], audioFor(step[1]));
+            }
+        }
+        preloaded = keep;
+        return keep.get(index);
+    }
+
+    async function play(audio) {
+        if (current && current !== audio) {
+            current.pause();
+        }
+        current = audio;
+        audio.currentTime = 0;
+        try {
+            await audio.play();
+        } catch (error) {
+            if (error.name !== "NotAllowedError") {
+                return;
+            }
+            // 브라우저가 자동 재생을 막으면 한 번 눌러서 시작
+            startButton.style.display = "inline-block";
+            setHeight();
+            await new Promise(resolve => { startButton.onclick = resolve; });
+            startButton.style.display = "none";
+            setHeight();
+            try { await audio.play(); } catch (ignored) {}
+        }
+        // 재생을 시작한 시각부터 대기 시간을 잼 (서버의 재생 후 대기와 같음)
+        clock = Math.max(clock, performance.now());
+    }
+    async function waitUntil(mine) {
+        const delay = clock - performance.now();
+        if (delay > 0) {
+            await sleep(delay);
+        }
+        return mine === generation;
+    }
+    function showSubtitle(index, text) {
+        const style = lesson.styles[index];
+        subtitles[index].textContent = text;
+        subtitles[index].style.fontSize = style.size + "px";
+        subtitles[index].style.color = style.color;
+        setHeight();
+    }
+
+    async function run(mine) {
+        for (let pass = 1; pass <= lesson.passes; pass++) {
+            notice.textContent = pass > 1 ? "반복 중... (" + (pass - 1) + "/" + lesson.passes + ")" : "";
+            clock = performance.now();
+            for (let p = 0; p < lesson.steps.length; p++) {
+                const step = lesson.steps[p];
+                if (step[0] === "sentence") {
+                    fill.style.width = (step[2] * 100) + "%";
+                    status.textContent = "No." + String(step[1]).padStart(3, "0") + " (" + lesson.speeds + ")";
+                    if (performance.now() - lastReport >= lesson.report_seconds * 1000) {
+                        report({sentence: step[1], pass: pass, done: false});
+                    }
+                } else if (step[0] === "subtitle") {
+                    showSubtitle(step[1], step[2]);
+                } else if (step[0] === "silence") {
+                    clock += step[1] * 1000;
+                    if (!await waitUntil(mine)) return;
+                } else if (step[0] === "clip") {
+                    if (step[1] < 0) {
+                        // 음성이 없으면 1초 쉬고 넘어감
+                        clock += 1000;
+                    } else {
+                        await play(preloadAfter(p, step[1]));
+                        clock += step[2] * 1000;
+                    }
+                    if (!await waitUntil(mine)) return;
+                } else if (step[0] === "break") {
+                    notice.textContent = step[1];
+                } else if (step[0] === "break_end") {
+                    notice.textContent = "";
+                }
+            }
+            report({pass: pass, done: pass === lesson.passes});
+        }
+        notice.textContent = "학습이 완료되었습니다!";
+    }
+
+    window.addEventListener("message", event => {
+        if (!event.data || event.data.type !== "streamlit:render") {
+            return;
+        }
+        const next = event.data.args.lesson;
+        // 진행 보고로 스크립트가 다시 실행되어도 같은 레슨이면 이어서 재생
+        if (lesson && lesson.id === next.id) {
+            return;
+        }
+        if (current) {
+            current.pause();
+        }
+        lesson = next;
+        preloaded = new Map();
+        lastReport = performance.now();
+        generation += 1;
+        setHeight();
+        run(generation);
+    });
+    send("streamlit:componentReady", {apiVersion: 1});
+})();
+</script>
+</body>
+</html>
+"""
+
+@st.cache_resource(show_spinner=False)
+def get_lesson_player():
+    """브라우저 레슨 플레이어 컴포넌트 (HTML을 캐시 폴더에 써서 등록)"""
+    index_path = PLAYER_COMPONENT_DIR / 'index.html'
+    html = LESSON_PLAYER_HTML.encode('utf-8')
+    if not index_path.exists() or index_path.read_bytes() != html:
+        atomic_write_bytes(index_path, html)
+    return components.declare_component('lesson_player', path=str(PLAYER_COMPONENT_DIR))
+
+def build_player_lesson(plan, clip_files, settings, lang_data, start_idx, total_sentences):
+    """
+    재생 계획을 브라우저 플레이어에 한 번에 넘길 레슨 데이터로 변환.
+    음성은 URL로, 음성마다의 대기 시간은 서버에서 play_audio와 같은 규칙으로 계산해 넣는다.
+    """
+    cache = get_audio_cache()
+    clips, clip_index, steps = [], {}, []
+    for step in plan:
+        kind = step[0]
+        if kind in ('clip', 'file'):
+            path = clip_files.get(step[1]) if kind == 'clip' else step[1]
+            if not path:
+                steps.append(['clip', -1, 1.0])
+                continue
+            if path not in clip_index:
+                clip_index[path] = len(clips)
+                clips.append(audio_source(path))
+            info = cache.info_for_path(path)
+            duration = info['duration'] if info is not None else AudioCache.probe(path)[0]
+            wait = playback_wait_time(duration or 2.0, settings['spacing'], step[2], settings)
+            steps.append(['clip', clip_index[path], round(wait, 3)])
+        elif kind == 'sentence':
+            steps.append(['sentence', step[1], round((step[1] - start_idx) / total_sentences, 4)])
+        elif kind == 'subtitle':
+            rank, text = step[1]
+            steps.append(['subtitle', rank_key_to_index(rank), text])
+        elif kind == 'break':
+            steps.append(['break', f"🔄 {step[1]}문장 완료! {settings['break_duration']}초간 휴식..."])
+        else:
+            steps.append(list(step))
+
+    lesson = {
+        'clips': clips,
+        'steps': steps,
+        'speeds': lesson_speed_text(settings, lang_data),
+        'styles': [
+            {'size': settings.get(f'{rank}_font_size', 32), 'color': settings.get(f'{rank}_color', '#00FF00')}
+            for rank in ('first', 'second', 'third')
+        ],
+        'passes': int(settings['repeat_count']) if settings.get('auto_repeat') else 1,
+        'report_seconds': PLAYER_REPORT_SECONDS,
+        'lookahead': PLAYER_LOOKAHEAD
+    }
+    payload = json.dumps(lesson, ensure_ascii=False, sort_keys=True)
+    lesson['id'] = hashlib.sha256(payload.encode('utf-8')).hexdigest()[:16]
+    return lesson
+
+def show_lesson_player(lesson, settings, progress=None):
+    """
+    브라우저 플레이어에 레슨을 넘기고 바로 돌아옴 (재생/자막/휴식은 브라우저에서 진행).
+    가끔 오는 진행 보고로 학습 시간을 기록하고 완료를 처리한다.
+    """
+    if progress is not None:
+        # 진행률은 플레이어 안에 표시
+        progress.empty()
+    report = get_lesson_player()(lesson=lesson, key=f"lesson_player_{lesson['id']}", default=None)
+    if not report or report.get('lesson') != lesson['id']:
+        return
+    record_study_time()
+    if report.get('done') and settings.get('auto_repeat'):
+        st.success(f"학습이 완료되었습니다! (총 {settings['repeat_count']}회 반복)")
+        st.session_state.page = 'settings'
+        st.rerun()
+
 def create_learning_ui():
     """학습 화면 UI 생성"""
     
@@ -1181,6 +4526,8 @@ async def create_break_audio():
 
 async def start_learning():
     """학습 시작"""
+    prefetcher = None
+    mixer_player = None
     try:
         settings = st.session_state.settings
         
@@ -1203,96 +4550,152 @@ async def start_learning():
                     # 음성 목록이 비어있거나 오류가 발생한 경우 처리
                     settings[voice_key] = None  # None으로 설정하여 자막만 표시하도록 함
 
+        # 브라우저 재생 모드: 진행 보고로 다시 실행된 경우 만들어 둔 레슨을 그대로 넘김 (데이터를 다시 읽지 않음)
+        browser_mode = settings.get('playback_mode', 'clips') == 'browser'
+        if browser_mode:
+            lesson_signature = hashlib.sha256(json.dumps(
+                [settings, get_workbook_fingerprint()], ensure_ascii=False, sort_keys=True, default=str
+            ).encode('utf-8')).hexdigest()
+            browser_lesson = st.session_state.get('browser_lesson')
+            if browser_lesson is not None and browser_lesson[0] == lesson_signature:
+                progress, status, subtitles, speed_info = create_learning_ui()
+                show_lesson_player(browser_lesson[1], settings, progress)
+                return
+
         sentence_count = 0
         repeat_count = 0
         
-        # 선택된 시트의 데이터 읽기
-        df = pd.read_excel(
-            EXCEL_PATH,
-            sheet_name=settings.get('selected_sheet', 0),
-            header=0,
-            engine='openpyxl'
-        )
-
         start_idx = settings['start_row'] - 1
         end_idx = settings['end_row'] - 1
 
-        # 열 이름 매핑 - 모든 시트에서 일관된 열 이름 사용을 위한 매핑
-        column_mapping = {
-            'english': 'en-미국',
-            'korean': 'ko-한국',
-            'chinese': 'zh-중국',
-            'vietnamese': 'vi-베트남',
-            'japanese': 'ja-일본',
-            'thai': 'th-태국',
-            'filipino': 'tl-필리핀',
-            'russian': 'ru-러시아',
-            'uzbek': 'uz-우즈벡',
-            'mongolian': 'mn-몽골',
-            'nepali': 'ne-네팔',
-            'burmese': 'my-미얀마',
-            'indonesian': 'id-인니',
-            'khmer': 'km-캄보디아'
-        }
+        # 이번 학습에 쓰는 언어 (순위 순서)
+        lesson_langs = []
+        for lang_key in ('first_lang', 'second_lang', 'third_lang'):
+            lang = settings.get(lang_key)
+            if lang and lang != 'none' and lang not in lesson_langs:
+                lesson_langs.append(lang)
 
         # 언어별 데이터 저장
         lang_data = {}
-        
-        # 엑셀 시트의 열 이름 확인
-        available_columns = df.columns.tolist()
-        
-        for lang, col in column_mapping.items():
-            # 해당 열이 있는지 확인
-            if col in available_columns:
-                lang_data[lang] = df[col].iloc[start_idx:end_idx+1].tolist()
+        selected_sheet = settings.get('selected_sheet', 0)
+
+        if is_corpus_cache_ready():
+            # 코퍼스를 읽을 때 만든 언어 -> 열 인덱스 사용 (머리글을 다시 검사하지 않음)
+            sheet_info = get_sheet_info(selected_sheet)
+            columns = sheet_info['columns']
+            column_index = sheet_info['column_index']
+        else:
+            columns, column_index = None, None
+
+        if settings.get('sheet_reader_mode', 'cache') == 'stream' or column_index is None:
+            # 스트리밍 모드: 이번 학습에 쓰는 언어 열과 행 범위만 원본 XML에서 읽기
+            if column_index is not None:
+                wanted = [columns[column_index[lang]] for lang in lesson_langs if column_index.get(lang) is not None]
+                columns, streamed = stream_sheet_rows(selected_sheet, wanted, settings['start_row'], settings['end_row'])
             else:
-                # 열이 없으면 빈 데이터로 초기화
-                lang_data[lang] = [""] * (end_idx - start_idx + 1)
-                print(f"Warning: Column '{col}' not found in the selected sheet. Using empty data for {lang}.")
-
-        # 최소한 영어와 한국어 데이터는 있어야 함
-        if not lang_data.get('english') or all(not text for text in lang_data.get('english', [])):
-            # 영어 데이터가 없으면 첫 번째 열을 영어로 간주
-            first_col = available_columns[0]
-            lang_data['english'] = df[first_col].iloc[start_idx:end_idx+1].tolist()
-            print(f"Using column '{first_col}' as English data.")
-            
-        if not lang_data.get('korean') or all(not text for text in lang_data.get('korean', [])):
-            # 한국어 데이터가 없으면 두 번째 열을 한국어로 간주
-            if len(available_columns) > 1:
-                second_col = available_columns[1]
-                lang_data['korean'] = df[second_col].iloc[start_idx:end_idx+1].tolist()
-                print(f"Using column '{second_col}' as Korean data.")
-
-        total_sentences = len(lang_data['english']) if 'english' in lang_data else 0
+                # 캐시가 아직 없으면 범위 안의 모든 열을 읽어 인덱스를 직접 만듦
+                header, _ = stream_sheet_rows(selected_sheet, [], 1, 0)
+                columns, streamed = stream_sheet_rows(selected_sheet, header, settings['start_row'], settings['end_row'])
+                column_index = build_column_index(columns, streamed)
+
+            def fetch_rows(col):
+                return streamed[col]
+        else:
+            # 캐시 모드: 메모리 매핑된 문장 저장소 (세션 간 공유)
+            store = get_sentence_store(selected_sheet)
+
+            def fetch_rows(col):
+                return store.get_rows(col, start_idx, end_idx)
+
+        # 찾을 수 없는 언어는 빈 자막으로 대체하지 않고 오류로 알림
+        missing = [lang for lang in lesson_langs if column_index.get(lang) is None]
+        if missing:
+            raise MissingLanguageColumnError(
+                f"선택한 시트에 {', '.join(LANG_DISPLAY.get(lang, lang) for lang in missing)} 열이 없습니다."
+            )
+
+        for lang in lesson_langs:
+            # 행 범위만 참조, 복사 없음
+            lang_data[lang] = fetch_rows(columns[column_index[lang]])
+
+        total_sentences = len(lang_data[lesson_langs[0]]) if lesson_langs else 0
         if total_sentences == 0:
             st.error("선택한 시트에서 데이터를 찾을 수 없습니다.")
             return
 
         # 학습 UI 생성
         progress, status, subtitles, speed_info = create_learning_ui()
+        audio_slot = st.empty()  # 음성 플레이어 자리 (새 음성이 이전 음성을 대신함)
+        mixer_player = session_mixer_player(settings)
+        if settings.get('audio_playback_method') == 'pygame' and mixer_player is None:
+            st.warning("서버 스피커를 다른 세션이 쓰고 있거나 사용할 수 없어 브라우저로 재생합니다.")
+
+        # 문장별로 합성할 음성 목록 (미리 합성용)
+        lesson_jobs = []
+        for i in range(total_sentences):
+            jobs = []
+            for rank, lang_key in [('first', 'first_lang'), ('second', 'second_lang'), ('third', 'third_lang')]:
+                lang = settings[lang_key]
+                if lang != 'none' and lang in lang_data and settings.get(f'{rank}_repeat', 0) > 0:
+                    voice = get_voice_mapping(lang, settings.get(f"{rank}_voice"))
+                    text = lang_data[lang][i]
+                    if voice and text and not text.isspace():
+                        job = (text, voice, settings.get(f"{rank}_speed", 1.2))
+                        if job not in jobs:
+                            jobs.append(job)
+            lesson_jobs.append(jobs)
+        stretcher = get_clip_stretcher() if settings.get('speed_mode', 'tts') == 'stretch' else None
+        backends = get_tts_backends(settings)
+        track_mode = settings.get('playback_mode', 'clips') == 'track'
+        # 레슨 트랙 모드는 원본 음성을 합쳐 트랙 전체를 한 번만 인코딩하므로 음성별 변형을 만들지 않음
+        prefetcher = LessonPrefetcher(lesson_jobs, get_synthesis_loop(), get_audio_cache(),
+                                      stretcher=stretcher, backends=backends,
+                                      profile='desktop' if track_mode else detect_audio_profile(settings))
+
+        # 브라우저 재생 모드: 필요한 음성을 모두 준비한 뒤 레슨 전체를 브라우저에 넘기고 바로 끝냄
+        if browser_mode and reachable_media_server()[0] is None:
+            status.warning("브라우저에서 음성 서버에 접근할 수 없어 음성마다 따로 재생합니다.")
+            browser_mode = False
+        if browser_mode:
+            status.info("레슨 준비 중...")
+            plan = plan_lesson_track(lang_data, settings, total_sentences, start_idx)
+            clip_files = await gather_lesson_clips(plan, prefetcher, status)
+            lesson = build_player_lesson(plan, clip_files, settings, lang_data, start_idx, total_sentences)
+            st.session_state.browser_lesson = (lesson_signature, lesson)
+            status.empty()
+            show_lesson_player(lesson, settings, progress)
+            return
+
+        # 레슨 트랙 모드: 레슨 전체를 한 파일로 만들어 한 번에 재생
+        lesson_track = None
+        if track_mode:
+            status.info("레슨 트랙 준비 중...")
+            lesson_track = await prepare_lesson_track(
+                plan_lesson_track(lang_data, settings, total_sentences, start_idx),
+                settings, prefetcher, get_audio_cache(), status, profile=detect_audio_profile(settings)
+            )
+            status.empty()
 
         # 학습 반복 처리
         while True:
-            for i in range(total_sentences):
+            if lesson_track is not None:
+                await follow_lesson_track(*lesson_track, settings, lang_data, start_idx, progress, status, subtitles)
+
+            # 문장별 재생 (레슨 트랙 모드에서는 위에서 이미 재생했으므로 건너뜀)
+            for i in range(total_sentences if lesson_track is None else 0):
                 # 진행률 업데이트
                 progress.progress((i + 1) / total_sentences)
+                
+                # 현재 문장을 재생하는 동안 다음 문장들의 음성을 미리 합성
+                prefetcher.advance(i)
+                if mixer_player is not None:
+                    # 서버 스피커 재생: 이번 문장과 다음 문장의 준비된 음성을 미리 디코딩
+                    for path in prefetcher.ready_paths(i) + prefetcher.ready_paths(i + 1):
+                        mixer_player.preload(path, playback_gap(clip_duration(path), settings['spacing'], False, settings))
 
                 # 현재 문장 번호와 배속 정보 표시
                 sentence_number = start_idx + i + 1
-                speed_display = []
-                
-                # 각 순위별 처리
-                for rank, lang_key in [('first', 'first_lang'), ('second', 'second_lang'), ('third', 'third_lang')]:
-                    lang = settings[lang_key]
-                    if lang != 'none' and lang in lang_data:
-                        # 배속 정보 표시
-                        speed_key = f"{rank}_speed"
-                        speed = settings.get(speed_key, 1.2)
-                        speed_text = str(int(speed)) if speed.is_integer() else f"{speed:.1f}"
-                        speed_display.append(f"{LANG_DISPLAY.get(lang, lang)} {speed_text}배")
-
-                status.markdown(f'<div style="color: #00FF00;">No.{sentence_number:03d} ({", ".join(speed_display)})</div>', unsafe_allow_html=True)
+                status.markdown(sentence_status_html(sentence_number, settings, lang_data), unsafe_allow_html=True)
 
                 # 각 순위별 처리
                 for rank, lang_key in [('first', 'first_lang'), ('second', 'second_lang'), ('third', 'third_lang')]:
@@ -1308,17 +4711,7 @@ async def start_learning():
                             if text and rank_key_to_index(rank) < len(subtitles):
                                 try:
                                     await asyncio.sleep(settings['subtitle_delay'] * rank_key_to_index(rank))
-                                    font_size = settings.get(f'{rank}_font_size', 32)
-                                    color = settings.get(f'{rank}_color', '#00FF00')
-                                    subtitles[rank_key_to_index(rank)].markdown(
-                                        f"""
-                                        <div class="{rank}-text" 
-                                             style="font-size: {font_size}px !important; color: {color};">
-                                            {text}
-                                        </div>
-                                        """,
-                                        unsafe_allow_html=True
-                                    )
+                                    show_subtitle(subtitles, rank, text, settings)
                                 except Exception:
                                     # 오류 발생 시 경고 없이 계속 진행
                                     await asyncio.sleep(1)
@@ -1339,14 +4732,10 @@ async def start_learning():
                                         await asyncio.sleep(1)
                                         break
                                     
-                                    # 음성 파일 생성 및 재생
-                                    audio_file = await get_voice_file(
-                                        text=text,
-                                        voice=voice,
-                                        speed=speed
-                                    )
+                                    # 음성 파일 생성(미리 합성된 결과 사용) 및 재생
+                                    audio_file = await prefetcher.get(text, voice, speed)
                                     if audio_file:
-                                        play_audio(audio_file, settings['spacing'], False)
+                                        await play_audio_async(audio_file, settings['spacing'], False, container=audio_slot)
                                     else:
                                         # 음성 파일 생성 실패 시 자막만 표시하고 계속 진행
                                         await asyncio.sleep(1)
@@ -1367,13 +4756,12 @@ async def start_learning():
                         # 1. 먼저 break.wav 알림음 재생
                         break_sound_path = SCRIPT_DIR / 'base/break.wav'
                         if break_sound_path.exists():
-                            play_audio(str(break_sound_path), 0, True)
+                            await play_audio_async(str(break_sound_path), 0, True, container=audio_slot)
                         
                         # 2. 브레이크 음성 메시지 생성 및 재생
-                        break_msg = "쉬어가는 시간입니다, 5초간의 호흡을 느껴보세요"
-                        break_audio = await get_voice_file(break_msg, VOICE_MAPPING['korean']['선희'], 1.0)
+                        break_audio = await prefetcher.get(BREAK_MESSAGE, VOICE_MAPPING['korean']['선희'], 1.0)
                         if break_audio:
-                            play_audio(break_audio, 0, True)
+                            await play_audio_async(break_audio, 0, True, container=audio_slot)
                         
                         # 3. 남은 휴식 시간 대기
                         remaining_time = max(0, settings['break_duration'] - 4)  # 알림음과 메시지 재생 시간을 고려
@@ -1390,19 +4778,12 @@ async def start_learning():
             # 학습 완료 시
             try:
                 # 마지막 시간 업데이트
-                current_time = time.time()
-                time_diff = current_time - st.session_state.last_update_time
-                if time_diff >= 60:
-                    minutes_to_add = int(time_diff / 60)
-                    st.session_state.today_total_study_time += minutes_to_add
-                    st.session_state.last_update_time = current_time
-                    # 학습 시간 저장
-                    save_study_time()
+                record_study_time()
                 
-                # final.wav 재생
+                # final.wav 재생 (레슨 트랙에는 이미 들어 있음)
                 final_sound_path = SCRIPT_DIR / 'base/final.wav'
-                if final_sound_path.exists():
-                    play_audio(str(final_sound_path), 0, True)
+                if lesson_track is None and final_sound_path.exists():
+                    await play_audio_async(str(final_sound_path), 0, True, container=audio_slot)
                 
                 if settings['auto_repeat']:
                     repeat_count += 1
@@ -1422,44 +4803,49 @@ async def start_learning():
                 # 오류 발생 시 경고 없이 계속 진행
                 break  # 오류 발생 시 루프 종료
 
+    except MissingLanguageColumnError as e:
+        st.error(str(e))
     except Exception as e:
         # 학습 중 심각한 오류만 표시
         st.error("학습 중 오류가 발생했습니다. 설정을 확인하고 다시 시도해주세요.")
+    finally:
+        # 학습 종료/중단 시 남은 미리 합성 작업 취소
+        if prefetcher is not None:
+            prefetcher.cancel()
+        # 서버 스피커로 재생 중이던 음성도 멈춤
+        if mixer_player is not None:
+            mixer_player.stop(mixer_owner_id())
 
 def get_column_data(df, column_name, start_idx, end_idx):
-    """메모리 효율적인 데이터 로드"""
-    try:
-        if column_name in df.columns:
-            # 청크 단위로 데이터 로드 (메모리 사용량 감소)
-            chunk_size = 100
-            result = []
-            for chunk_start in range(start_idx, end_idx + 1, chunk_size):
-                chunk_end = min(chunk_start + chunk_size, end_idx + 1)
-                chunk = df.loc[chunk_start:chunk_end-1, column_name].tolist()
-                result.extend(chunk)
-            return result
+    """
+    메모리 효율적인 데이터 로드 (SentenceStore는 복사 없이 행 범위만 반환).
+    column_name은 열 이름 또는 언어 이름('english' 등)이며, 찾을 수 없으면 MissingLanguageColumnError.
+    """
+    if column_name not in df.columns:
+        # 언어 이름(또는 'en-미국' 같은 머리글)을 열 인덱스로 해석
+        lang = column_name if column_name in LANGUAGE_CODES else _language_from_header(column_name)
+        if isinstance(df, SentenceStore):
+            column_index = df.column_index
         else:
-            # 열 이름이 없는 경우 대체 열 찾기 시도
-            # 열 이름에 언어 코드가 포함되어 있는지 확인
-            for col in df.columns:
-                col_str = str(col).lower()
-                if column_name.startswith('en') and ('en' in col_str or 'english' in col_str or '영어' in col_str or '미국' in col_str):
-                    return get_column_data(df, col, start_idx, end_idx)
-                elif column_name.startswith('ko') and ('ko' in col_str or 'korean' in col_str or '한국' in col_str or '한글' in col_str):
-                    return get_column_data(df, col, start_idx, end_idx)
-                elif column_name.startswith('zh') and ('zh' in col_str or 'chinese' in col_str or '중국' in col_str):
-                    return get_column_data(df, col, start_idx, end_idx)
-                elif column_name.startswith('ja') and ('ja' in col_str or 'japanese' in col_str or '일본' in col_str):
-                    return get_column_data(df, col, start_idx, end_idx)
-                elif column_name.startswith('vi') and ('vi' in col_str or 'vietnamese' in col_str or '베트남' in col_str):
-                    return get_column_data(df, col, start_idx, end_idx)
-                # 다른 언어에 대한 매핑도 추가
-            
-            # 대체 열을 찾지 못한 경우 빈 데이터 반환
-            return [""] * (end_idx - start_idx + 1)
-    except Exception as e:
-        # 오류 발생 시 경고 없이 빈 데이터 반환
-        return [""] * (end_idx - start_idx + 1)
+            columns = [str(col) for col in df.columns]
+            column_index = build_column_index(columns, {col: df[orig].dropna().astype(str).head(200).tolist()
+                                                        for col, orig in zip(columns, df.columns)})
+        position = column_index.get(lang) if lang else None
+        if position is None:
+            raise MissingLanguageColumnError(f"'{column_name}' 열을 찾을 수 없습니다.")
+        column_name = df.columns[position]
+
+    if isinstance(df, SentenceStore):
+        return df.get_rows(column_name, start_idx, end_idx)
+
+    # 청크 단위로 데이터 로드 (메모리 사용량 감소)
+    chunk_size = 100
+    result = []
+    for chunk_start in range(start_idx, end_idx + 1, chunk_size):
+        chunk_end = min(chunk_start + chunk_size, end_idx + 1)
+        chunk = df.loc[chunk_start:chunk_end-1, column_name].tolist()
+        result.extend(chunk)
+    return result
 
 def create_personalized_ui():
     """개인별 맞춤 UI 생성"""
@@ -1512,26 +4898,41 @@ def main():
     elif st.session_state.page == 'settings_from_learning':
         create_settings_ui(return_to_learning=True)
 
-def save_settings(settings):
-    """설정값을 파일에 저장"""
+def save_settings(settings, force=True):
+    """
+    설정값을 사용자 저장소에 저장. 세션에서 마지막으로 저장한 값과 비교해 바뀐 키만 한 트랜잭션으로 기록한다.
+    force=False이면 마지막 저장 후 SETTINGS_SAVE_DEBOUNCE초 안의 변경을 모아 두었다가 그 시간이 끝날 때 기록
+    """
     try:
-        with open(SETTINGS_PATH, 'w', encoding='utf-8') as f:
-            json.dump(settings, f, ensure_ascii=False, indent=2)
+        saver = st.session_state.get('settings_saver')
+        if saver is None:
+            saver = st.session_state.settings_saver = SettingsSaver(
+                get_user_store(), st.session_state.get('user_id', DEFAULT_USER_ID), {}, get_synthesis_loop())
+        saver.save(settings, force)
     except Exception as e:
         st.error(f"설정 저장 중 오류: {e}")
 
-def save_study_time():
-    """학습 시간을 파일에 저장"""
-    study_time_path = SCRIPT_DIR / 'study_time.json'
+def save_study_time(minutes):
+    """학습 시간(분)을 사용자 저장소에 이벤트로 추가"""
     try:
-        with open(study_time_path, 'w') as f:
-            json.dump({
-                'date': st.session_state.today_date,
-                'time': st.session_state.today_total_study_time
-            }, f)
+        get_user_store().add_study_minutes(
+            st.session_state.get('user_id', DEFAULT_USER_ID), st.session_state.today_date, minutes,
+            current_session_id()
+        )
     except Exception as e:
         st.error(f"학습 시간 저장 중 오류: {e}")
 
+def record_study_time():
+    """마지막 기록 이후 지난 시간을 분 단위로 오늘 학습 시간에 더해 저장"""
+    current_time = time.time()
+    time_diff = current_time - st.session_state.last_update_time
+    if time_diff >= 60:
+        minutes_to_add = int(time_diff / 60)
+        st.session_state.today_total_study_time += minutes_to_add
+        st.session_state.last_update_time = current_time
+        # 학습 시간 저장
+        save_study_time(minutes_to_add)
+
 def get_setting(key, default_value):
     """안전하게 설정값을 가져오는 유틸리티 함수"""
     return st.session_state.settings.get(key, default_value)
@@ -1550,10 +4951,8 @@ def save_learning_state(df, current_index, session_state):
             'last_sentence': df.iloc[current_index]['english'] if current_index < len(df) else ""
         }
         
-        # 파일 저장
-        save_path = TEMP_DIR / 'learning_state.json'
-        with open(save_path, 'w', encoding='utf-8') as f:
-            json.dump(state_data, f, ensure_ascii=False, indent=2)
+        # 사용자 저장소에 저장
+        get_user_store().save_checkpoint(st.session_state.get('user_id', DEFAULT_USER_ID), 'learning_state', state_data)
             
         st.success(f"학습 상태가 저장되었습니다. (진행률: {state_data['progress']})")
         
@@ -1572,14 +4971,10 @@ def load_learning_state():
     학습 상태 불러오기 함수 개선
     """
     try:
-        save_path = TEMP_DIR / 'learning_state.json'
-        
-        if not save_path.exists():
+        state_data = get_user_store().load_checkpoint(st.session_state.get('user_id', DEFAULT_USER_ID), 'learning_state')
+        if state_data is None:
             return None
             
-        with open(save_path, 'r', encoding='utf-8') as f:
-            state_data = json.load(f)
-            
         # 저장된 데이터 검증
         required_keys = ['current_index', 'timestamp', 'total_rows']
         if not all(key in state_data for key in required_keys):
@@ -1657,5 +5052,201 @@ def rank_key_to_index(rank):
     rank_mapping = {'first': 0, 'second': 1, 'third': 2}
     return rank_mapping.get(rank, 0)
 
+def load_saved_settings(user_id=DEFAULT_USER_ID):
+    """사용자의 저장된 설정 읽기 (없거나 읽을 수 없으면 빈 설정)"""
+    try:
+        return migrate_settings(get_user_store().load_settings(user_id))
+    except Exception:
+        return {}
+
+def build_render_jobs(store, langs, speeds, voices, start_row=1, end_row=None):
+    """시트의 (문장, 음성, 배속) 조합 목록 생성 (중복 제거, 학습 화면과 같은 캐시 키가 되도록 구성)"""
+    end_row = end_row or store.rows
+    jobs = []
+    seen = set()
+    for lang in langs:
+        texts = store.get_rows(store.language_column(lang), start_row - 1, end_row - 1)
+        for text in texts:
+            if not text or text.isspace():
+                continue
+            for voice in voices[lang]:
+                for speed in speeds:
+                    job = (text, voice, speed)
+                    if job not in seen:
+                        seen.add(job)
+                        jobs.append(job)
+    return jobs
+
+async def render_audio_jobs(jobs, cache, workers=4, retries=2, progress_path=None, log=print, stretcher=None,
+                            backend=None):
+    """
+    여러 작업자로 음성을 합성해 캐시에 저장 (기본 엔진: edge-tts).
+    재시도·제한 시간·서킷 브레이커는 ResilientTTSBackend가 맡으며,
+    서버 장애로 요청이 차단된 동안의 작업은 실패로 기록되어 다음 실행에서 다시 시도된다.
+    이미 캐시에 있는 조합은 건너뛰므로 중단 후 다시 실행하면 이어서 진행된다.
+    stretcher가 있으면 (문장, 음성)마다 1배속만 합성하고 나머지 배속은 로컬에서 변환한다.
+    """
+    backend = backend or ResilientTTSBackend(EdgeTTSBackend(), retries=retries, max_inflight=workers)
+    stretched = stretcher is not None
+    pending = [job for job in jobs
+               if not cache.contains(clip_cache_key(*job, stretched=stretched, backend=backend))]
+    progress = {
+        'total': len(jobs),
+        'cached': len(jobs) - len(pending),
+        'rendered': 0,
+        'failed': [],
+        'started': time.time()
+    }
+    log(f"전체 {progress['total']}개 중 {progress['cached']}개는 이미 캐시에 있음, {len(pending)}개 생성")
+
+    def save_progress():
+        if progress_path is not None:
+            progress['updated'] = time.time()
+            atomic_write_json(progress_path, progress)
+
+    async def render_clip(text, voice, speed):
+        """음성 하나를 캐시에 만들고 경로 반환 (실패하면 예외)"""
+        return await synthesize_clip(text, voice, speed, cache, backend, stretcher)
+
+    # 같은 (문장, 음성)의 배속들은 한 작업자가 차례로 처리 (배속 변환 모드에서 1배속 합성이 한 번만 일어남)
+    groups = {}
+    for text, voice, speed in pending:
+        groups.setdefault((text, voice), []).append(speed)
+    queue = asyncio.Queue()
+    for (text, voice), speeds in groups.items():
+        queue.put_nowait((text, voice, speeds))
+
+    async def worker():
+        while True:
+            try:
+                text, voice, speeds = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            for speed in speeds:
+                try:
+                    await render_clip(text, voice, speed)
+                    progress['rendered'] += 1
+                except Exception as e:
+                    progress['failed'].append({'text': text, 'voice': voice, 'speed': speed, 'error': repr(e)})
+                done = progress['rendered'] + len(progress['failed'])
+                if done % 25 == 0 or done == len(pending):
+                    log(f"  {done}/{len(pending)} (실패 {len(progress['failed'])})")
+                    save_progress()
+
+    await asyncio.gather(*(worker() for _ in range(max(1, workers))))
+    progress['finished'] = time.time()
+    save_progress()
+    return progress
+
+def render_command(argv):
+    """
+    헤드리스 일괄 음성 생성: 시트 전체를 지정한 언어/음성/배속으로 미리 합성해 음성 캐시에 저장.
+    예) python en600_pro.py render --sheet 0 --langs english,korean --speeds 1.0,1.5,2.0
+    """
+    parser = argparse.ArgumentParser(prog='en600_pro.py render', description='시트 전체 음성을 미리 생성해 캐시에 저장')
+    parser.add_argument('--sheet', default='0', help='시트 이름 또는 순번 (기본: 첫 시트)')
+    parser.add_argument('--langs', required=True, help='쉼표로 구분한 언어 (예: english,korean)')
+    parser.add_argument('--speeds', help='쉼표로 구분한 배속 (기본: 저장된 설정의 순위별 배속)')
+    parser.add_argument('--voices', help='언어=음성 목록 (예: english=Jenny+Guy,korean=선희, 기본: 저장된 설정의 음성)')
+    parser.add_argument('--start', type=int, default=1, help='시작 행 (1부터)')
+    parser.add_argument('--end', type=int, help='종료 행 (기본: 마지막 행)')
+    parser.add_argument('--workers', type=int, default=4, help='동시 합성 작업자 수')
+    parser.add_argument('--retries', type=int, default=2, help='실패 시 재시도 횟수')
+    parser.add_argument('--backend', choices=list(TTS_BACKENDS), default='edge',
+                        help='음성 엔진 (edge: 온라인 edge-tts, local: 오프라인 로컬 합성)')
+    parser.add_argument('--speed-mode', choices=['tts', 'stretch'],
+                        help='tts: 배속마다 edge-tts 요청, stretch: 1배속만 받아 로컬에서 배속 변환 (기본: 저장된 설정)')
+    parser.add_argument('--user', default=DEFAULT_USER_ID, help='기본 음성/배속을 가져올 사용자 (기본: default)')
+    args = parser.parse_args(argv)
+
+    settings = load_saved_settings(args.user)
+    sheet = int(args.sheet) if args.sheet.isdigit() else args.sheet
+    langs = [lang.strip() for lang in args.langs.split(',') if lang.strip()]
+    unknown = [lang for lang in langs if lang not in VOICE_MAPPING]
+    if unknown:
+        parser.error(f"음성을 지원하지 않는 언어: {', '.join(unknown)}")
+
+    # 학습 화면과 같은 (음성, 배속) 조합이 되도록 저장된 설정의 순위별 값을 기본으로 사용
+    ranks = [rank for rank in ('first', 'second', 'third') if settings.get(f'{rank}_lang') in langs]
+    if args.speeds:
+        speeds = [float(speed) for speed in args.speeds.split(',')]
+    else:
+        speeds = sorted({float(settings.get(f'{rank}_speed', 1.2)) for rank in ranks} or {1.2})
+
+    voices = {}
+    requested = {}
+    for item in (args.voices or '').split(','):
+        if '=' in item:
+            lang, names = item.split('=', 1)
+            requested[lang.strip()] = [name.strip() for name in names.split('+') if name.strip()]
+    for lang in langs:
+        if lang in requested:
+            names = requested[lang]
+        else:
+            names = [settings.get(f'{rank}_voice') for rank in ranks if settings.get(f'{rank}_lang') == lang] or [None]
+        # 표시 이름('Jenny') 또는 edge-tts 음성 이름('en-US-JennyNeural') 모두 허용
+        mapped = [name if name in VOICE_MAPPING[lang].values() else get_voice_mapping(lang, name) for name in names]
+        voices[lang] = list(dict.fromkeys(voice for voice in mapped if voice))
+
+    try:
+        store = get_sentence_store(sheet)
+        sheet_name = get_sheet_info(sheet)['name']
+        jobs = build_render_jobs(store, langs, speeds, voices, args.start, args.end)
+    except (KeyError, IndexError, MissingLanguageColumnError) as e:
+        print(f"오류: {e}", file=sys.stderr)
+        return 2
+
+    speed_mode = args.speed_mode or settings.get('speed_mode', 'tts')
+    print(f"시트 '{sheet_name}' · 언어 {', '.join(langs)} · 배속 {', '.join(f'{speed:g}' for speed in speeds)} "
+          f"({speed_mode}, {args.backend})")
+    for lang in langs:
+        print(f"  {LANG_DISPLAY.get(lang, lang)} 음성: {', '.join(voices[lang])}")
+
+    run_key = hashlib.sha256(json.dumps([sheet_name, langs, speeds, voices, args.start, args.end, speed_mode,
+                                         args.backend],
+                                        ensure_ascii=False).encode('utf-8')).hexdigest()[:16]
+    progress_path = RENDER_PROGRESS_DIR / f"{run_key}.json"
+    cache = AudioCache()
+    stretcher = ClipStretcher() if speed_mode == 'stretch' else None
+    backend = ResilientTTSBackend(TTS_BACKENDS[args.backend](), retries=args.retries, max_inflight=args.workers)
+    progress = asyncio.run(render_audio_jobs(jobs, cache, args.workers, args.retries, progress_path,
+                                             stretcher=stretcher, backend=backend))
+
+    elapsed = progress['finished'] - progress['started']
+    print(f"완료: 새로 생성 {progress['rendered']}개, 캐시 재사용 {progress['cached']}개, "
+          f"실패 {len(progress['failed'])}개 ({elapsed:.0f}초)")
+    for failure in progress['failed'][:20]:
+        print(f"  실패: [{failure['voice']} x{failure['speed']:g}] {failure['text'][:40]} - {failure['error']}")
+    if len(progress['failed']) > 20:
+        print(f"  ... 외 {len(progress['failed']) - 20}개 (전체 목록: {progress_path})")
+    if cache.evictions:
+        print(f"경고: 캐시 한도({cache.max_bytes // (1024 * 1024)}MB)를 넘어 {cache.evictions}개가 삭제되었습니다. "
+              "EN600_AUDIO_CACHE_MB를 늘려 주세요.")
+    return 1 if progress['failed'] else 0
+
+def worker_command(argv):
+    """
+    독립 합성 작업자 실행: 여러 앱 프로세스의 합성 요청을 모아 처리 (앱은 EN600_SYNTH_WORKER=주소:포트로 연결).
+    예) python en600_pro.py worker --port 8765 --rate 10
+    """
+    parser = argparse.ArgumentParser(prog='en600_pro.py worker', description='음성 합성 작업자 실행')
+    parser.add_argument('--host', default='127.0.0.1', help='받을 주소 (기본: 127.0.0.1)')
+    parser.add_argument('--port', type=int, default=SYNTHESIS_WORKER_PORT, help=f'포트 (기본: {SYNTHESIS_WORKER_PORT})')
+    parser.add_argument('--concurrency', type=int, default=TTS_MAX_INFLIGHT, help='동시 합성 수')
+    parser.add_argument('--rate', type=float, default=10.0, help='초당 최대 합성 요청 수 (캐시 적중은 제외)')
+    args = parser.parse_args(argv)
+
+    worker = SynthesisWorker(AudioCache(), concurrency=args.concurrency, rate=args.rate)
+    print(f"합성 작업자 시작: {args.host}:{args.port} (동시 {args.concurrency}개, 초당 {args.rate:g}개)", flush=True)
+    try:
+        asyncio.run(worker.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
 if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == 'render':
+        sys.exit(render_command(sys.argv[2:]))
+    if len(sys.argv) > 1 and sys.argv[1] == 'worker':
+        sys.exit(worker_command(sys.argv[2:]))
     main()
@@ -0,0 +1,45 @@
+import numpy as np
+import pandas as pd
+
+import en600_pro
+
+
+def build_index(tmp_path, frames):
+    path = tmp_path / 'search_index.npz'
+    en600_pro.write_search_index(path, frames)
+    return en600_pro.SearchIndex(path)
+
+
+def rows(docs):
+    return sorted({(doc >> en600_pro.SEARCH_ROW_SHIFT) & en600_pro.SEARCH_ROW_MASK for doc in docs.tolist()})
+
+
+def test_single_character_query_matches_end_of_run(tmp_path):
+    frame = pd.DataFrame({
+        'chinese': ['你好吗', '吗', '吗你好', '你好', '好吗？'],
+        'korean': ['안녕하세요', '좋아요', '요리', '안녕', '갑니다'],
+    })
+    index = build_index(tmp_path, [frame])
+
+    assert rows(index.search('吗')[0]) == [0, 1, 2, 4]
+    assert rows(index.search('요')[0]) == [0, 1, 2]
+    assert rows(index.search('다')[0]) == [4]
+
+
+def test_multi_character_query_still_uses_bigrams(tmp_path):
+    frame = pd.DataFrame({'korean': ['안녕하세요', '하세', '세요 안녕']})
+    index = build_index(tmp_path, [frame])
+
+    docs, runs = index.search('하세요')
+    assert rows(docs) == [0]
+    assert runs == ['하세요']
+
+
+def test_word_query_is_prefix_matched(tmp_path):
+    frame = pd.DataFrame({'english': ['Hello there', 'Help me', 'Good morning']})
+    index = build_index(tmp_path, [frame])
+
+    assert rows(index.search('hel')[0]) == [0, 1]
+    assert rows(index.search('good morn')[0]) == [2]
+    assert len(index.search('nothing')[0]) == 0
+    assert index.search('')[0].dtype == np.int64
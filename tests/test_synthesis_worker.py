@@ -0,0 +1,79 @@
+import asyncio
+
+import en600_pro
+
+
+class CountingWorker(en600_pro.SynthesisWorker):
+    """합성 대신 호출 횟수만 세는 작업자"""
+
+    def __init__(self, concurrency=4):
+        super().__init__(cache=None, concurrency=concurrency)
+        self.calls = []
+
+    async def _process(self, job):
+        self.calls.append(job)
+        await asyncio.sleep(0.05)
+        return f"/cache/{job[0]}.mp3"
+
+
+def run_worker(worker, scenario):
+    async def main():
+        runners = [asyncio.ensure_future(worker._run()) for _ in range(worker.concurrency)]
+        try:
+            return await scenario(), runners
+        finally:
+            await asyncio.sleep(0)
+            dead = [task for task in runners if task.done()]
+            for task in runners:
+                task.cancel()
+            assert not dead, [task.exception() for task in dead]
+    return asyncio.run(main())
+
+
+def test_duplicate_submits_are_processed_once():
+    worker = CountingWorker()
+    job = ('hello', 'en-US-GuyNeural', 1.0, 'edge', False)
+
+    async def scenario():
+        futures = [worker.submit(job, priority) for priority in (3, 2, 1)]
+        return await asyncio.gather(*futures)
+
+    results, _ = run_worker(worker, scenario)
+    assert results == ['/cache/hello.mp3'] * 3
+    assert worker.calls == [job]
+    assert worker.completed == 1 and worker.coalesced == 2 and worker.failed == 0
+    assert not worker.pending and not worker.queued and not worker.in_flight
+
+
+def test_duplicate_submit_while_in_flight_is_not_requeued():
+    worker = CountingWorker()
+    job = ('hi', 'en-US-GuyNeural', 1.0, 'edge', False)
+
+    async def scenario():
+        first = worker.submit(job, 5)
+        await asyncio.sleep(0.01)  # 첫 요청이 합성 중일 때 더 급한 요청이 옴
+        second = worker.submit(job, 0)
+        return await asyncio.gather(first, second)
+
+    results, _ = run_worker(worker, scenario)
+    assert results == ['/cache/hi.mp3'] * 2
+    assert worker.calls == [job]
+    assert worker.queue.qsize() == 0
+
+
+def test_failure_is_delivered_to_every_waiter():
+    class FailingWorker(CountingWorker):
+        async def _process(self, job):
+            await super()._process(job)
+            raise en600_pro.SynthesisError("boom")
+
+    worker = FailingWorker()
+    job = ('x', 'en-US-GuyNeural', 1.0, 'edge', False)
+
+    async def scenario():
+        futures = [worker.submit(job, priority) for priority in (2, 1)]
+        return await asyncio.gather(*futures, return_exceptions=True)
+
+    results, _ = run_worker(worker, scenario)
+    assert all(isinstance(result, en600_pro.SynthesisError) for result in results)
+    assert worker.calls == [job] and worker.failed == 1